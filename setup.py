@@ -30,6 +30,8 @@ setup(
         'console_scripts': [
             'input_generation=perturbopy.generate_input:input_generation',
             'run-tests=perturbopy.tests_use:main',
+            'repack_cdyna=perturbopy.postproc.utils.cdyna_tools:repack_cdyna_cli',
+            'restart_cdyna=perturbopy.postproc.utils.cdyna_tools:restart_cdyna_cli',
         ],
     },
 )
@@ -4,7 +4,7 @@ Suite of Python scripts for the Perturbo code testing and postprocessing.
 
 from .calc_modes.calc_mode import CalcMode
 from .calc_modes.bands import Bands
-from .calc_modes.spectral_cumulant import SpectralCumulant
+from .calc_modes.spectral_cumulant import SpectralCumulant, AkwArray
 from .calc_modes.spins import Spins
 from .calc_modes.phdisp import Phdisp
 from .calc_modes.ephmat import Ephmat
@@ -17,9 +17,11 @@ from .calc_modes.dyna_pp import DynaPP
 
 from .dbs.units_dict import UnitsDict
 from .dbs.recip_pt_db import RecipPtDB
+from .dbs.kgrid_index import KGridIndex
+from .dbs.transition_energies import TransitionEnergies
 
 from .utils import constants, plot_tools, lattice, spectra_generate_pulse, \
-    timing, spectra_trans_abs, spectra_plots
+    timing, spectra_trans_abs, spectra_plots, snapshots, cdyna_tools, lineshapes
 
 import warnings
 import os
@@ -13,14 +13,20 @@ class DynaIndivRun():
     time_step : float
         Time step in fs
 
-    snap_t : np.ndarray
-        Distribution function computed at each time step
+    snap_t : np.ndarray or SnapshotArray
+        Distribution function computed at each time step. Shape: (num_bands, num_kpoints, num_steps).
+        SnapshotArray if the snapshots are read lazily from the HDF5 file.
+        If a subset of steps was loaded, the last axis follows steps.
+
+    steps : np.ndarray
+        Indices N of the snap_t_N snapshots along the time axis of snap_t.
+        Default is all the steps: 1, ..., num_steps.
 
     efield : np.ndarray
         Electric field assumed during the calculation. Default value is [0, 0, 0].
     """
 
-    def __init__(self, num_steps, time_step, snap_t, time_units='fs', efield=None):
+    def __init__(self, num_steps, time_step, snap_t, time_units='fs', efield=None, steps=None):
         """
         Constructor method
         
@@ -30,6 +36,8 @@ class DynaIndivRun():
         time_step : float
             Time step in fs
         snap_t : array_like
+        steps : array_like, optional
+            Indices N of the snap_t_N snapshots loaded in snap_t.
 
         """
 
@@ -37,3 +45,16 @@ class DynaIndivRun():
         self.time_step = time_step
         self.snap_t = snap_t
         self.efield = efield
+
+        if steps is None:
+            steps = np.arange(1, num_steps + 1)
+
+        self.steps = np.asarray(steps, dtype=int)
+
+    @property
+    def times(self):
+        """
+        Times (fs) of the snapshots of snap_t, from the beginning of the run.
+        """
+
+        return self.steps * self.time_step
@@ -2,6 +2,7 @@ import numpy as np
 import os
 from perturbopy.postproc.calc_modes.calc_mode import CalcMode
 from perturbopy.io_utils.io import open_yaml, open_hdf5, close_hdf5
+from perturbopy.postproc.utils.snapshots import PopuArray, read_popu_shared, CONSOLIDATED_POPU_DSET
 
 
 class DynaPP(CalcMode):
@@ -23,19 +24,32 @@ class DynaPP(CalcMode):
     energy_units : str
         Units for the energy_grid attribute
 
-    popu : np.ndarray
-        Array of shape num_times x num_energies containing carrier populations over the energy_grid and times.
+    popu : np.ndarray or PopuArray
+        Array of shape num_energies x num_times containing carrier populations over the energy_grid and times.
+        With lazy=True, a PopuArray reading only the sliced times from the HDF5 file.
+
+    _popu_file : h5py.File
+        The popu HDF5 file, kept open with lazy=True only.
 
     """
 
-    def __init__(self, popu_file, pert_dict):
+    def __init__(self, popu_file, pert_dict, lazy=False, n_workers=None):
         """
         Constructor method
         
         Parameters
         ----------
+        popu_file : h5py.File
+            The prefix_popu.h5 file of the dynamics-pp calculation.
+
         pert_dict : dict
             Dictionary containing the inputs and outputs from the dynamics-pp calculation.
+
+        lazy : bool, optional
+            If True, popu is a PopuArray reading the populations on demand, and popu_file is kept open.
+
+        n_workers : int, optional
+            Number of worker processes reading the popu_tN datasets (eager loading of the per-time layout).
         """
         super().__init__(pert_dict)
 
@@ -47,10 +61,25 @@ class DynaPP(CalcMode):
         self.energy_units = 'ev'
         self.energy_grid = popu_file['energy_grid_ev'][()]
 
-        self.popu = np.zeros((len(self.energy_grid), len(self.times)))
+        num_times = len(self.times)
+        group = popu_file['energy_distribution']
 
-        for itime, time in enumerate(self.times):
-            self.popu[:, itime] = popu_file['energy_distribution'][f'popu_t{itime}'][()]
+        if lazy:
+            self._popu_file = popu_file
+            self.popu = PopuArray(group, num_times)
+
+        elif CONSOLIDATED_POPU_DSET in group:
+            self._popu_file = None
+            self.popu = group[CONSOLIDATED_POPU_DSET][()]
+
+        elif n_workers is not None and n_workers > 1 and num_times > 1:
+            self._popu_file = None
+            print(f'Reading populations with {n_workers} workers...')
+            self.popu = read_popu_shared(popu_file.filename, num_times, n_workers)
+
+        else:
+            self._popu_file = None
+            self.popu = PopuArray(group, num_times).read_times(np.arange(num_times))
 
         if 'concentration' in pert_dict['dynamics-pp'].keys():
             self.conc = pert_dict['dynamics-pp'].pop('concentration')
@@ -67,7 +96,7 @@ class DynaPP(CalcMode):
             self.drift_vel_units = None
 
     @classmethod
-    def from_hdf5_yaml(cls, popu_path, yaml_path='pert_output.yml'):
+    def from_hdf5_yaml(cls, popu_path, yaml_path='pert_output.yml', lazy=False, n_workers=None):
         """
         Class method to create a DynamicsRunCalcMode object from the HDF5 file and YAML file
         generated by a Perturbo calculation
@@ -78,6 +107,10 @@ class DynaPP(CalcMode):
            Path to the HDF5 file generated by a dynamics-pp calculation
         yaml_path : str, optional
            Path to the YAML file generated by a dynamics-pp calculation
+        lazy : bool, optional
+           If True, read the populations on demand. The HDF5 file stays open until close_hdf5_files is called.
+        n_workers : int, optional
+           Number of worker processes reading the populations (eager loading only)
 
         Returns
         -------
@@ -94,4 +127,24 @@ class DynaPP(CalcMode):
         popu_file = open_hdf5(popu_path)
         yaml_dict = open_yaml(yaml_path)
 
-        return cls(popu_file, yaml_dict)
+        try:
+            dyna_pp = cls(popu_file, yaml_dict, lazy=lazy, n_workers=n_workers)
+        except BaseException:
+            close_hdf5(popu_file)
+            raise
+
+        # The populations are in memory, the file is not needed anymore
+        if not lazy:
+            close_hdf5(popu_file)
+
+        return dyna_pp
+
+    def close_hdf5_files(self):
+        """
+        Method to close the HDF5 file kept open with lazy=True. The lazy popu array cannot be read afterwards.
+        """
+
+        if self._popu_file:
+            close_hdf5(self._popu_file)
+
+        self._popu_file = None
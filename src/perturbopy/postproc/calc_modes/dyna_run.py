@@ -1,11 +1,19 @@
 import os
+import multiprocessing
 import numpy as np
 import warnings
+from concurrent.futures import ProcessPoolExecutor
 from perturbopy.postproc.calc_modes.calc_mode import CalcMode
 from perturbopy.postproc.dbs.recip_pt_db import RecipPtDB
+from perturbopy.postproc.dbs.kgrid_index import KGridIndex
 from perturbopy.postproc.calc_modes.dyna_indiv_run import DynaIndivRun
 from perturbopy.io_utils.io import open_yaml, open_hdf5, close_hdf5
 from perturbopy.postproc.utils.timing import Timing, TimingGroup
+from perturbopy.postproc.utils.snapshots import SnapshotArray, MemmapSnapshotArray, prefetch, read_snaps_shared, \
+    subset_index, read_snap, snap_steps
+from perturbopy.postproc.utils.constants import energy_conversion_factor, length_conversion_factor, hbar, \
+    boltzmann
+from perturbopy.postproc.utils.cdyna_tools import snap_dataset_options, print_storage_size
 from perturbopy.postproc.dbs.units_dict import UnitsDict
 
 # for plotting
@@ -15,14 +23,14 @@ from perturbopy.postproc.utils.plot_tools import plotparams
 plt.rcParams.update(plotparams)
 
 
+# Observables of DynaRun.observables
+OBSERVABLES = ('carrier_number', 'mean_energy', 'temperature', 'chem_potential')
+
+
 class DynaRun(CalcMode):
     """
     Class representation of a Perturbo dynamics-run calculation.
 
-    TODO: better handling with snaps. Make it as property.
-    Print a sensible message if snaps is None and access is attempted.
-    Implement a getter and setter for snaps linked to HDF5 file.
-
     Attributes
     ----------
     kpt : RecipPtDB
@@ -40,11 +48,25 @@ class DynaRun(CalcMode):
         Raw array of k-points. Shape (num_kpoints, 3)
     _energies : array
         Raw array of band energies. Shape (num_kpoints, num_bands)
+    _kgrid : KGridIndex
+        Integer index of _kpoints on the boltz_kdim grid, created on the first access to kgrid.
+    _transition_energies : dict
+        Cache of the TransitionEnergies objects with hole DynaRun objects, see TransitionEnergies.from_dyna_runs.
+    _band_index : np.ndarray or None
+        Columns of _energies (bands) loaded in snap_t, None if all the bands are loaded.
+    _kpoint_index : np.ndarray or None
+        Rows of _kpoints and _energies loaded in snap_t, None if all the k-points are loaded.
+    _snap_array_class : type
+        SnapshotArray class of the snap_backend, used for the lazy access to the snapshots.
+    _snap_dtype : np.dtype
+        Data type of the snapshots.
     _dat : dict
         Python dictionary of DynaIndivRun objects containing results from each simulation
     """
 
-    def __init__(self, cdyna_file, tet_file, pert_dict, read_snaps=True):
+    def __init__(self, cdyna_file, tet_file, pert_dict, read_snaps=True, snap_cache_size=16, n_workers=None,
+                 snap_backend='h5py', snap_dtype=np.float64, time_stride=1, time_window=None, times=None,
+                 band_index=None, kpoint_index=None):
         """
         Constructor method
 
@@ -63,11 +85,53 @@ class DynaRun(CalcMode):
         read_snaps : bool, optional
             Flag to read the snapshots from the HDF5 file.
             Reading the snapshots can be time-consuming and memory-intensive.
+            If False, snap_t of each run is a lazy SnapshotArray backed by the open HDF5 file.
+
+        snap_cache_size : int, optional
+            Number of snapshots kept in memory by the lazy SnapshotArray (read_snaps=False).
+
+        n_workers : int, optional
+            Number of worker processes reading the snapshots (read_snaps=True), see read_snaps_shared.
+            Each worker reads a range of steps into shared memory, snap_t is a view of it.
+            If None or 1, the snapshots are read in the current process.
+
+        snap_backend : str, optional
+            Reader of the lazy snapshot arrays (read_snaps=False): 'h5py' (SnapshotArray) or
+            'memmap' (MemmapSnapshotArray), which maps the contiguous, uncompressed snapshots written by Perturbo
+            into memory and falls back to h5py for the other layouts.
+
+        snap_dtype : np.dtype, optional
+            Data type of snap_t, e.g. np.float32 to halve its memory.
+
+        time_stride : int, optional
+            Load every time_stride-th step. Default is all the steps.
+
+        time_window : tuple of float, optional
+            (t_min, t_max) in fs, from the beginning of each run: load the steps within this window.
+
+        times : array_like, optional
+            Times in fs, from the beginning of each run: load the steps closest to these times.
+
+        band_index : array_like, optional
+            Bands to load: indices of the columns of _energies, or boolean mask. Default is all.
+
+        kpoint_index : array_like, optional
+            K-points to load: indices of the rows of _energies, or boolean mask,
+            e.g. an energy window np.any((_energies > emin) & (_energies < emax), axis=1). Default is all.
+
+            The selections are applied while reading: the other occupations are never kept in memory.
+            The raw arrays (_energies, _kpoints) and the other attributes are not reduced.
+            The loaded steps of each run are stored in DynaIndivRun.steps.
 
         """
 
         self.timings = TimingGroup("dynamics-run")
 
+        snap_array_classes = {'h5py': SnapshotArray, 'memmap': MemmapSnapshotArray}
+
+        if snap_backend not in snap_array_classes:
+            raise ValueError(f"Unknown snap_backend '{snap_backend}'. Options: {list(snap_array_classes.keys())}")
+
         self.read_snaps = read_snaps
 
         super().__init__(pert_dict)
@@ -103,41 +167,70 @@ class DynaRun(CalcMode):
         # Raw arrays
         self._kpoints = kpoint
         self._energies = energies
+        self._kgrid = None
+        self._band_velocities = None
+        self._transition_energies = {}
+
+        self._band_index = subset_index(band_index, energies.shape[1], 'band_index')
+        self._kpoint_index = subset_index(kpoint_index, energies.shape[0], 'kpoint_index')
+
+        self._snap_array_class = snap_array_classes[snap_backend]
+        self._snap_dtype = snap_dtype
 
         self._data = {}
 
         self.num_runs = cdyna_file['num_runs'][()]
 
-        with self.timings.add('iterate_dyna') as t:
+        executor = None
+        if read_snaps and n_workers is not None and n_workers > 1:
+            executor = ProcessPoolExecutor(max_workers=n_workers, mp_context=multiprocessing.get_context('spawn'))
 
-            for irun in range(1, self.num_runs + 1):
-                dyn_str = f'dynamics_run_{irun}'
+        try:
+            with self.timings.add('iterate_dyna') as t:
 
-                num_steps = cdyna_file[dyn_str]['num_steps'][()]
-                time_step = cdyna_file[dyn_str]['time_step_fs'][()]
+                for irun in range(1, self.num_runs + 1):
+                    dyn_str = f'dynamics_run_{irun}'
 
-                # a dynamics run must have at least one snap
-                numk, numb = cdyna_file[dyn_str]['snap_t_1'][()].shape
+                    num_steps = cdyna_file[dyn_str]['num_steps'][()]
+                    time_step = cdyna_file[dyn_str]['time_step_fs'][()]
 
-                if read_snaps:
-                    print(f'Reading snapshots for {dyn_str}...')
-                    snap_t = np.zeros((numb, numk, num_steps), dtype=np.float64)
+                    steps = select_steps(num_steps, time_step, time_stride, time_window, times)
 
-                    for itime in range(num_steps):
-                        snap_t[:, :, itime] = cdyna_file[dyn_str][f'snap_t_{itime + 1}'][()].T
-                else:
-                    snap_t = None
+                    # Snapshots can be stored as snap_t_N datasets or in the consolidated layout
+                    snap_t = self._snap_array_class(cdyna_file[dyn_str], steps, cache_size=snap_cache_size,
+                                                    dtype=snap_dtype, band_index=self._band_index,
+                                                    kpoint_index=self._kpoint_index)
 
-                # Get E-field, which is only present if nonzero
-                if "efield" in cdyna_file[dyn_str].keys():
-                    efield = cdyna_file[dyn_str]["efield"][()]
-                else:
-                    efield = np.array([0.0, 0.0, 0.0])
+                    if read_snaps and executor is not None:
+                        print(f'Reading snapshots for {dyn_str} with {n_workers} workers...')
+                        # Shared memory (num_steps, num_kpoints, num_bands) -> view (num_bands, num_kpoints, num_steps)
+                        snap_t = read_snaps_shared(cdyna_file.filename, dyn_str, steps, n_workers,
+                                                   dtype=snap_dtype, executor=executor,
+                                                   band_index=self._band_index,
+                                                   kpoint_index=self._kpoint_index).transpose(2, 1, 0)
+
+                    elif read_snaps:
+                        print(f'Reading snapshots for {dyn_str}...')
+                        snap_t.cache_size = 0
+                        snap_t = snap_t[:, :, :]
 
-                self._data[irun] = DynaIndivRun(num_steps, time_step, snap_t, time_units='fs', efield=efield)
+                    # Get E-field, which is only present if nonzero
+                    if "efield" in cdyna_file[dyn_str].keys():
+                        efield = cdyna_file[dyn_str]["efield"][()]
+                    else:
+                        efield = np.array([0.0, 0.0, 0.0])
+
+                    self._data[irun] = DynaIndivRun(num_steps, time_step, snap_t, time_units='fs', efield=efield,
+                                                    steps=steps)
+
+        finally:
+            if executor is not None:
+                executor.shutdown()
 
     @classmethod
-    def from_hdf5_yaml(cls, cdyna_path, tet_path, yaml_path='pert_output.yml', read_snaps=True):
+    def from_hdf5_yaml(cls, cdyna_path, tet_path, yaml_path='pert_output.yml', read_snaps=True, snap_cache_size=16,
+                       n_workers=None, snap_backend='h5py', snap_dtype=np.float64, time_stride=1, time_window=None,
+                       times=None, band_index=None, kpoint_index=None):
         """
         Class method to create a DynamicsRunCalcMode object from the HDF5 file and YAML file
         generated by a Perturbo calculation
@@ -150,6 +243,18 @@ class DynaRun(CalcMode):
            Path to the HDF5 file generated by the setup calculation required before the dynamics-run calculation
         yaml_path : str, optional
            Path to the YAML file generated by a dynamics-run calculation
+        read_snaps : bool, optional
+           Flag to read all the snapshots into memory. If False, the snapshots are read lazily.
+        snap_cache_size : int, optional
+           Number of snapshots kept in memory by the lazy snapshot arrays.
+        n_workers : int, optional
+           Number of worker processes reading the snapshots into shared memory (read_snaps=True).
+           Scripts using it must be guarded by if __name__ == '__main__'.
+        snap_backend : str, optional
+           Reader of the lazy snapshot arrays: 'h5py' or 'memmap' (memory map of the contiguous snapshots).
+        snap_dtype, time_stride, time_window, times, band_index, kpoint_index : optional
+           Loading options of the snapshots (data type, selection of steps, bands and k-points),
+           applied while reading. See DynaRun.
 
         Returns
         -------
@@ -169,7 +274,9 @@ class DynaRun(CalcMode):
         cdyna_file = open_hdf5(cdyna_path)
         tet_file = open_hdf5(tet_path)
 
-        return cls(cdyna_file, tet_file, yaml_dict, read_snaps=read_snaps)
+        return cls(cdyna_file, tet_file, yaml_dict, read_snaps=read_snaps, snap_cache_size=snap_cache_size,
+                   n_workers=n_workers, snap_backend=snap_backend, snap_dtype=snap_dtype, time_stride=time_stride,
+                   time_window=time_window, times=times, band_index=band_index, kpoint_index=kpoint_index)
 
     def close_hdf5_files(self):
         """
@@ -246,6 +353,516 @@ class DynaRun(CalcMode):
 
         return text
 
+    @property
+    def kgrid(self):
+        """
+        Integer index of the k-points on the boltz_kdim grid, used to match the k-points
+        of different calculations (e.g. electrons and holes). Created once and cached.
+
+        Returns
+        -------
+        kgrid : KGridIndex
+        """
+
+        if self._kgrid is None:
+            self._kgrid = KGridIndex(self._kpoints, self.boltz_kdim)
+
+        return self._kgrid
+
+    @property
+    def band_velocities(self):
+        """
+        Band velocities v = dE/dk / hbar on the k-points of the calculation, in cm/s, Cartesian coordinates.
+        Computed once and cached, see compute_band_velocities.
+
+        Returns
+        -------
+        band_velocities : np.ndarray
+            Shape (num_kpoints, num_bands, 3).
+        """
+
+        if self._band_velocities is None:
+            self._band_velocities = self.compute_band_velocities()
+
+        return self._band_velocities
+
+    def compute_band_velocities(self):
+        """
+        Compute the band velocities by periodic finite differences of the band energies on the boltz_kdim grid.
+        The neighbors of each k-point along the reciprocal lattice vectors are found with the integer
+        index of the grid (see KGridIndex.neighbor_table). Central differences are used when both neighbors
+        are in the k-point set, one-sided differences at the boundaries of the energy window,
+        and the derivative is zero along a direction without neighbors.
+
+        The bands are differentiated by index, so the velocities are not accurate near band crossings.
+
+        Returns
+        -------
+        band_velocities : np.ndarray
+            Band velocities in cm/s, Cartesian coordinates. Shape (num_kpoints, num_bands, 3).
+        """
+
+        with self.timings.add('band_velocities') as t:
+            neighbors = self.kgrid.neighbor_table()
+            energies = self._energies
+
+            # Derivatives with respect to the crystal coordinates, in Ry
+            grad_cryst = np.zeros(energies.shape + (3,))
+
+            for i in range(3):
+                has_plus = neighbors[:, i, 0] >= 0
+                has_minus = neighbors[:, i, 1] >= 0
+
+                e_plus = np.where(has_plus[:, None], energies[neighbors[:, i, 0]], energies)
+                e_minus = np.where(has_minus[:, None], energies[neighbors[:, i, 1]], energies)
+
+                step = (has_plus.astype(float) + has_minus) / self.boltz_kdim[i]
+                np.divide(e_plus - e_minus, step[:, None], out=grad_cryst[:, :, i], where=step[:, None] > 0)
+
+            # k_cart = recip_lat @ k_cryst, so grad_cart = inv(recip_lat.T) @ grad_cryst; in Ry * alat / (2 pi)
+            grad_cart = grad_cryst @ np.linalg.inv(self.recip_lat)
+
+            alat_cm = self.alat * length_conversion_factor(self.alat_units, 'bohr') * \
+                length_conversion_factor('bohr', 'm') * 100.0
+
+            factor = energy_conversion_factor('Ry', 'eV') * alat_cm / (2 * np.pi) / hbar('ev*s')
+
+        return grad_cart * factor
+
+    def _lazy_snaps(self, irun, cache_size=0):
+        """
+        Lazy snapshot array of the dynamics run irun, reading directly from _cdyna_file.
+        Same steps, band and k-point subsets, data type and backend as snap_t.
+
+        Parameters
+        ----------
+        irun : int
+            Index of the dynamics run, starting from 1.
+
+        cache_size : int, optional
+            Number of snapshots kept in the LRU cache. Default is no caching (streaming access).
+
+        Returns
+        -------
+        snap_t : SnapshotArray
+            Array-like object of shape (num_bands, num_kpoints, num_steps).
+        """
+
+        if irun <= 0 or irun > self.num_runs:
+            raise IndexError("Index out of range")
+
+        if not self._cdyna_file:
+            raise ValueError('The dynamics HDF5 file (prefix_cdyna.h5) is closed.')
+
+        return self._snap_array_class(self._cdyna_file[f'dynamics_run_{irun}'], self._data[irun].steps,
+                                      cache_size=cache_size, dtype=self._snap_dtype, band_index=self._band_index,
+                                      kpoint_index=self._kpoint_index)
+
+    def iter_snaps(self, irun=1, start=0, stop=None, step=1, chunk=64, prefetch_depth=1):
+        """
+        Iterate over the snapshots of a dynamics run in time order, chunk by chunk.
+        The next chunk is read from the HDF5 file in a background thread
+        while the current one is processed.
+
+        Parameters
+        ----------
+        irun : int, optional
+            Index of the dynamics run, starting from 1.
+
+        start, stop, step : int, optional
+            Time indices to iterate over, as in range(start, stop, step). stop=None means num_steps.
+
+        chunk : int, optional
+            Number of time steps per yielded block.
+
+        prefetch_depth : int, optional
+            Number of chunks read ahead. Set to 0 to read in the calling thread.
+
+        Yields
+        ------
+        itimes : np.ndarray
+            Time indices of the block.
+
+        snaps : np.ndarray
+            Occupations of the block. Shape: (num_bands, num_kpoints, len(itimes)).
+        """
+
+        if step <= 0:
+            raise ValueError('step must be positive')
+        if chunk <= 0:
+            raise ValueError('chunk must be positive')
+
+        snap_t = self._lazy_snaps(irun)
+
+        start, stop, step = slice(start, stop, step).indices(snap_t.num_steps)
+        itimes = np.arange(start, stop, step)
+
+        def read_chunks():
+            for ichunk in range(0, itimes.size, chunk):
+                idx = itimes[ichunk:ichunk + chunk]
+                yield idx, snap_t[:, :, idx[0]:idx[-1] + 1:step]
+
+        if prefetch_depth > 0:
+            yield from prefetch(read_chunks(), depth=prefetch_depth)
+        else:
+            yield from read_chunks()
+
+    def _snap_sequence(self, irun=None):
+        """
+        Snapshots of one or all the dynamics runs, in time order.
+
+        Parameters
+        ----------
+        irun : int, optional
+            Index of the dynamics run. Default is all the runs, one after another.
+
+        Returns
+        -------
+        run_steps : list
+            (run index, step) of each snapshot.
+
+        times : np.ndarray
+            Times in fs. With all the runs, the times of a run follow the previous one
+            and snap_t_0 is only included for the first run.
+        """
+
+        if not self._cdyna_file:
+            raise ValueError('The dynamics HDF5 file (prefix_cdyna.h5) is closed.')
+
+        if irun is not None and (irun <= 0 or irun > self.num_runs):
+            raise IndexError("Index out of range")
+
+        runs = range(1, self.num_runs + 1) if irun is None else [irun]
+
+        run_steps = []
+        times = []
+        time_end = 0.0
+
+        for jrun in runs:
+            group = self._cdyna_file[f'dynamics_run_{jrun}']
+            time_step = self._data[jrun].time_step
+            steps = snap_steps(group)
+
+            if len(times) > 0:
+                steps = steps[steps > 0]
+
+            run_steps.extend((jrun, step) for step in steps)
+            times.extend(time_end + steps * time_step)
+            time_end = times[-1]
+
+        return run_steps, np.array(times)
+
+    def _read_snap_chunks(self, run_steps, chunk=64, prefetch_depth=1):
+        """
+        Iterate over the snapshots run_steps (see _snap_sequence), chunk by chunk.
+
+        Yields
+        ------
+        istart : int
+            Position of the first snapshot of the block in run_steps.
+
+        block : np.ndarray
+            Flattened snapshots. Shape: (num_block, num_kpoints * num_bands).
+        """
+
+        def read_chunks():
+            for istart in range(0, len(run_steps), chunk):
+                block = np.stack([read_snap(self._cdyna_file[f'dynamics_run_{jrun}'], step).ravel()
+                                  for jrun, step in run_steps[istart:istart + chunk]])
+                yield istart, block
+
+        if prefetch_depth > 0:
+            yield from prefetch(read_chunks(), depth=prefetch_depth)
+        else:
+            yield from read_chunks()
+
+    def compute_populations(self, energy_grid, irun=None, chunk=64, prefetch_depth=1):
+        """
+        Compute the carrier populations over an energy grid from the snapshots, as in a dynamics-pp calculation.
+        The band energies are binned once into an index array; the populations of each snapshot
+        are then the sums of the occupations per bin (np.bincount weighted by the occupations).
+        The snapshots are streamed from the HDF5 file chunk by chunk.
+
+        The populations are histograms over bins of width de centered on the energy grid points,
+        normalized per unit cell (number of k-points of the boltz_kdim grid) and per eV.
+        The spin degeneracy is not included.
+
+        Parameters
+        ----------
+        energy_grid : array_like
+            Uniform energy grid in eV (bin centers).
+
+        irun : int, optional
+            Index of the dynamics run. Default is all the runs, one after another.
+
+        chunk : int, optional
+            Number of snapshots read and binned at once.
+
+        prefetch_depth : int, optional
+            Number of chunks read ahead in a background thread. Set to 0 to read in the calling thread.
+
+        Returns
+        -------
+        times : np.ndarray
+            Times in fs. Shape (num_times,). With all the runs, the times of a run follow the previous one
+            and snap_t_0 is only included for the first run.
+
+        popu : np.ndarray
+            Carrier populations (carriers per unit cell per eV). Shape (num_energies, num_times).
+
+        carrier_number : np.ndarray
+            Total number of carriers per unit cell (all the states, within the energy grid or not).
+            Shape (num_times,).
+        """
+
+        energy_grid = np.asarray(energy_grid, dtype=float)
+        num_energies = energy_grid.size
+
+        if num_energies < 2:
+            raise ValueError('energy_grid must have at least two points')
+
+        de = energy_grid[1] - energy_grid[0]
+
+        if de <= 0 or not np.allclose(np.diff(energy_grid), de, rtol=1e-6, atol=0.0):
+            raise ValueError('energy_grid must be uniform and increasing')
+
+        if not self._cdyna_file:
+            raise ValueError('The dynamics HDF5 file (prefix_cdyna.h5) is closed.')
+
+        run_steps, times = self._snap_sequence(irun)
+        num_times = times.size
+
+        # Bin index of each (k-point, band) state, same layout as the snapshots;
+        # the states outside of the grid go into the overflow bin num_energies
+        energies_ev = self._energies * energy_conversion_factor('Ry', 'eV')
+        bin_index = np.floor((energies_ev - energy_grid[0]) / de + 0.5).astype(np.int64).ravel()
+        bin_index[(bin_index < 0) | (bin_index >= num_energies)] = num_energies
+
+        num_bins = num_energies + 1
+        norm = 1.0 / (np.prod(self.boltz_kdim) * de)
+
+        popu = np.empty((num_energies, num_times))
+        carrier_number = np.empty(num_times)
+
+        with self.timings.add('compute_populations') as t:
+            for istart, block in self._read_snap_chunks(run_steps, chunk, prefetch_depth):
+                num_block = block.shape[0]
+
+                # One bincount for the whole chunk: the bins of each snapshot are offset by num_bins
+                index = (bin_index[None, :] + num_bins * np.arange(num_block)[:, None]).ravel()
+                hist = np.bincount(index, weights=block.ravel(), minlength=num_block * num_bins)
+                hist = hist.reshape(num_block, num_bins)
+
+                popu[:, istart:istart + num_block] = hist[:, :num_energies].T * norm
+                carrier_number[istart:istart + num_block] = np.sum(block, axis=1) / np.prod(self.boltz_kdim)
+
+        return times, popu, carrier_number
+
+    def observables(self, irun=None, which=('carrier_number', 'mean_energy', 'temperature'), occ_min=1e-6,
+                    chunk=64, prefetch_depth=1, cache=False, cache_path=None):
+        """
+        Compute time series of observables of the snapshots in a single streaming pass:
+
+        * carrier_number: number of carriers per unit cell.
+        * mean_energy: average carrier energy (eV) from the band edge (band minimum for electrons,
+          band maximum for holes), positive.
+        * temperature: effective temperature (K) of a Fermi-Dirac fit of the occupations,
+          ln(1/f - 1) = (e - mu) / kT, where e is the carrier energy from the band edge.
+          The states with occ_min < f < 1 - occ_min are used. In the Boltzmann limit, ln(1/f - 1) ~ -ln(f).
+        * chem_potential: chemical potential mu (eV) of the same fit, from the band edge.
+
+        The reductions over the states are matrix-vector products over each chunk of snapshots,
+        and the least-squares fits of all the time steps are solved at once.
+        On request (cache=True), the result is cached to a sidecar HDF5 file
+        (prefix_cdyna_observables.h5 next to prefix_cdyna.h5 by default), invalidated when the cdyna file changes.
+        Only the observables missing from the cache are then computed.
+
+        Parameters
+        ----------
+        irun : int, optional
+            Index of the dynamics run. Default is all the runs, one after another (see compute_populations).
+
+        which : list of str, optional
+            Observables to compute, among carrier_number, mean_energy, temperature and chem_potential.
+
+        occ_min : float, optional
+            Occupation threshold of the temperature fit.
+
+        chunk : int, optional
+            Number of snapshots read and reduced at once.
+
+        prefetch_depth : int, optional
+            Number of chunks read ahead in a background thread. Set to 0 to read in the calling thread.
+
+        cache : bool, optional
+            Read and write the sidecar file. Default is False: nothing is written to disk.
+
+        cache_path : str, optional
+            Path to the sidecar file. If provided, the cache is used even if cache is False.
+
+        Returns
+        -------
+        result : np.ndarray
+            Structured array with the fields time (fs) and the requested observables. Shape (num_times,).
+            The temperature and chem_potential are NaN for the steps where the fit is not defined
+            (fewer than two states in the threshold, or a non-positive slope).
+        """
+
+        which = [which] if isinstance(which, str) else list(which)
+
+        for name in which:
+            if name not in OBSERVABLES:
+                raise ValueError(f'Unknown observable {name}. Choose from {OBSERVABLES}.')
+
+        if not 0.0 < occ_min < 0.5:
+            raise ValueError('occ_min must be in (0, 0.5)')
+
+        run_steps, times = self._snap_sequence(irun)
+        num_times = times.size
+
+        cdyna_path = self._cdyna_file.filename
+
+        if cache_path is None:
+            cache_path = os.path.splitext(cdyna_path)[0] + '_observables.h5'
+        else:
+            cache = True
+
+        group_name = 'all_runs' if irun is None else f'run_{irun}'
+
+        # Stamp of the cdyna file and of the parameters: the cache is discarded if any of them changes
+        stat = os.stat(cdyna_path)
+        stamp = {'source_mtime_ns': stat.st_mtime_ns, 'source_size': stat.st_size, 'occ_min': occ_min}
+
+        values = {}
+
+        if cache and os.path.isfile(cache_path):
+            with open_hdf5(cache_path, 'r') as cache_file:
+                if group_name in cache_file:
+                    group = cache_file[group_name]
+                    if all(group.attrs.get(key) == val for key, val in stamp.items()):
+                        values = {name: group[name][()] for name in which if name in group}
+
+        missing = [name for name in which if name not in values]
+
+        if missing:
+            do_fit = 'temperature' in missing or 'chem_potential' in missing
+
+            # Carrier energy of each state from the band edge, in eV
+            energies_ev = self._energies.ravel() * energy_conversion_factor('Ry', 'eV')
+            if self._pert_dict['input parameters']['after conversion']['hole']:
+                eps = np.max(energies_ev) - energies_ev
+            else:
+                eps = energies_ev - np.min(energies_ev)
+
+            # Per-step sums: occupations, energies, and the normal equations of the fits
+            sums = np.zeros((7, num_times))
+            s_f, s_fe, s_n, s_x, s_xx, s_y, s_xy = sums
+
+            with self.timings.add('observables') as t:
+                for istart, block in self._read_snap_chunks(run_steps, chunk, prefetch_depth):
+                    iend = istart + block.shape[0]
+
+                    s_f[istart:iend] = np.sum(block, axis=1)
+                    s_fe[istart:iend] = block @ eps
+
+                    if do_fit:
+                        mask = (block > occ_min) & (block < 1.0 - occ_min)
+                        y = np.zeros_like(block)
+                        np.log(1.0 / block - 1.0, out=y, where=mask)
+                        mask = mask.astype(float)
+
+                        s_n[istart:iend] = np.sum(mask, axis=1)
+                        s_x[istart:iend] = mask @ eps
+                        s_xx[istart:iend] = mask @ eps**2
+                        s_y[istart:iend] = np.sum(y, axis=1)
+                        s_xy[istart:iend] = y @ eps
+
+                computed = {}
+                computed['carrier_number'] = s_f / np.prod(self.boltz_kdim)
+                computed['mean_energy'] = np.divide(s_fe, s_f, out=np.full(num_times, np.nan), where=s_f > 0)
+
+                if do_fit:
+                    # y = a + b * e, with b = 1 / kT and a = -mu / kT
+                    det = s_n * s_xx - s_x**2
+                    valid = (s_n >= 2) & (det > 0)
+                    slope = np.divide(s_n * s_xy - s_x * s_y, det, out=np.full(num_times, np.nan), where=valid)
+                    intercept = np.divide(s_xx * s_y - s_x * s_xy, det, out=np.full(num_times, np.nan), where=valid)
+
+                    valid &= slope > 0
+                    slope[~valid] = np.nan
+
+                    computed['temperature'] = 1.0 / (slope * boltzmann('ev/K'))
+                    computed['chem_potential'] = -intercept / slope
+
+            values.update({name: computed[name] for name in missing})
+
+            if cache:
+                try:
+                    with open_hdf5(cache_path, 'a') as cache_file:
+                        if group_name in cache_file and \
+                           not all(cache_file[group_name].attrs.get(key) == val for key, val in stamp.items()):
+                            del cache_file[group_name]
+
+                        group = cache_file.require_group(group_name)
+                        group.attrs.update(stamp)
+
+                        for name in missing:
+                            if name in group:
+                                del group[name]
+                            group.create_dataset(name, data=values[name])
+
+                except OSError as err:
+                    warnings.warn(f'Cannot write the observables cache {cache_path}: {err}')
+
+        result = np.empty(num_times, dtype=[('time', float)] + [(name, float) for name in which])
+        result['time'] = times
+        for name in which:
+            result[name] = values[name]
+
+        return result
+
+    def drift_velocity(self, irun=None, chunk=64, prefetch_depth=1):
+        """
+        Compute the drift velocity of the carriers for each snapshot, v_d = sum_nk f_nk v_nk / sum_nk f_nk,
+        from the band velocities (see band_velocities). The snapshots are streamed from the HDF5 file,
+        with one matrix product per chunk of snapshots.
+
+        Parameters
+        ----------
+        irun : int, optional
+            Index of the dynamics run. Default is all the runs, one after another (see compute_populations).
+
+        chunk : int, optional
+            Number of snapshots read at once.
+
+        prefetch_depth : int, optional
+            Number of chunks read ahead in a background thread. Set to 0 to read in the calling thread.
+
+        Returns
+        -------
+        times : np.ndarray
+            Times in fs. Shape (num_times,).
+
+        drift_vel : np.ndarray
+            Drift velocities in cm/s, Cartesian coordinates. NaN without carriers. Shape (num_times, 3).
+        """
+
+        run_steps, times = self._snap_sequence(irun)
+        num_times = times.size
+
+        # Velocities and a column of ones (number of carriers), same layout as the flattened snapshots
+        weights = np.concatenate([self.band_velocities.reshape(-1, 3), np.ones((self._energies.size, 1))], axis=1)
+
+        sums = np.empty((num_times, 4))
+
+        with self.timings.add('drift_velocity') as t:
+            for istart, block in self._read_snap_chunks(run_steps, chunk, prefetch_depth):
+                sums[istart:istart + block.shape[0]] = block @ weights
+
+        drift_vel = np.divide(sums[:, :3], sums[:, 3:], out=np.full((num_times, 3), np.nan), where=sums[:, 3:] > 0)
+
+        return times, drift_vel
+
     def extract_steady_drift_vel(self, dyna_pp_yaml_path):
         """
         Method to extract the drift velocities and equilibrium carrier concentrations
@@ -284,7 +901,8 @@ class DynaRun(CalcMode):
 
     @staticmethod
     def to_cdyna_h5(prefix, band_structure_ryd, snap_array, time_step_fs,
-                    path='.', new=True, overwrite=False, num_runs=1):
+                    path='.', new=True, overwrite=False, num_runs=1, compression=None,
+                    compression_opts=None, shuffle=False, chunks=None, storage_dtype=None):
         """
         Write the dynamics data into the prefix_cdyna.h5 HDF5 file.
         Follows the script format of the Perturbo dynamics-run calculation.
@@ -292,6 +910,9 @@ class DynaRun(CalcMode):
         file, it is forcfully different from an existing one, therefore, one or more
         attributes are different from the original cdyna file.
 
+        The snapshots are written one at a time, so that snap_array can be a generator
+        of snapshots that would not fit in memory.
+
         Parameters
         ----------
 
@@ -299,10 +920,15 @@ class DynaRun(CalcMode):
             Prefix of the HDF5 file. Same as prefix in any Perturbo calculation.
 
         band_structure_ryd : np.ndarray
-            Band structure in Rydberg units. Shape: num_kpoints x num_bands
+            Band structure in Rydberg units. Shape: num_kpoints x num_bands.
+            Can be None if new is False: the band structure of the existing file is kept.
 
-        snap_array : np.ndarray
-            Array of carrier occupations. Shape: (num_steps, num_kpoints, num_bands)
+        snap_array : np.ndarray or iterable
+            Carrier occupations: array of shape (num_steps, num_kpoints, num_bands),
+            or iterable (e.g. generator) of (num_kpoints, num_bands) snapshots.
+            If num_runs > 1, a list or any iterable (e.g. a generator) with one such array or iterable per run.
+            In a new file, the first snapshot of dynamics_run_1 is the initial state snap_t_0;
+            if it is the only snapshot, it is also written as snap_t_1.
 
         time_step_fs : float or np.ndarray
             Time step in fs. If float, the same time step is used for all runs.
@@ -313,87 +939,237 @@ class DynaRun(CalcMode):
 
         new : bool
             Flag to indicate if the file is new. Default is True.
+            If False, the runs are appended to the existing file as new dynamics_run_N groups,
+            e.g. to extend a calculation (the snapshots start from snap_t_1).
 
         overwrite : bool
             Flag to indicate if the file is overwritten. Default is False.
 
         num_runs : int
-            Number of dynamics_run runs. Default is 1.
+            Number of dynamics_run runs to write. Default is 1.
+
+        compression : str, optional
+            HDF5 compression of the snap_t_N datasets: None, 'gzip' or 'lzf'.
+            Perturbo reads gzip-compressed datasets, lzf is h5py-only.
+
+        compression_opts : int, optional
+            gzip compression level (0-9).
+
+        shuffle : bool, optional
+            If True, apply the HDF5 shuffle filter before compression.
+
+        chunks : tuple or bool, optional
+            Chunk shape of the snap_t_N datasets. Default: contiguous, or guessed by h5py if compressed.
+
+        storage_dtype : np.dtype, optional
+            Storage data type of the snap_t_N datasets, e.g. np.float32 to halve the file size.
+            Default is the data type of snap_array.
         """
 
         trun = TimingGroup('write cdyna')
         trun.add('total', level=3).start()
 
-        if not new:
-            raise NotImplementedError("Only new files are supported")
-        if num_runs != 1:
-            raise NotImplementedError("Only num_runs=1 is supported")
+        if num_runs < 1:
+            raise ValueError("num_runs must be at least 1")
 
-        if isinstance(time_step_fs, (float, np.floating)):
-            time_step_fs = np.array([time_step_fs])
+        time_step_fs = np.atleast_1d(np.asarray(time_step_fs, dtype=float))
+        if time_step_fs.shape[0] == 1:
+            time_step_fs = np.repeat(time_step_fs, num_runs)
         if time_step_fs.shape[0] != num_runs:
             raise ValueError("The number of time steps must be equal to num_runs")
 
-        if path != '.':
+        if num_runs == 1:
+            run_snaps = [snap_array]
+        else:
+            if isinstance(snap_array, np.ndarray):
+                raise ValueError("If num_runs > 1, snap_array must be a list with one array or iterable per run")
+            # The outer iterable (e.g. a generator of runs) is materialized, the runs themselves are not
+            run_snaps = list(snap_array)
+            if len(run_snaps) != num_runs:
+                raise ValueError(f"snap_array has {len(run_snaps)} runs, expected num_runs={num_runs}")
+
+        for snaps in run_snaps:
+            if isinstance(snaps, np.ndarray):
+                if snaps.ndim != 3:
+                    raise ValueError("snap_array must be 3D. Shape: (num_steps, num_kpoints, num_bands)")
+
+                num_steps_read, num_kpoints_read, num_bands_read = snaps.shape
+                print("Occupations shape to write:")
+                print(f"num_steps: {num_steps_read}, num_kpoints: {num_kpoints_read}, num_bands: {num_bands_read}")
+
+                if num_kpoints_read < num_steps_read or num_kpoints_read < num_bands_read:
+                    warnings.warn("The number of k-points of snap array to write is smaller "
+                                  "than the number of time steps or bands.")
+
+        if new and path != '.':
             os.makedirs(path, exist_ok=True)
 
         new_cdyna_filename = os.path.join(path, f'{prefix}_cdyna.h5')
 
-        if os.path.isfile(new_cdyna_filename):
-            if overwrite:
-                warnings.warn(f'File {new_cdyna_filename} already exists. Overwriting it.')
-            else:
-                raise FileExistsError(f'File {new_cdyna_filename} already exists. Set overwrite=True to overwrite it.')
+        if new:
+            if os.path.isfile(new_cdyna_filename):
+                if overwrite:
+                    warnings.warn(f'File {new_cdyna_filename} already exists. Overwriting it.')
+                else:
+                    raise FileExistsError(f'File {new_cdyna_filename} already exists. '
+                                          'Set overwrite=True to overwrite it.')
+
+            if band_structure_ryd is None:
+                raise ValueError("band_structure_ryd must be provided for a new file")
+
+        elif not os.path.isfile(new_cdyna_filename):
+            raise FileNotFoundError(f'File {new_cdyna_filename} does not exist. Set new=True to create it.')
+
+        dset_options = snap_dataset_options(compression, compression_opts, shuffle, chunks, storage_dtype)
+
+        if new:
+            new_cdyna_file = open_hdf5(new_cdyna_filename, 'w')
+
+            new_cdyna_file.create_dataset('band_structure_ryd', data=band_structure_ryd)
+            new_cdyna_file['band_structure_ryd'].attrs['ryd2ev'] = 13.605698066
+
+            new_cdyna_file.create_dataset('num_runs', data=0)
+            first_run = 1
 
-        if snap_array.ndim != 3:
-            raise ValueError("snap_array must be 3D. Shape: (num_steps, num_kpoints, num_bands)")
         else:
-            num_steps_read, num_kpoints_read, num_bands_read = snap_array.shape
-            print("Occupations shape to write:")
-            print(f"num_steps: {num_steps_read}, num_kpoints: {num_kpoints_read}, num_bands: {num_bands_read}")
+            new_cdyna_file = open_hdf5(new_cdyna_filename, 'a')
 
-            if num_kpoints_read < num_steps_read or num_kpoints_read < num_bands_read:
-                warnings.warn("The number of k-points of snap array to write is smaller "
-                              "than the number of time steps or bands.")
+            existing_shape = new_cdyna_file['band_structure_ryd'].shape
 
-        new_cdyna_file = open_hdf5(new_cdyna_filename, 'w')
+            if band_structure_ryd is not None and np.shape(band_structure_ryd) != existing_shape:
+                close_hdf5(new_cdyna_file)
+                raise ValueError(f"band_structure_ryd shape {np.shape(band_structure_ryd)} does not match "
+                                 f"the existing {existing_shape}")
 
-        new_cdyna_file.create_dataset('band_structure_ryd', data=band_structure_ryd)
-        new_cdyna_file['band_structure_ryd'].attrs['ryd2ev'] = 13.605698066
+            first_run = int(new_cdyna_file['num_runs'][()]) + 1
 
-        new_cdyna_file.create_dataset('num_runs', data=num_runs)
+        band_shape = new_cdyna_file['band_structure_ryd'].shape
 
-        for irun in range(1, num_runs + 1):
+        try:
+            for irun, snaps in enumerate(run_snaps, start=first_run):
 
-            # In Perturbo, in dynamics_run_1, snap_t_ start from 0, where snap_t_0 is the initial state
-            # In dynamics_run_2 and onwards, snap_t_ start from
-            if irun == 1:
-                offset = 0
+                dyn_str = f'dynamics_run_{irun}'
+                run_group = new_cdyna_file.create_group(dyn_str)
+                run_group.create_dataset('time_step_fs', data=time_step_fs[irun - first_run])
 
-                if snap_array.shape[0] == 1:
-                    # duplicate the initial state
-                    snap_array = np.vstack((snap_array, snap_array))
-                num_steps = snap_array.shape[0] - 1
+                # In Perturbo, in dynamics_run_1, snap_t_ start from 0, where snap_t_0 is the initial state
+                # In dynamics_run_2 and onwards, snap_t_ start from 1
+                try:
+                    num_steps = _write_cdyna_snaps(run_group, snaps, 0 if irun == 1 else 1, band_shape,
+                                                   dset_options)
+                except Exception:
+                    # Do not leave an incomplete run in the file
+                    del new_cdyna_file[dyn_str]
+                    raise
 
-            else:
-                offset = 1
-                num_steps = snap_array.shape[0]
+                run_group.create_dataset('num_steps', data=num_steps)
 
-            dyn_str = f'dynamics_run_{irun}'
-            new_cdyna_file.create_group(dyn_str)
-            new_cdyna_file[dyn_str].create_dataset('num_steps', data=num_steps)
-            new_cdyna_file[dyn_str].create_dataset('time_step_fs', data=time_step_fs[irun - 1])
+                # Updated after each run, so that an interrupted write leaves a readable file
+                new_cdyna_file['num_runs'][()] = irun
 
-            for itime in range(snap_array.shape[0]):
-                new_cdyna_file[dyn_str].create_dataset(f'snap_t_{itime + offset}', data=snap_array[itime, :, :])
+                print(f'{dyn_str:>30}: {num_steps} steps')
+                print_storage_size(run_group, label=dyn_str)
 
-        close_hdf5(new_cdyna_file)
+        finally:
+            close_hdf5(new_cdyna_file)
 
         trun.timings['total'].stop()
+        print(f'{"File size (MB)":>30}: {os.path.getsize(new_cdyna_filename) / 1024**2:.3f}')
         print(f'{"Total time to write cdyna":>30}: {trun.timings["total"].total_runtime} s')
         print()
 
 
+def _write_cdyna_snaps(run_group, snaps, offset, band_shape, dset_options):
+    """
+    Write the snapshots of one dynamics_run_N group one at a time, starting from snap_t_{offset}.
+    A single initial state (offset 0) is also written as snap_t_1.
+
+    Returns
+    -------
+    num_steps : int
+        Number of steps of the run.
+    """
+
+    num_written = 0
+    snap = None
+
+    for snap in snaps:
+        snap = np.asarray(snap)
+
+        if snap.shape != band_shape:
+            raise ValueError(f'Snapshot {num_written} has shape {snap.shape}, expected {band_shape} '
+                             '(num_kpoints, num_bands)')
+
+        run_group.create_dataset(f'snap_t_{num_written + offset}', data=snap, **dset_options)
+        num_written += 1
+
+    if num_written == 0:
+        raise ValueError(f'No snapshots to write in {run_group.name}')
+
+    if offset == 0:
+        if num_written == 1:
+            # Perturbo requires at least one step: the initial state is also the first step
+            run_group.create_dataset('snap_t_1', data=snap, **dset_options)
+            num_written += 1
+
+        return num_written - 1
+
+    return num_written
+
+
+def select_steps(num_steps, time_step, time_stride=1, time_window=None, times=None):
+    """
+    Select the steps N (snap_t_N, N = 1, ..., num_steps) of a dynamics run to load.
+
+    Parameters
+    ----------
+    num_steps : int
+        Number of steps of the run.
+
+    time_step : float
+        Time step in fs.
+
+    time_stride : int, optional
+        Keep every time_stride-th selected step.
+
+    time_window : tuple of float, optional
+        (t_min, t_max) in fs: keep the steps with t_min <= N * time_step <= t_max.
+
+    times : array_like, optional
+        Times in fs: keep the steps closest to these times.
+
+    Returns
+    -------
+    steps : np.ndarray
+        Selected steps, in increasing order.
+    """
+
+    if time_stride is None:
+        time_stride = 1
+
+    if time_stride < 1:
+        raise ValueError('time_stride must be a positive integer')
+
+    steps = np.arange(1, num_steps + 1)
+
+    if times is not None:
+        steps = np.unique(np.rint(np.asarray(times, dtype=float) / time_step).astype(int))
+
+        if steps.size > 0 and (steps[0] < 1 or steps[-1] > num_steps):
+            raise ValueError(f'times must be between {time_step} and {num_steps * time_step} fs')
+
+    if time_window is not None:
+        t_min, t_max = time_window
+        steps = steps[(steps * time_step >= t_min) & (steps * time_step <= t_max)]
+
+    steps = steps[::time_stride]
+
+    if steps.size == 0:
+        raise ValueError('No steps selected: check time_window and times')
+
+    return steps
+
+
 class PumpPulse():
     """
     Class for pump pulse excitation.
@@ -1,8 +1,10 @@
 import numpy as np
 import h5py as h5
 import matplotlib.pyplot as plt
+from collections import OrderedDict
 from perturbopy.postproc.calc_modes.calc_mode import CalcMode
 from perturbopy.io_utils.io import open_yaml, open_hdf5, close_hdf5
+from perturbopy.postproc.utils.snapshots import normalize_key
 import os
 
 
@@ -23,10 +25,11 @@ class SpectralCumulant(CalcMode):
         Array of energy value in electron volts (eV).
     freq_step : float
         Energy step size for the energy grid in eV.
-    Akw : numpy.ndarray
+    Akw : numpy.ndarray or AkwArray
         Spectral function data, indexed by k-point, band, temperature, and ω.
+        With lazy=True, an AkwArray reading the k-points from the HDF5 file on demand.
     """
-    def __init__(self, spectral_file, pert_dict):
+    def __init__(self, spectral_file, pert_dict, lazy=False, cache_size=16):
         """
         Constructor method
 
@@ -36,6 +39,11 @@ class SpectralCumulant(CalcMode):
             Dictionary for the prefix_spectral_cumulant.h5
         pert_dict : dict
             Dictionary containing the inputs from the spectral-cum calculation.
+        lazy : bool, optional
+            If True, Akw is an AkwArray and spectral_file is kept open until close_hdf5_files is called.
+            Otherwise, the spectral functions are read into memory and spectral_file is closed.
+        cache_size : int, optional
+            Number of k-points kept in the LRU cache of the AkwArray (lazy=True only).
 
         """
         super().__init__(pert_dict)
@@ -49,15 +57,18 @@ class SpectralCumulant(CalcMode):
         self.temp_array = np.asanyarray(spectral_file['temperatures'])
         self.freq_array = np.arange(w_lower, w_upper + 1) * freq_step
         self.freq_step = freq_step
-        Akw_np = []
-        for key in Akw.keys():
-            Akw_np.append(np.asarray(Akw[key]))
-        close_hdf5(spectral_file)
 
-        self.Akw = np.asarray(Akw_np)
+        self.Akw = AkwArray(Akw, cache_size=cache_size)
+
+        if lazy:
+            self._spectral_file = spectral_file
+        else:
+            self.Akw = self.Akw.read_all()
+            self._spectral_file = None
+            close_hdf5(spectral_file)
 
     @classmethod
-    def from_hdf5_yaml(cls, spectral_path, yaml_path='pert_output.yml'):
+    def from_hdf5_yaml(cls, spectral_path, yaml_path='pert_output.yml', lazy=False, cache_size=16):
         """
         Class method to create a SpectralCumulantCalcMode object from the HDF5 file and YAML file
         generated by a Perturbo calculation
@@ -68,9 +79,15 @@ class SpectralCumulant(CalcMode):
            Path to the HDF5 file generated by a spectral-cum calculation
         yaml_path : str, optional
            Path to the YAML file generated by a spectral-cum calculation
+        lazy : bool, optional
+           If True, read the spectral functions on demand (see AkwArray)
+        cache_size : int, optional
+           Number of k-points kept in the LRU cache (lazy=True only)
 
         Returns
         -------
+        spectral_cumulant : SpectralCumulant
+           The SpectralCumulant object generated from the HDF5 and YAML files
 
         """
 
@@ -82,7 +99,20 @@ class SpectralCumulant(CalcMode):
         spectral_file = open_hdf5(spectral_path)
         yaml_dict = open_yaml(yaml_path)
 
-        return cls(spectral_file, yaml_dict)
+        return cls(spectral_file, yaml_dict, lazy=lazy, cache_size=cache_size)
+
+    def close_hdf5_files(self):
+        """
+        Method to close the HDF5 file kept open with lazy=True. The lazy Akw array cannot be read afterwards.
+        """
+
+        if self._spectral_file:
+            close_hdf5(self._spectral_file)
+
+        self._spectral_file = None
+
+        if isinstance(self.Akw, AkwArray):
+            self.Akw.clear_cache()
 
     def plot_Aw(self, ax, ik=0, it=0, ib=0):
         """
@@ -130,3 +160,177 @@ class SpectralCumulant(CalcMode):
         plt.yticks(fontsize=20)
         plt.tight_layout()
         return ax
+
+
+class AkwArray():
+    """
+    Lazy, read-only array-like view of the spectral functions of a spectral-cum calculation,
+    indexed by (k-point, band, temperature, ω). Each k-point is a dataset of the spectral_functions group;
+    only the k-points required by a given slice are read, and the most recent ones are kept in a bounded LRU cache.
+
+    Attributes
+    ----------
+    shape : tuple
+        Shape of the array: (num_kpoints, num_bands, num_temperatures, num_freqs).
+
+    dtype : np.dtype
+        Data type of the returned arrays.
+
+    cache_size : int
+        Maximum number of k-points kept in the LRU cache.
+
+    _group : h5py.Group
+        The spectral_functions group of the HDF5 file.
+
+    _keys : list
+        Names of the k-point datasets, in the order of the group.
+
+    _cache : OrderedDict
+        LRU cache of the k-points read from the file. Keys are the k-point indices.
+    """
+
+    def __init__(self, group, cache_size=16, dtype=np.float64):
+        """
+        Constructor method
+
+        Parameters
+        ----------
+        group : h5py.Group
+            The spectral_functions group of an open prefix_spectral_cumulant.h5 file.
+
+        cache_size : int, optional
+            Maximum number of k-points kept in the LRU cache. 0 disables the cache.
+
+        dtype : np.dtype, optional
+            Data type of the returned arrays.
+        """
+
+        self._group = group
+        self._keys = list(group.keys())
+        self.cache_size = cache_size
+        self.dtype = np.dtype(dtype)
+        self._cache = OrderedDict()
+
+        if len(self._keys) == 0:
+            raise ValueError('The spectral_functions group is empty')
+
+        self.shape = (len(self._keys),) + group[self._keys[0]].shape
+
+    @property
+    def ndim(self):
+        return len(self.shape)
+
+    @property
+    def size(self):
+        return int(np.prod(self.shape))
+
+    def __len__(self):
+        return self.shape[0]
+
+    def __repr__(self):
+        return f'AkwArray(shape={self.shape}, dtype={self.dtype})'
+
+    def __array__(self, dtype=None, copy=None):
+        arr = self.read_all()
+        if dtype is not None:
+            arr = arr.astype(dtype, copy=False)
+        return arr
+
+    def get_kpoint(self, ik):
+        """
+        Get the spectral functions of the k-point ik, using the LRU cache.
+
+        Parameters
+        ----------
+        ik : int
+            Index of the k-point, starting from 0.
+
+        Returns
+        -------
+        Aw : np.ndarray
+            Shape: (num_bands, num_temperatures, num_freqs).
+        """
+
+        self._check_open()
+
+        ik = range(self.shape[0])[ik]
+
+        if ik in self._cache:
+            self._cache.move_to_end(ik)
+            return self._cache[ik]
+
+        Aw = np.asarray(self._group[self._keys[ik]][()], dtype=self.dtype)
+
+        if self.cache_size > 0:
+            self._cache[ik] = Aw
+            while len(self._cache) > self.cache_size:
+                self._cache.popitem(last=False)
+
+        return Aw
+
+    def _check_open(self):
+        """
+        Raise a ValueError if the HDF5 file of the spectral functions was closed.
+        """
+
+        if not self._group:
+            raise ValueError('The spectral function HDF5 file is closed: the lazy Akw array cannot be read anymore.')
+
+    def clear_cache(self):
+        """
+        Remove all the k-points from the LRU cache.
+        """
+
+        self._cache.clear()
+
+    def read_all(self):
+        """
+        Read all the k-points into a single preallocated array, each dataset directly into its slice.
+        The LRU cache is bypassed.
+
+        Returns
+        -------
+        Akw : np.ndarray
+            Shape: (num_kpoints, num_bands, num_temperatures, num_freqs).
+        """
+
+        self._check_open()
+
+        Akw = np.empty(self.shape, dtype=self.dtype)
+
+        for ik, key in enumerate(self._keys):
+            dset = self._group[key]
+            if dset.dtype == self.dtype:
+                dset.read_direct(Akw, dest_sel=np.s_[ik])
+            else:
+                Akw[ik] = dset[()]
+
+        return Akw
+
+    def __getitem__(self, key):
+        """
+        Numpy-style indexing over (k-point, band, temperature, ω). Only the selected k-points are read.
+        """
+
+        key = normalize_key(key, self.ndim)
+        kpoint_key, rest = key[0], key[1:]
+
+        kpoint_idx = np.arange(self.shape[0])[kpoint_key]
+
+        if np.ndim(kpoint_idx) == 0:
+            # The integer is kept in the key, so that it counts as an advanced index as in numpy
+            return self.get_kpoint(int(kpoint_idx))[None][(0,) + rest]
+
+        # A slice stays a slice, so that the numpy semantics are kept when combined with advanced indices;
+        # the duplicated k-points of an index array are read once
+        if isinstance(kpoint_key, slice):
+            read_idx, select = kpoint_idx, slice(None)
+        else:
+            read_idx, inverse = np.unique(kpoint_idx, return_inverse=True)
+            select = inverse.reshape(kpoint_idx.shape)
+
+        data = np.empty((read_idx.size,) + self.shape[1:], dtype=self.dtype)
+        for i, ik in enumerate(read_idx):
+            data[i] = self.get_kpoint(int(ik))
+
+        return data[(select,) + rest]
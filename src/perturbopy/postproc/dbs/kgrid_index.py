@@ -0,0 +1,237 @@
+import numpy as np
+
+
+class KGridIndex():
+    """
+    Integer index of a set of k-points lying on a regular Monkhorst-Pack grid (e.g. boltz_kdim).
+    The crystal coordinates are converted into integer grid coordinates, folded into the first Brillouin zone,
+    and then into a single linear index. The matching of k-points is then exact and does not depend
+    on the rounding of the floating point coordinates.
+
+    Attributes
+    ----------
+    kdim : np.ndarray
+       Number of grid points along each reciprocal lattice vector. Shape (3,).
+
+    num_kpoints : int
+       Number of k-points in the set.
+
+    grid_index : np.ndarray
+       Linear grid index of each k-point, in [0, prod(kdim)). Shape (num_kpoints,).
+
+    tol : float
+       Maximal distance (in units of the grid spacing) between a k-point and the nearest grid point.
+
+    _sorted_index : np.ndarray
+       Sorted grid indices, for the vectorized lookups.
+
+    _order : np.ndarray
+       Permutation sorting grid_index.
+
+    _lookup_dict : dict
+       Hash table from the linear grid index to the position in the set, built on the first scalar lookup.
+
+    """
+
+    def __init__(self, kpoints_cryst, kdim, tol=1e-4):
+        """
+        Constructor method
+
+        Parameters
+        ----------
+        kpoints_cryst : array_like
+           K-points in crystal coordinates. Shape (num_kpoints, 3).
+
+        kdim : array_like
+           Number of grid points along each reciprocal lattice vector.
+
+        tol : float, optional
+           Maximal distance (in units of the grid spacing) between a k-point and the nearest grid point.
+
+        """
+
+        self.kdim = np.array(kdim, dtype=np.int64).reshape(3)
+
+        if np.any(self.kdim <= 0):
+            raise ValueError(f'kdim must be positive, got {self.kdim}')
+
+        self.tol = tol
+
+        self.grid_index = self.to_grid_index(kpoints_cryst)
+        self.num_kpoints = self.grid_index.size
+
+        self._order = np.argsort(self.grid_index, kind='stable')
+        self._sorted_index = self.grid_index[self._order]
+
+        if np.any(np.diff(self._sorted_index) == 0):
+            raise ValueError('Several k-points map to the same grid point')
+
+        self._lookup_dict = None
+
+    def __len__(self):
+        return self.num_kpoints
+
+    def __repr__(self):
+        return f'KGridIndex(num_kpoints={self.num_kpoints}, kdim={tuple(self.kdim)})'
+
+    def to_grid_index(self, kpoints_cryst):
+        """
+        Method to convert crystal coordinates into linear grid indices, folded into the first Brillouin zone.
+
+        Parameters
+        ----------
+        kpoints_cryst : array_like
+           K-points in crystal coordinates. Shape (num_kpoints, 3) or (3,).
+
+        Returns
+        -------
+        grid_index : np.ndarray
+           Linear grid indices. Shape (num_kpoints,).
+
+        """
+
+        kpoints_cryst = np.asarray(kpoints_cryst, dtype=float).reshape(-1, 3)
+
+        grid_coords = kpoints_cryst * self.kdim
+        int_coords = np.rint(grid_coords)
+
+        if np.any(np.abs(grid_coords - int_coords) > self.tol):
+            raise ValueError(f'Some k-points are not on the {tuple(self.kdim)} grid')
+
+        # Fold into [0, kdim)
+        int_coords = np.mod(int_coords.astype(np.int64), self.kdim)
+
+        return (int_coords[:, 0] * self.kdim[1] + int_coords[:, 1]) * self.kdim[2] + int_coords[:, 2]
+
+    def lookup(self, kpoints_cryst):
+        """
+        Method to find the positions of k-points in the set (vectorized).
+
+        Parameters
+        ----------
+        kpoints_cryst : array_like
+           K-points in crystal coordinates. Shape (num_kpoints, 3).
+
+        Returns
+        -------
+        kidx : np.ndarray
+           Position of each k-point in the set, -1 if the k-point is not in the set.
+
+        """
+
+        return self._lookup_grid_index(self.to_grid_index(kpoints_cryst))
+
+    def _lookup_grid_index(self, grid_index):
+        """
+        Positions in the set of the given linear grid indices, -1 if absent.
+        """
+
+        if self.num_kpoints == 0:
+            return np.full(np.shape(grid_index), -1, dtype=np.int64)
+
+        pos = np.searchsorted(self._sorted_index, grid_index)
+        pos = np.minimum(pos, self.num_kpoints - 1)
+
+        found = self._sorted_index[pos] == grid_index
+
+        return np.where(found, self._order[pos], -1)
+
+    def index(self, kpoint_cryst):
+        """
+        Method to find the position of a single k-point in the set, with a hashed lookup.
+
+        Parameters
+        ----------
+        kpoint_cryst : array_like
+           K-point in crystal coordinates. Shape (3,).
+
+        Returns
+        -------
+        kidx : int
+           Position of the k-point in the set.
+
+        """
+
+        if self._lookup_dict is None:
+            self._lookup_dict = dict(zip(self.grid_index.tolist(), range(self.num_kpoints)))
+
+        grid_index = int(self.to_grid_index(kpoint_cryst)[0])
+
+        if grid_index not in self._lookup_dict:
+            raise KeyError(f'K-point {kpoint_cryst} is not in the set')
+
+        return self._lookup_dict[grid_index]
+
+    def grid_coords(self):
+        """
+        Method to get the integer grid coordinates of the k-points, folded into [0, kdim).
+
+        Returns
+        -------
+        int_coords : np.ndarray
+           Integer grid coordinates. Shape (num_kpoints, 3).
+
+        """
+
+        return np.stack([self.grid_index // (self.kdim[1] * self.kdim[2]),
+                         (self.grid_index // self.kdim[2]) % self.kdim[1],
+                         self.grid_index % self.kdim[2]], axis=1)
+
+    def neighbor_table(self):
+        """
+        Method to get the nearest neighbors of each k-point along the three reciprocal lattice vectors,
+        with periodic boundary conditions on the grid (e.g. for finite differences).
+
+        Returns
+        -------
+        neighbors : np.ndarray
+           Positions in the set of the neighbors k + e_i / kdim_i (neighbors[:, i, 0])
+           and k - e_i / kdim_i (neighbors[:, i, 1]), -1 if the neighbor is not in the set.
+           Shape (num_kpoints, 3, 2).
+
+        """
+
+        int_coords = self.grid_coords()
+        neighbors = np.empty((self.num_kpoints, 3, 2), dtype=np.int64)
+
+        for i in range(3):
+            for j, shift in enumerate((1, -1)):
+                shifted = int_coords.copy()
+                shifted[:, i] = np.mod(shifted[:, i] + shift, self.kdim[i])
+                grid_index = (shifted[:, 0] * self.kdim[1] + shifted[:, 1]) * self.kdim[2] + shifted[:, 2]
+                neighbors[:, i, j] = self._lookup_grid_index(grid_index)
+
+        return neighbors
+
+    def __contains__(self, kpoint_cryst):
+        try:
+            self.index(kpoint_cryst)
+        except (KeyError, ValueError):
+            return False
+
+        return True
+
+    def match(self, other):
+        """
+        Method to find the k-points common to two sets on the same grid,
+        e.g. the electron and hole k-points of a pump-probe calculation.
+
+        Parameters
+        ----------
+        other : KGridIndex
+           The other set of k-points.
+
+        Returns
+        -------
+        kidx, other_kidx : np.ndarray
+           Positions of the common k-points in this set and in the other set, sorted by kidx.
+
+        """
+
+        if not np.array_equal(self.kdim, other.kdim):
+            raise ValueError(f'The k-point grids are different: {tuple(self.kdim)} and {tuple(other.kdim)}')
+
+        other_kidx = other._lookup_grid_index(self.grid_index)
+        kidx = np.nonzero(other_kidx >= 0)[0]
+
+        return kidx, other_kidx[kidx]
@@ -0,0 +1,266 @@
+import numpy as np
+from perturbopy.postproc.utils.constants import energy_conversion_factor
+from perturbopy.postproc.utils.lineshapes import gaussian
+
+
+class TransitionEnergies():
+    """
+    Class representation of the electron-hole transition energies E_c(k) - E_v(k)
+    for all the pairs of conduction (electron) and valence (hole) bands on the k-points common to both.
+    The (elec_nband, hole_nband, num_kpoints) tensor is computed once and shared by the
+    pump excitation and the transient absorption (probe) kernels, which evaluate over it in broadcasted operations.
+
+    Attributes
+    ----------
+    energies : np.ndarray
+       Transition energies in eV. Shape (elec_nband, hole_nband, num_kpoints).
+
+    ekidx : np.ndarray
+       Indices of the common k-points in the electron k-point array. Shape (num_kpoints,).
+
+    hkidx : np.ndarray
+       Indices of the common k-points in the hole k-point array. Shape (num_kpoints,).
+
+    num_elec_kpoints : int
+       Total number of electron k-points.
+
+    num_hole_kpoints : int
+       Total number of hole k-points.
+
+    dtype : np.dtype
+       Data type of energies. float32 halves the memory of the tensor.
+
+    _sort_order : np.ndarray
+       Flat indices of energies sorted by energy, created on the first call to sorted_index.
+
+    """
+
+    def __init__(self, elec_energy_array, hole_energy_array, ekidx=None, hkidx=None, dtype=np.float64):
+        """
+        Constructor method
+
+        Parameters
+        ----------
+        elec_energy_array : array_like
+           Electron band energies in eV. Shape (num_elec_kpoints, elec_nband).
+
+        hole_energy_array : array_like
+           Hole band energies in eV. Shape (num_hole_kpoints, hole_nband).
+
+        ekidx, hkidx : array_like, optional
+           Indices of the common k-points in the electron and hole arrays.
+           If not provided, the two arrays must be on the same k-points, in the same order.
+
+        dtype : np.dtype, optional
+           Data type of the transition energies.
+
+        """
+
+        elec_energy_array = np.asarray(elec_energy_array)
+        hole_energy_array = np.asarray(hole_energy_array)
+
+        if ekidx is None and hkidx is None:
+            if elec_energy_array.shape[0] != hole_energy_array.shape[0]:
+                raise ValueError('ekidx and hkidx must be provided if the electron and hole k-points differ')
+            ekidx = np.arange(elec_energy_array.shape[0])
+            hkidx = ekidx
+        elif ekidx is None or hkidx is None:
+            raise ValueError('Both ekidx and hkidx must be provided')
+
+        self.ekidx = np.asarray(ekidx, dtype=int)
+        self.hkidx = np.asarray(hkidx, dtype=int)
+
+        if self.ekidx.shape != self.hkidx.shape:
+            raise ValueError('ekidx and hkidx must have the same shape')
+
+        self.num_elec_kpoints = elec_energy_array.shape[0]
+        self.num_hole_kpoints = hole_energy_array.shape[0]
+        self.dtype = np.dtype(dtype)
+
+        # e - elec. band, h - hole band, k - common k-point
+        self.energies = (elec_energy_array[self.ekidx].T[:, None, :] -
+                         hole_energy_array[self.hkidx].T[None, :, :]).astype(self.dtype, copy=False)
+
+        self._sort_order = None
+        self._sorted_energies = None
+
+    @classmethod
+    def from_dyna_runs(cls, elec_dyna_run, hole_dyna_run, dtype=np.float64):
+        """
+        Class method to get the transition energies of an electron and a hole DynaRun objects.
+        The k-points are matched on the boltz_kdim grid. The object is cached on elec_dyna_run,
+        so that the pump pulse setup and the transient absorption share it.
+
+        Parameters
+        ----------
+        elec_dyna_run : DynaRun
+           The DynaRun object for electrons.
+
+        hole_dyna_run : DynaRun
+           The DynaRun object for holes.
+
+        dtype : np.dtype, optional
+           Data type of the transition energies.
+
+        Returns
+        -------
+        trans_energies : TransitionEnergies
+
+        """
+
+        key = (id(hole_dyna_run), np.dtype(dtype).str)
+        cached = elec_dyna_run._transition_energies.get(key)
+
+        # The hole object is stored with the cache entry: the id of a deleted object can be reused
+        if cached is not None and cached[0] is hole_dyna_run:
+            return cached[1]
+
+        ekidx, hkidx = elec_dyna_run.kgrid.match(hole_dyna_run.kgrid)
+
+        trans_energies = cls(elec_dyna_run._energies * energy_conversion_factor('Ry', 'eV'),
+                             hole_dyna_run._energies * energy_conversion_factor('Ry', 'eV'),
+                             ekidx, hkidx, dtype=dtype)
+
+        elec_dyna_run._transition_energies[key] = (hole_dyna_run, trans_energies)
+
+        return trans_energies
+
+    @property
+    def shape(self):
+        return self.energies.shape
+
+    @property
+    def num_kpoints(self):
+        return self.energies.shape[2]
+
+    def __repr__(self):
+        return f'TransitionEnergies(shape={self.shape}, dtype={self.dtype})'
+
+    def sorted_index(self):
+        """
+        Method to get the transitions sorted by energy. Computed once and cached.
+
+        Returns
+        -------
+        sort_order : np.ndarray
+           Flat indices of energies in increasing order of energy.
+
+        sorted_energies : np.ndarray
+           Sorted transition energies.
+
+        """
+
+        if self._sort_order is None:
+            self._sort_order = np.argsort(self.energies, axis=None)
+            self._sorted_energies = self.energies.ravel()[self._sort_order]
+
+        return self._sort_order, self._sorted_energies
+
+    def window(self, center, sigma, num_sigma=6.0):
+        """
+        Method to select the transitions within num_sigma * sigma of a target energy,
+        or of a range of target energies. The selection is a contiguous range of the sorted index
+        (see sorted_index), so its cost is proportional to the number of selected transitions.
+
+        Parameters
+        ----------
+        center : float or array_like
+           Target energy (eV). If an array is provided, the window spans from its minimum to its maximum.
+
+        sigma : float
+           Broadening (eV).
+
+        num_sigma : float, optional
+           Half-width of the window in units of sigma.
+
+        Returns
+        -------
+        iband, jband, ik : np.ndarray
+           Electron band, hole band and k-point indices of the selected transitions, sorted by energy.
+
+        """
+
+        center = np.atleast_1d(center)
+        width = num_sigma * sigma
+
+        sort_order, sorted_energies = self.sorted_index()
+
+        lower = np.searchsorted(sorted_energies, np.min(center) - width, side='left')
+        upper = np.searchsorted(sorted_energies, np.max(center) + width, side='right')
+
+        return np.unravel_index(sort_order[lower:upper], self.shape)
+
+    def excitation(self, pump_energies, sigma, factor=1.0, weights=None, num_sigma=None):
+        """
+        Method to compute the optically excited occupations: for each transition, a Gaussian of the
+        transition energy centered at the pump energy is added to the electron and to the hole occupations.
+
+        Parameters
+        ----------
+        pump_energies : float or array_like
+           Pump energies (eV).
+
+        sigma : float
+           Gaussian sigma of the pump energy broadening (eV).
+
+        factor : float, optional
+           Amplitude of the Gaussian.
+
+        weights : np.ndarray, optional
+           Weight of each transition (e.g. transition dipoles squared). Same shape as energies.
+
+        num_sigma : float, optional
+           If provided, only the transitions within num_sigma * sigma of the pump energies are evaluated.
+           The neglected contributions are below factor * max(weights) * exp(-num_sigma**2 / 2) each.
+
+        Returns
+        -------
+        elec_occs_amplitude : np.ndarray
+           Shape (num_pump_energies, num_elec_kpoints, elec_nband).
+
+        hole_occs_amplitude : np.ndarray
+           Shape (num_pump_energies, num_hole_kpoints, hole_nband).
+
+        """
+
+        pump_energies = np.atleast_1d(np.asarray(pump_energies, dtype=float))
+        num_energies = pump_energies.shape[0]
+
+        elec_nband, hole_nband, _ = self.shape
+
+        elec_occs_amplitude = np.zeros((num_energies, self.num_elec_kpoints, elec_nband))
+        hole_occs_amplitude = np.zeros((num_energies, self.num_hole_kpoints, hole_nband))
+
+        if num_sigma is None:
+            # One pump energy at a time: a single (elec_nband, hole_nband, num_kpoints) tensor is held
+            for ienergy, pump_energy in enumerate(pump_energies):
+                # e - elec. band, h - hole band, k - common k-point
+                delta = factor * gaussian(self.energies, pump_energy, sigma)
+
+                if weights is not None:
+                    delta *= weights
+
+                elec_occs_amplitude[ienergy, self.ekidx, :] = np.sum(delta, axis=1).T
+                hole_occs_amplitude[ienergy, self.hkidx, :] = np.sum(delta, axis=0).T
+
+        else:
+            iband, jband, ik = self.window(pump_energies, sigma, num_sigma)
+
+            delta = factor * gaussian(self.energies[iband, jband, ik][None, :], pump_energies[:, None], sigma)
+
+            if weights is not None:
+                delta *= weights[iband, jband, ik][None, :]
+
+            # Flat indices of the (k-point, band) occupations
+            elec_flat = self.ekidx[ik] * elec_nband + iband
+            hole_flat = self.hkidx[ik] * hole_nband + jband
+
+            for ienergy in range(num_energies):
+                elec_occs_amplitude[ienergy] = \
+                    np.bincount(elec_flat, weights=delta[ienergy],
+                                minlength=self.num_elec_kpoints * elec_nband).reshape(-1, elec_nband)
+                hole_occs_amplitude[ienergy] = \
+                    np.bincount(hole_flat, weights=delta[ienergy],
+                                minlength=self.num_hole_kpoints * hole_nband).reshape(-1, hole_nband)
+
+        return elec_occs_amplitude, hole_occs_amplitude
@@ -0,0 +1,725 @@
+"""
+Utils for the prefix_cdyna.h5 files of the dynamics-run calculations:
+conversion between the per-step and consolidated snapshot layouts,
+virtual datasets stitching several runs and restarts,
+storage options (chunking, compression) of the snapshot datasets,
+restart seeds and truncated copies of a calculation.
+Also the consolidated layout of the prefix_popu.h5 files of the dynamics-pp calculations.
+"""
+
+import os
+import argparse
+import warnings
+import numpy as np
+import h5py
+
+from perturbopy.io_utils.io import open_hdf5, close_hdf5
+
+from .timing import TimingGroup
+from .snapshots import CONSOLIDATED_DSET, CONSOLIDATED_POPU_DSET, is_consolidated, snap_shape, snap_steps, read_snap
+
+
+def consolidated_chunks(num_snaps, num_kpoints, num_bands, itemsize=8, chunk_steps=16, chunk_mb=1.0):
+    """
+    Chunk shape for the consolidated (num_snaps, num_kpoints, num_bands) dataset.
+    A chunk spans all the bands, chunk_steps time steps and as many k-points
+    as fit in chunk_mb, so that both time series at fixed k and k-slices at fixed time
+    touch a small number of chunks.
+
+    Returns
+    -------
+    chunks : tuple
+        Chunk shape (steps, k-points, bands).
+    """
+
+    chunk_steps = max(1, min(chunk_steps, num_snaps))
+    chunk_k = int(chunk_mb * 1024**2 / (chunk_steps * num_bands * itemsize))
+    chunk_k = max(1, min(chunk_k, num_kpoints))
+
+    return (chunk_steps, chunk_k, num_bands)
+
+
+def snap_dataset_options(compression=None, compression_opts=None, shuffle=False, chunks=None, dtype=None):
+    """
+    Keyword arguments of h5py create_dataset for the snapshot datasets (snap_t_N, pulse_snap_t_N).
+    The default (all None) is the contiguous, uncompressed float64 layout written by Perturbo.
+
+    Note that lzf is only available in h5py: use gzip for the files read by Perturbo.
+    HDF5 converts float32 datasets to double precision when they are read as double.
+
+    Parameters
+    ----------
+    compression : str, optional
+        HDF5 compression filter: None, 'gzip' or 'lzf'.
+
+    compression_opts : int, optional
+        Compression level for gzip (0-9).
+
+    shuffle : bool, optional
+        Apply the HDF5 shuffle filter before compression. Improves the compression of floats.
+
+    chunks : tuple or bool, optional
+        Chunk shape. Compression requires chunking: if None, h5py guesses the chunk shape.
+
+    dtype : np.dtype, optional
+        Storage data type, e.g. np.float32. Default is the data type of the written array.
+
+    Returns
+    -------
+    options : dict
+        Keyword arguments for h5py.Group.create_dataset.
+    """
+
+    if compression not in (None, 'gzip', 'lzf'):
+        raise ValueError(f"Unknown compression '{compression}'. Options: None, 'gzip', 'lzf'.")
+
+    if compression_opts is not None and compression != 'gzip':
+        raise ValueError('compression_opts is only used with gzip compression.')
+
+    options = {}
+
+    if compression is not None:
+        options['compression'] = compression
+        if compression_opts is not None:
+            options['compression_opts'] = compression_opts
+
+    if shuffle:
+        options['shuffle'] = True
+
+    if chunks is not None:
+        options['chunks'] = chunks
+
+    if dtype is not None:
+        options['dtype'] = np.dtype(dtype)
+
+    return options
+
+
+def storage_size(group, prefix='snap_t_'):
+    """
+    Size of the snapshot datasets of a group, as written and as float64 uncompressed data.
+
+    Parameters
+    ----------
+    group : h5py.Group
+        Group with the snapshot datasets.
+
+    prefix : str, optional
+        Prefix of the names of the snapshot datasets, e.g. 'snap_t_' or 'pulse_snap_t_'.
+
+    Returns
+    -------
+    stored_mb : float
+        Storage size of the datasets in the file (MB).
+
+    raw_mb : float
+        Size of the data as contiguous float64 (MB).
+    """
+
+    stored = 0
+    raw = 0
+
+    for name, dset in group.items():
+        if name.startswith(prefix) and isinstance(dset, h5py.Dataset):
+            stored += dset.id.get_storage_size()
+            raw += dset.size * 8
+
+    return stored / 1024**2, raw / 1024**2
+
+
+def print_storage_size(group, prefix='snap_t_', label='Snapshots'):
+    """
+    Print the storage size of the snapshot datasets of a group, see storage_size.
+    """
+
+    stored_mb, raw_mb = storage_size(group, prefix)
+    ratio = raw_mb / stored_mb if stored_mb > 0 else np.inf
+
+    print(f'{label + " size (MB)":>30}: {stored_mb:.3f} (float64 uncompressed: {raw_mb:.3f}, ratio {ratio:.2f})')
+
+
+def repack_cdyna(cdyna_path, out_path, compression=None, compression_opts=None, shuffle=False,
+                 chunk_steps=16, chunk_mb=1.0, overwrite=False):
+    """
+    Rewrite a prefix_cdyna.h5 file, storing the snap_t_N datasets of each dynamics_run_N group
+    into a single chunked dataset of shape (num_snaps, num_kpoints, num_bands).
+    All the other datasets are copied as is. DynaRun detects and reads both layouts.
+
+    Parameters
+    ----------
+    cdyna_path : str
+        Path to the prefix_cdyna.h5 file written by Perturbo.
+
+    out_path : str
+        Path to the repacked HDF5 file.
+
+    compression : str, optional
+        HDF5 compression filter: None, 'gzip' or 'lzf'.
+
+    compression_opts : int, optional
+        Compression level for gzip (0-9).
+
+    shuffle : bool, optional
+        Apply the HDF5 shuffle filter before compression.
+
+    chunk_steps : int, optional
+        Number of time steps per chunk.
+
+    chunk_mb : float, optional
+        Target chunk size in MB.
+
+    overwrite : bool, optional
+        Overwrite out_path if it exists.
+    """
+
+    trun = TimingGroup('repack cdyna')
+    trun.add('total', level=3).start()
+
+    _check_out_path(cdyna_path, out_path, overwrite)
+
+    cdyna_file = open_hdf5(cdyna_path)
+    new_cdyna_file = open_hdf5(out_path, 'w')
+
+    try:
+        for name in cdyna_file.keys():
+
+            if not name.startswith('dynamics_run_'):
+                cdyna_file.copy(name, new_cdyna_file)
+                continue
+
+            group = cdyna_file[name]
+
+            if is_consolidated(group):
+                raise ValueError(f'{name} of {cdyna_path} is already in the consolidated layout.')
+
+            new_group = new_cdyna_file.create_group(name)
+
+            for key in group.keys():
+                if not key.startswith('snap_t_'):
+                    group.copy(key, new_group)
+
+            steps = snap_steps(group)
+            num_snaps = steps.size
+
+            if not np.array_equal(steps, np.arange(steps[0], steps[0] + num_snaps)):
+                raise ValueError(f'The snap_t_N datasets of {name} are not consecutive.')
+
+            num_kpoints, num_bands = group[f'snap_t_{steps[0]}'].shape
+            dtype = group[f'snap_t_{steps[0]}'].dtype
+
+            chunks = consolidated_chunks(num_snaps, num_kpoints, num_bands, dtype.itemsize, chunk_steps, chunk_mb)
+
+            print(f'Repacking {name}: {num_snaps} snapshots, chunks {chunks}')
+
+            with trun.add('write snaps') as t:
+                dset = new_group.create_dataset(CONSOLIDATED_DSET, shape=(num_snaps, num_kpoints, num_bands),
+                                                dtype=dtype, chunks=chunks, compression=compression,
+                                                compression_opts=compression_opts, shuffle=shuffle)
+                dset.attrs['first_step'] = steps[0]
+
+                # Write one row of chunks at a time
+                buffer = np.empty((chunks[0], num_kpoints, num_bands), dtype=dtype)
+
+                for istart in range(0, num_snaps, chunks[0]):
+                    iend = min(istart + chunks[0], num_snaps)
+                    for i in range(istart, iend):
+                        group[f'snap_t_{steps[i]}'].read_direct(buffer, dest_sel=np.s_[i - istart])
+                    dset[istart:iend] = buffer[:iend - istart]
+
+    finally:
+        close_hdf5(cdyna_file)
+        close_hdf5(new_cdyna_file)
+
+    trun.timings['total'].stop()
+    print(f'{"Input file size (MB)":>30}: {os.path.getsize(cdyna_path) / 1024**2:.3f}')
+    print(f'{"Repacked file size (MB)":>30}: {os.path.getsize(out_path) / 1024**2:.3f}')
+    print(trun)
+
+
+def build_cdyna_vds(cdyna_paths, vds_path, overwrite=False):
+    """
+    Build an HDF5 virtual dataset (VDS) presenting the snapshots of all the dynamics runs
+    of one or several prefix_cdyna.h5 files (e.g. a chain of restarted simulations) as one
+    continuous (num_times, num_kpoints, num_bands) array. No snapshot data is copied:
+    the VDS file only stores the mappings to the source datasets, which must stay in place.
+
+    The snapshots are ordered by file, then by dynamics run, then by step.
+    The initial state snap_t_0 is only kept for the first run of the first file,
+    since a restarted simulation starts from the last snapshot of the previous one.
+
+    The VDS file contains:
+    snaps : virtual dataset, shape (num_times, num_kpoints, num_bands)
+    time_fs : global time grid in fs, shape (num_times,)
+    source_file, source_run, source_step : index of the file in cdyna_paths, dynamics run and N of snap_t_N
+    for each time.
+    band_structure_ryd : copied from the first file.
+
+    Parameters
+    ----------
+    cdyna_paths : str or list of str
+        Paths to the prefix_cdyna.h5 files, in chronological order.
+
+    vds_path : str
+        Path to the HDF5 file with the virtual dataset.
+
+    overwrite : bool, optional
+        Overwrite vds_path if it exists.
+
+    Returns
+    -------
+    time_fs : np.ndarray
+        Global time grid of the virtual dataset in fs.
+    """
+
+    if isinstance(cdyna_paths, str):
+        cdyna_paths = [cdyna_paths]
+
+    for cdyna_path in cdyna_paths:
+        if not os.path.isfile(cdyna_path):
+            raise FileNotFoundError(f'File {cdyna_path} not found')
+
+    if os.path.isfile(vds_path):
+        if overwrite:
+            warnings.warn(f'File {vds_path} already exists. Overwriting it.')
+        else:
+            raise FileExistsError(f'File {vds_path} already exists. Set overwrite=True to overwrite it.')
+
+    # First pass: collect the (file, run, step) of each time and the time grid
+    sources = []
+    times = []
+    shape = None
+    dtype = None
+    band_structure_ryd = None
+    time_end = 0.0
+
+    for ifile, cdyna_path in enumerate(cdyna_paths):
+        with h5py.File(cdyna_path, 'r') as cdyna_file:
+
+            if band_structure_ryd is None:
+                band_structure_ryd = cdyna_file['band_structure_ryd'][()]
+
+            for irun in range(1, cdyna_file['num_runs'][()] + 1):
+                dyn_str = f'dynamics_run_{irun}'
+                group = cdyna_file[dyn_str]
+
+                if shape is None:
+                    shape = snap_shape(group)
+                    dtype = group[CONSOLIDATED_DSET].dtype if is_consolidated(group) else group['snap_t_1'].dtype
+                elif snap_shape(group) != shape:
+                    raise ValueError(f'Shape of the snapshots of {cdyna_path}/{dyn_str} is {snap_shape(group)}, '
+                                     f'expected {shape}.')
+
+                time_step = group['time_step_fs'][()]
+                steps = snap_steps(group)
+
+                # Keep snap_t_0 only at the very beginning of the trajectory
+                if len(sources) > 0:
+                    steps = steps[steps > 0]
+
+                for step in steps:
+                    sources.append((ifile, irun, step))
+                    times.append(time_end + step * time_step)
+
+                time_end = times[-1]
+
+    sources = np.array(sources, dtype=int)
+    time_fs = np.array(times)
+    num_times = time_fs.size
+
+    # Second pass: map the source datasets into the virtual layout
+    layout = h5py.VirtualLayout(shape=(num_times,) + tuple(shape), dtype=dtype)
+
+    itime = 0
+    while itime < num_times:
+        ifile, irun, step = sources[itime]
+        cdyna_path = os.path.abspath(cdyna_paths[ifile])
+        dyn_str = f'dynamics_run_{irun}'
+
+        with h5py.File(cdyna_path, 'r') as cdyna_file:
+            group = cdyna_file[dyn_str]
+
+            if is_consolidated(group):
+                dset = group[CONSOLIDATED_DSET]
+                first_step = int(dset.attrs['first_step'])
+                vsource = h5py.VirtualSource(dset)
+
+                # All the remaining times of this run map to one slab
+                num = np.sum((sources[itime:, 0] == ifile) & (sources[itime:, 1] == irun))
+                layout[itime:itime + num] = vsource[step - first_step:step - first_step + num]
+                itime += num
+            else:
+                while itime < num_times and sources[itime, 0] == ifile and sources[itime, 1] == irun:
+                    step = sources[itime, 2]
+                    layout[itime] = h5py.VirtualSource(cdyna_path, f'{dyn_str}/snap_t_{step}', shape=tuple(shape))
+                    itime += 1
+
+    with h5py.File(vds_path, 'w') as vds_file:
+        vds_file.create_virtual_dataset(CONSOLIDATED_DSET, layout)
+        vds_file.create_dataset('time_fs', data=time_fs)
+        vds_file['time_fs'].attrs['units'] = 'fs'
+        vds_file.create_dataset('source_file', data=sources[:, 0])
+        vds_file.create_dataset('source_run', data=sources[:, 1])
+        vds_file.create_dataset('source_step', data=sources[:, 2])
+        vds_file.attrs['cdyna_paths'] = [os.path.abspath(p) for p in cdyna_paths]
+        vds_file.create_dataset('band_structure_ryd', data=band_structure_ryd)
+
+    print(f'{"Virtual dataset shape":>30}: {(num_times,) + tuple(shape)}')
+    print(f'{"Time range (fs)":>30}: {time_fs[0]:.3f} - {time_fs[-1]:.3f}')
+
+    return time_fs
+
+
+def repack_popu(popu_path, out_path, chunk_times=256, compression=None, compression_opts=None,
+                shuffle=False, overwrite=False):
+    """
+    Rewrite a prefix_popu.h5 file of a dynamics-pp calculation, storing the popu_tN datasets
+    of the energy_distribution group into a single chunked dataset of shape (num_energies, num_times).
+    All the other datasets are copied as is. DynaPP detects and reads both layouts.
+
+    Parameters
+    ----------
+    popu_path : str
+        Path to the prefix_popu.h5 file written by Perturbo.
+
+    out_path : str
+        Path to the repacked HDF5 file.
+
+    chunk_times : int, optional
+        Number of times per chunk.
+
+    compression : str, optional
+        HDF5 compression filter: None, 'gzip' or 'lzf'.
+
+    compression_opts : int, optional
+        Compression level for gzip (0-9).
+
+    shuffle : bool, optional
+        Apply the HDF5 shuffle filter before compression.
+
+    overwrite : bool, optional
+        Overwrite out_path if it exists.
+    """
+
+    trun = TimingGroup('repack popu')
+    trun.add('total', level=3).start()
+
+    _check_out_path(popu_path, out_path, overwrite)
+
+    with h5py.File(popu_path, 'r') as popu_file:
+
+        group = popu_file['energy_distribution']
+
+        if CONSOLIDATED_POPU_DSET in group:
+            raise ValueError(f'The energy_distribution group of {popu_path} is already in the consolidated layout.')
+
+        num_times = popu_file['times_fs'].shape[0]
+        num_energies = group['popu_t0'].shape[0]
+        dtype = group['popu_t0'].dtype
+
+        chunk_times = max(1, min(chunk_times, num_times))
+
+        print(f'Repacking energy_distribution: {num_times} times, chunks {(num_energies, chunk_times)}')
+
+        with h5py.File(out_path, 'w') as new_popu_file:
+
+            for name in popu_file.keys():
+                if name != 'energy_distribution':
+                    popu_file.copy(name, new_popu_file)
+
+            new_group = new_popu_file.create_group('energy_distribution')
+
+            for key in group.keys():
+                if not key.startswith('popu_t'):
+                    group.copy(key, new_group)
+
+            with trun.add('write popu') as t:
+                dset = new_group.create_dataset(CONSOLIDATED_POPU_DSET, shape=(num_energies, num_times),
+                                                dtype=dtype, chunks=(num_energies, chunk_times),
+                                                compression=compression, compression_opts=compression_opts,
+                                                shuffle=shuffle)
+
+                # Write one chunk of times at a time
+                buffer = np.empty((chunk_times, num_energies), dtype=dtype)
+
+                for istart in range(0, num_times, chunk_times):
+                    iend = min(istart + chunk_times, num_times)
+                    for itime in range(istart, iend):
+                        group[f'popu_t{itime}'].read_direct(buffer, dest_sel=np.s_[itime - istart])
+                    dset[:, istart:iend] = buffer[:iend - istart].T
+
+    trun.timings['total'].stop()
+    print(f'{"Input file size (MB)":>30}: {os.path.getsize(popu_path) / 1024**2:.3f}')
+    print(f'{"Repacked file size (MB)":>30}: {os.path.getsize(out_path) / 1024**2:.3f}')
+    print(trun)
+
+
+def _check_out_path(in_path, out_path, overwrite):
+    """
+    Check the input file exists and the output file can be written.
+    Shared by all the tools writing a new file from an input file.
+    """
+
+    if not os.path.isfile(in_path):
+        raise FileNotFoundError(f'File {in_path} not found')
+
+    if os.path.abspath(in_path) == os.path.abspath(out_path):
+        raise ValueError('The output file must be different from the input file.')
+
+    if os.path.isfile(out_path):
+        if overwrite:
+            warnings.warn(f'File {out_path} already exists. Overwriting it.')
+        else:
+            raise FileExistsError(f'File {out_path} already exists. Set overwrite=True to overwrite it.')
+
+
+def _locate_step(cdyna_file, irun=None, step=None):
+    """
+    Validate a (dynamics run, step) pair of a cdyna file. By default, the last step of the last run.
+
+    Returns
+    -------
+    irun, step : int
+    """
+
+    num_runs = int(cdyna_file['num_runs'][()])
+
+    if irun is None:
+        irun = num_runs
+
+    if irun < 1 or irun > num_runs:
+        raise ValueError(f'irun must be between 1 and {num_runs}, got {irun}')
+
+    steps = snap_steps(cdyna_file[f'dynamics_run_{irun}'])
+
+    if step is None:
+        step = int(steps[-1])
+
+    if step not in steps:
+        raise ValueError(f'snap_t_{step} not found in dynamics_run_{irun}. Steps: {steps[0]} - {steps[-1]}')
+
+    return irun, step
+
+
+def _copy_snap(group, step, dest_group, name):
+    """
+    Copy the snapshot snap_t_{step} of a dynamics_run_N group into dest_group.
+    A snap_t_N dataset is copied as an HDF5 object (no numpy round trip, storage options kept);
+    a snapshot of the consolidated layout is read and written.
+    """
+
+    if is_consolidated(group):
+        dest_group.create_dataset(name, data=read_snap(group, step))
+    else:
+        group.copy(f'snap_t_{step}', dest_group, name=name)
+
+
+def _copy_metadata(cdyna_file, new_cdyna_file):
+    """
+    Copy the root attributes and all the root objects except the dynamics runs (band structure, etc.).
+    """
+
+    for key, value in cdyna_file.attrs.items():
+        new_cdyna_file.attrs[key] = value
+
+    for name in cdyna_file.keys():
+        if not name.startswith('dynamics_run_') and name != 'num_runs':
+            cdyna_file.copy(name, new_cdyna_file)
+
+
+def extract_restart_seed(cdyna_path, out_path, irun=None, step=None, overwrite=False):
+    """
+    Write a new prefix_cdyna.h5 file with a single snapshot of a dynamics run, e.g. to restart
+    a Perturbo dynamics-run calculation from an intermediate state.
+    The new file has one run, dynamics_run_1, with num_steps = 1: the chosen snapshot is both
+    snap_t_0 and snap_t_1 (a hard link, stored once). The band structure and the other metadata are copied.
+    Only the chosen snapshot is read (HDF5 object copies): the cost does not depend on the size of the file.
+
+    Parameters
+    ----------
+    cdyna_path : str
+        Path to the prefix_cdyna.h5 file.
+
+    out_path : str
+        Path to the new prefix_cdyna.h5 file.
+
+    irun : int, optional
+        Index of the dynamics run. Default is the last run.
+
+    step : int, optional
+        Index N of the snapshot snap_t_N. Default is the last step of the run.
+
+    overwrite : bool, optional
+        Overwrite out_path if it exists.
+
+    Returns
+    -------
+    irun, step : int
+        Dynamics run and step of the extracted snapshot.
+    """
+
+    trun = TimingGroup('restart seed')
+    trun.add('total', level=3).start()
+
+    _check_out_path(cdyna_path, out_path, overwrite)
+
+    with h5py.File(cdyna_path, 'r') as cdyna_file:
+
+        irun, step = _locate_step(cdyna_file, irun, step)
+        group = cdyna_file[f'dynamics_run_{irun}']
+
+        with h5py.File(out_path, 'w') as new_cdyna_file:
+
+            _copy_metadata(cdyna_file, new_cdyna_file)
+            new_cdyna_file.create_dataset('num_runs', data=1)
+
+            new_group = new_cdyna_file.create_group('dynamics_run_1')
+            group.copy('time_step_fs', new_group)
+            new_group.create_dataset('num_steps', data=1)
+
+            _copy_snap(group, step, new_group, 'snap_t_0')
+            new_group['snap_t_1'] = new_group['snap_t_0']
+
+    trun.timings['total'].stop()
+    print(f'{"Restart seed":>30}: dynamics_run_{irun}/snap_t_{step}')
+    print(f'{"Total time":>30}: {trun.timings["total"].t_delta:.4f} s')
+
+    return irun, step
+
+
+def truncate_cdyna(cdyna_path, out_path, irun=None, step=None, overwrite=False):
+    """
+    Write a copy of a prefix_cdyna.h5 file truncated after the snapshot snap_t_{step} of dynamics_run_{irun}:
+    the later steps and runs are dropped. The last snapshot of the new file is the restart point
+    of a Perturbo dynamics-run calculation.
+    The kept runs and snapshots are HDF5 object copies (no numpy round trip, storage options kept);
+    a run in the consolidated layout is copied in blocks of its chunks.
+
+    A new file is written since HDF5 does not reclaim the space of deleted datasets.
+
+    Parameters
+    ----------
+    cdyna_path : str
+        Path to the prefix_cdyna.h5 file.
+
+    out_path : str
+        Path to the truncated prefix_cdyna.h5 file.
+
+    irun : int, optional
+        Index of the last dynamics run to keep. Default is the last run.
+
+    step : int, optional
+        Index N of the last snapshot snap_t_N to keep in dynamics_run_{irun}. Default is the last step.
+
+    overwrite : bool, optional
+        Overwrite out_path if it exists.
+    """
+
+    trun = TimingGroup('truncate cdyna')
+    trun.add('total', level=3).start()
+
+    _check_out_path(cdyna_path, out_path, overwrite)
+
+    with h5py.File(cdyna_path, 'r') as cdyna_file:
+
+        irun, step = _locate_step(cdyna_file, irun, step)
+
+        if step < 1:
+            raise ValueError('A run must keep at least one step: step must be >= 1. '
+                             'Use extract_restart_seed to keep the initial state only.')
+
+        with h5py.File(out_path, 'w') as new_cdyna_file:
+
+            _copy_metadata(cdyna_file, new_cdyna_file)
+            new_cdyna_file.create_dataset('num_runs', data=irun)
+
+            # The previous runs are copied as a whole
+            for jrun in range(1, irun):
+                cdyna_file.copy(f'dynamics_run_{jrun}', new_cdyna_file)
+
+            dyn_str = f'dynamics_run_{irun}'
+            group = cdyna_file[dyn_str]
+            new_group = new_cdyna_file.create_group(dyn_str)
+
+            for key in group.keys():
+                if not key.startswith('snap_t_') and key not in ('num_steps', CONSOLIDATED_DSET):
+                    group.copy(key, new_group)
+
+            new_group.create_dataset('num_steps', data=step)
+
+            steps = snap_steps(group)
+            kept_steps = steps[steps <= step]
+
+            if is_consolidated(group):
+                dset = group[CONSOLIDATED_DSET]
+                num_snaps = kept_steps.size
+
+                chunks = None
+                if dset.chunks is not None:
+                    chunks = (min(dset.chunks[0], num_snaps),) + dset.chunks[1:]
+
+                new_dset = new_group.create_dataset(CONSOLIDATED_DSET, shape=(num_snaps,) + dset.shape[1:],
+                                                    dtype=dset.dtype, chunks=chunks, compression=dset.compression,
+                                                    compression_opts=dset.compression_opts, shuffle=dset.shuffle)
+                new_dset.attrs['first_step'] = dset.attrs['first_step']
+
+                # Copy one row of chunks at a time
+                block = chunks[0] if chunks is not None else num_snaps
+                for istart in range(0, num_snaps, block):
+                    iend = min(istart + block, num_snaps)
+                    new_dset[istart:iend] = dset[istart:iend]
+            else:
+                for kept_step in kept_steps:
+                    group.copy(f'snap_t_{kept_step}', new_group)
+
+    trun.timings['total'].stop()
+    print(f'{"Truncated after":>30}: dynamics_run_{irun}/snap_t_{step}')
+    print(f'{"Truncated file size (MB)":>30}: {os.path.getsize(out_path) / 1024**2:.3f}')
+    print(f'{"Total time":>30}: {trun.timings["total"].t_delta:.4f} s')
+
+
+def repack_cdyna_cli():
+    """
+    Console script: repack a prefix_cdyna.h5 file into the consolidated snapshot layout.
+    """
+
+    parser = argparse.ArgumentParser(
+        description='Rewrite a Perturbo prefix_cdyna.h5 file, storing the snap_t_N datasets '
+                    'of each dynamics run into a single chunked (num_snaps, num_kpoints, num_bands) dataset.')
+    parser.add_argument('cdyna_path', help='Input prefix_cdyna.h5 file.')
+    parser.add_argument('out_path', help='Output (repacked) HDF5 file.')
+    parser.add_argument('--compression', choices=['gzip', 'lzf'], default=None, help='Compression filter.')
+    parser.add_argument('--level', type=int, default=None, help='gzip compression level (0-9).')
+    parser.add_argument('--shuffle', action='store_true', help='Apply the shuffle filter.')
+    parser.add_argument('--chunk-steps', type=int, default=16, help='Number of time steps per chunk. Default is 16.')
+    parser.add_argument('--chunk-mb', type=float, default=1.0, help='Target chunk size in MB. Default is 1.')
+    parser.add_argument('--overwrite', action='store_true', help='Overwrite the output file.')
+
+    args = parser.parse_args()
+
+    repack_cdyna(args.cdyna_path, args.out_path, compression=args.compression, compression_opts=args.level,
+                 shuffle=args.shuffle, chunk_steps=args.chunk_steps, chunk_mb=args.chunk_mb,
+                 overwrite=args.overwrite)
+
+
+def restart_cdyna_cli():
+    """
+    Console script: extract a restart seed from a prefix_cdyna.h5 file, or truncate it after a step.
+    """
+
+    parser = argparse.ArgumentParser(
+        description='Write a new Perturbo prefix_cdyna.h5 file with a single snapshot of a dynamics run '
+                    '(restart seed), or with all the snapshots up to a step (--truncate).')
+    parser.add_argument('cdyna_path', help='Input prefix_cdyna.h5 file.')
+    parser.add_argument('out_path', help='Output prefix_cdyna.h5 file.')
+    parser.add_argument('--run', type=int, default=None, help='Dynamics run. Default is the last run.')
+    parser.add_argument('--step', type=int, default=None, help='Step N of snap_t_N. Default is the last step.')
+    parser.add_argument('--truncate', action='store_true',
+                        help='Keep all the snapshots up to the step instead of the single snapshot.')
+    parser.add_argument('--overwrite', action='store_true', help='Overwrite the output file.')
+
+    args = parser.parse_args()
+
+    if args.truncate:
+        truncate_cdyna(args.cdyna_path, args.out_path, args.run, args.step, overwrite=args.overwrite)
+    else:
+        extract_restart_seed(args.cdyna_path, args.out_path, args.run, args.step, overwrite=args.overwrite)
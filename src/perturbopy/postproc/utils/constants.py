@@ -317,3 +317,31 @@ def hbar(units):
         raise ValueError(f"Please choose hbar units from the following list: {list(hbar_dict.keys())}")
 
     return hbar_dict[units][0] * (10 ** hbar_dict[units][1])
+
+
+def boltzmann(units):
+    """
+    find the value of the Boltzmann constant for specific units.
+
+    Parameters
+    ----------
+    units : str
+       The units the Boltzmann constant should be returned in.
+
+    Returns
+    -------
+    kb : float
+       The value of the Boltzmann constant in the specified units.
+
+    Raises
+    ------
+    ValueError
+        If `units` is not in the keys of `kb_dict`
+
+    """
+    kb_dict = {'ev/K': (8.617333262, -5), 'Ry/K': (6.333623318, -6), 'J/K': (1.380649, -23)}
+
+    if units not in kb_dict.keys():
+        raise ValueError(f"Please choose Boltzmann constant units from the following list: {list(kb_dict.keys())}")
+
+    return kb_dict[units][0] * (10 ** kb_dict[units][1])
@@ -0,0 +1,13 @@
+"""
+Line shapes shared by the pump pulse and the transient absorption modules.
+Only depends on numpy, so that it can be imported from the databases (e.g. TransitionEnergies).
+"""
+import numpy as np
+
+
+def gaussian(x, mu, sigma):
+    """
+    Gaussian function. Not normalized.
+    """
+
+    return np.exp(-0.5 * ((x - mu) / sigma)**2)
@@ -0,0 +1,903 @@
+"""
+Utils for lazy access to the carrier occupation snapshots (snap_t_N datasets)
+stored in the prefix_cdyna.h5 file of a dynamics-run calculation,
+and to the carrier populations (popu_tN datasets) of the prefix_popu.h5 file of a dynamics-pp calculation.
+"""
+
+import re
+import queue
+import threading
+import weakref
+import multiprocessing
+import numpy as np
+import h5py
+from collections import OrderedDict
+from concurrent.futures import ProcessPoolExecutor
+from multiprocessing import shared_memory
+
+# Name of the single (num_snaps, num_kpoints, num_bands) dataset of a repacked dynamics_run_N group
+CONSOLIDATED_DSET = 'snaps'
+
+# Name of the single (num_energies, num_times) dataset of a repacked energy_distribution group
+CONSOLIDATED_POPU_DSET = 'popu'
+
+
+def is_consolidated(group):
+    """
+    Check if a dynamics_run_N group stores its snapshots in the consolidated layout
+    (one 3D dataset) instead of one snap_t_N dataset per step.
+    """
+
+    return CONSOLIDATED_DSET in group
+
+
+def snap_shape(group):
+    """
+    Shape (num_kpoints, num_bands) of one snapshot of a dynamics_run_N group.
+    """
+
+    if is_consolidated(group):
+        return group[CONSOLIDATED_DSET].shape[1:]
+
+    # a dynamics run must have at least one snap
+    return group['snap_t_1'].shape
+
+
+def snap_steps(group):
+    """
+    Sorted indices N of the snapshots snap_t_N of a dynamics_run_N group, for either layout.
+    """
+
+    if is_consolidated(group):
+        dset = group[CONSOLIDATED_DSET]
+        first_step = int(dset.attrs['first_step'])
+        return np.arange(first_step, first_step + dset.shape[0])
+
+    pattern = re.compile(r'^snap_t_(\d+)$')
+    steps = [int(m.group(1)) for m in map(pattern.match, group.keys()) if m]
+
+    return np.array(sorted(steps), dtype=int)
+
+
+def read_snap(group, step, kslice=slice(None)):
+    """
+    Read the snapshot snap_t_{step} of a dynamics_run_N group, for either layout.
+
+    Parameters
+    ----------
+    group : h5py.Group
+        The dynamics_run_N group of a cdyna HDF5 file.
+
+    step : int
+        Index N of the snap_t_N snapshot.
+
+    kslice : slice, optional
+        Contiguous range of k-points to read. Default is all the k-points.
+
+    Returns
+    -------
+    snap : np.ndarray
+        Occupations. Shape: (num_kpoints, num_bands).
+    """
+
+    if is_consolidated(group):
+        dset = group[CONSOLIDATED_DSET]
+        return dset[step - dset.attrs['first_step'], kslice]
+
+    return group[f'snap_t_{step}'][kslice]
+
+
+def subset_index(index, size, name='index'):
+    """
+    Convert a subset of bands or k-points, given by indices or by a boolean mask, into an index array.
+
+    Parameters
+    ----------
+    index : array_like or None
+        Indices (0-based) or boolean mask of length size. None means all.
+
+    size : int
+        Number of bands or k-points.
+
+    name : str, optional
+        Name of the subset for the error messages.
+
+    Returns
+    -------
+    index : np.ndarray or None
+        Indices of the subset, None if index is None.
+    """
+
+    if index is None:
+        return None
+
+    index = np.asarray(index)
+
+    if index.dtype == bool:
+        if index.shape != (size,):
+            raise ValueError(f'The boolean mask {name} must have shape ({size},), got {index.shape}')
+        index = np.nonzero(index)[0]
+    else:
+        index = index.astype(int).ravel()
+        if np.any(index < -size) or np.any(index >= size):
+            raise ValueError(f'{name} out of range for size {size}')
+        index = np.mod(index, size)
+
+    if index.size == 0:
+        raise ValueError(f'{name} selects nothing')
+
+    return index
+
+
+def normalize_key(key, ndim):
+    """
+    Convert a numpy-style index into a tuple of exactly ndim entries.
+    Ellipsis is expanded and missing trailing axes are filled with full slices.
+    """
+
+    if not isinstance(key, tuple):
+        key = (key,)
+
+    if any(k is None for k in key):
+        raise IndexError('np.newaxis is not supported for the snapshot arrays')
+
+    num_ellipsis = sum(k is Ellipsis for k in key)
+
+    if num_ellipsis > 1:
+        raise IndexError('An index can only have a single ellipsis (...)')
+
+    if num_ellipsis == 1:
+        iell = next(i for i, k in enumerate(key) if k is Ellipsis)
+        fill = (slice(None),) * (ndim - len(key) + 1)
+        key = key[:iell] + fill + key[iell + 1:]
+
+    if len(key) > ndim:
+        raise IndexError(f'Too many indices: array is {ndim}-dimensional, but {len(key)} were indexed')
+
+    return key + (slice(None),) * (ndim - len(key))
+
+
+def _split_axis_key(key, size):
+    """
+    Split the index of one axis into a part applied when reading (basic indexing)
+    and a part applied to the data that was read (to reproduce the numpy semantics).
+
+    Returns
+    -------
+    read_key : slice
+        Slice applied at the reading stage.
+
+    final_key : int, slice, or np.ndarray
+        Index applied to the read data.
+    """
+
+    if isinstance(key, (int, np.integer)):
+        idx = range(size)[key]
+        return slice(idx, idx + 1), 0
+
+    if isinstance(key, slice):
+        return key, slice(None)
+
+    return slice(None), np.asarray(key)
+
+
+class SnapshotArray():
+    """
+    Lazy, read-only array-like view of the carrier occupations of one dynamics run.
+    The data stays in the HDF5 file, only the snap_t_N datasets required by a given slice are read.
+    Both the per-step layout written by Perturbo and the consolidated layout (see cdyna_tools.repack_cdyna)
+    are supported.
+    The most recently read snapshots are kept in a bounded LRU cache.
+
+    Indexing follows numpy: snap_t[band, k-point, time], the same layout as the dense array
+    returned when the snapshots are read at initialization.
+
+    Attributes
+    ----------
+    shape : tuple
+        Shape of the array: (num_bands, num_kpoints, num_steps).
+
+    dtype : np.dtype
+        Data type of the returned arrays.
+
+    cache_size : int
+        Maximum number of snapshots kept in the LRU cache.
+
+    band_index, kpoint_index : np.ndarray or None
+        Subsets of bands and k-points (indices of the columns and rows of the snapshots), None for all.
+
+    _group : h5py.Group
+        The dynamics_run_N group of the cdyna HDF5 file.
+
+    _steps : np.ndarray
+        Indices N of the snap_t_N datasets, one per time step.
+
+    _cache : OrderedDict
+        LRU cache of the snapshots read from the file. Keys are the step indices N.
+
+    _kslice : slice
+        Range of k-points read from the file, bounding kpoint_index.
+    """
+
+    def __init__(self, group, steps, cache_size=16, dtype=np.float64, band_index=None, kpoint_index=None):
+        """
+        Constructor method
+
+        Parameters
+        ----------
+        group : h5py.Group
+            The dynamics_run_N group of an open cdyna HDF5 file.
+
+        steps : array_like
+            Indices N of the snap_t_N datasets in time order.
+
+        cache_size : int, optional
+            Maximum number of snapshots kept in memory. Set to 0 to disable caching.
+
+        dtype : np.dtype, optional
+            Data type of the returned arrays.
+
+        band_index, kpoint_index : array_like, optional
+            Subsets of bands and k-points, as indices or boolean masks (see subset_index).
+            Only the selected occupations are kept in memory. Default is all.
+        """
+
+        self._group = group
+        self._steps = np.asarray(steps, dtype=int)
+
+        if self._steps.ndim != 1 or self._steps.size == 0:
+            raise ValueError('steps must be a non-empty 1D array of snapshot indices')
+
+        self.cache_size = cache_size
+        self.dtype = np.dtype(dtype)
+        self._cache = OrderedDict()
+
+        numk, numb = snap_shape(group)
+
+        self.band_index = subset_index(band_index, numb, 'band_index')
+        self.kpoint_index = subset_index(kpoint_index, numk, 'kpoint_index')
+
+        self._kslice = slice(None)
+        self._kpoint_local = self.kpoint_index
+
+        if self.kpoint_index is not None:
+            # Read the bounding range of k-points only
+            kmin = int(np.min(self.kpoint_index))
+            self._kslice = slice(kmin, int(np.max(self.kpoint_index)) + 1)
+            self._kpoint_local = self.kpoint_index - kmin
+            numk = self.kpoint_index.size
+
+        if self.band_index is not None:
+            numb = self.band_index.size
+
+        self.shape = (numb, numk, self._steps.size)
+
+    @property
+    def ndim(self):
+        return len(self.shape)
+
+    @property
+    def size(self):
+        return int(np.prod(self.shape))
+
+    @property
+    def num_steps(self):
+        return self.shape[2]
+
+    def __len__(self):
+        return self.shape[0]
+
+    def __repr__(self):
+        return f'SnapshotArray(shape={self.shape}, dtype={self.dtype}, group={self._group.name})'
+
+    def __array__(self, dtype=None, copy=None):
+        arr = self[...]
+        if dtype is not None:
+            arr = arr.astype(dtype, copy=False)
+        return arr
+
+    def _read_step(self, step):
+        """
+        Read the snap_t_{step} snapshot from the file, for the k-points of _kslice.
+        """
+
+        return read_snap(self._group, step, self._kslice)
+
+    def _select(self, snap):
+        """
+        Select the subsets of k-points and bands of a snapshot read by _read_step.
+        """
+
+        if self._kpoint_local is not None and self.band_index is not None:
+            return snap[np.ix_(self._kpoint_local, self.band_index)]
+        if self._kpoint_local is not None:
+            return snap[self._kpoint_local]
+        if self.band_index is not None:
+            return snap[:, self.band_index]
+
+        return snap
+
+    def get_step(self, itime):
+        """
+        Get the occupations for the time index itime, using the LRU cache.
+        Only the subsets of k-points and bands are returned.
+
+        Parameters
+        ----------
+        itime : int
+            Time index, starting from 0.
+
+        Returns
+        -------
+        snap : np.ndarray
+            Occupations at time index itime. Shape: (num_kpoints, num_bands) of the subsets.
+        """
+
+        step = int(self._steps[itime])
+
+        if step in self._cache:
+            self._cache.move_to_end(step)
+            return self._cache[step]
+
+        snap = np.asarray(self._select(self._read_step(step)), dtype=self.dtype)
+
+        if self.cache_size > 0:
+            self._cache[step] = snap
+            while len(self._cache) > self.cache_size:
+                self._cache.popitem(last=False)
+
+        return snap
+
+    def clear_cache(self):
+        """
+        Remove all the snapshots from the LRU cache.
+        """
+
+        self._cache.clear()
+
+    def __getitem__(self, key):
+        """
+        Numpy-style indexing over (band, k-point, time).
+        Only the snapshots selected along the time axis are read.
+        """
+
+        band_key, k_key, time_key = normalize_key(key, self.ndim)
+
+        band_read, band_final = _split_axis_key(band_key, self.shape[0])
+        k_read, k_final = _split_axis_key(k_key, self.shape[1])
+
+        # Time indices of the snapshots to read
+        time_idx = np.arange(self.num_steps)[time_key]
+
+        if np.ndim(time_idx) == 0:
+            read_idx = np.array([time_idx])
+            time_final = 0
+        elif isinstance(time_key, slice):
+            read_idx = time_idx
+            time_final = slice(None)
+        else:
+            read_idx, inverse = np.unique(time_idx, return_inverse=True)
+            time_final = inverse.reshape(time_idx.shape)
+
+        # Shape of the read block after the basic (slice) indexing of bands and k-points
+        nb = len(range(*band_read.indices(self.shape[0])))
+        nk = len(range(*k_read.indices(self.shape[1])))
+
+        block = np.empty((nb, nk, read_idx.size), dtype=self.dtype)
+
+        for i, itime in enumerate(read_idx):
+            block[:, :, i] = self.get_step(itime)[k_read, band_read].T
+
+        return block[band_final, k_final, time_final]
+
+
+def mappable_offset(dset):
+    """
+    Byte offset of a dataset in its file if the data can be memory-mapped, i.e. stored contiguous
+    (not chunked, hence not compressed), allocated, not virtual or external, in a file opened
+    with the default (sec2) driver. Perturbo writes the snap_t_N datasets in this layout.
+
+    Parameters
+    ----------
+    dset : h5py.Dataset
+
+    Returns
+    -------
+    offset : int or None
+        Byte offset of the data from the beginning of the file, None if the dataset cannot be mapped.
+    """
+
+    if dset.file.driver != 'sec2' or dset.chunks is not None or dset.is_virtual or dset.external:
+        return None
+
+    if dset.dtype.kind not in 'fiu':
+        return None
+
+    return dset.id.get_offset()
+
+
+class MemmapSnapshotArray(SnapshotArray):
+    """
+    SnapshotArray reading the snapshots through a read-only memory map of the cdyna file
+    instead of h5py, when their layout allows it (see mappable_offset): a snapshot is then a numpy view
+    of the map, served by the OS page cache without any copy. The snapshots that cannot be mapped
+    (chunked or compressed datasets) are read with h5py.
+
+    The snapshots returned by get_step are read-only.
+
+    Attributes
+    ----------
+    _file_map : np.memmap
+        Read-only byte map of the whole file, created on the first mapped read.
+
+    _offsets : dict
+        Byte offset of each snapshot (None if it cannot be mapped). Keys are the step indices N.
+    """
+
+    def __init__(self, group, steps, cache_size=16, dtype=np.float64, band_index=None, kpoint_index=None):
+        """
+        Constructor method. See SnapshotArray.
+        """
+
+        super().__init__(group, steps, cache_size=cache_size, dtype=dtype, band_index=band_index,
+                         kpoint_index=kpoint_index)
+
+        self._file_map = None
+        self._offsets = {}
+        self._snap_dtype = None
+        self._snap_shape = snap_shape(group)
+
+        if is_consolidated(group):
+            dset = group[CONSOLIDATED_DSET]
+            offset = mappable_offset(dset)
+            first_step = int(dset.attrs['first_step'])
+            snap_nbytes = int(np.prod(self._snap_shape)) * dset.dtype.itemsize
+
+            # The consolidated dataset is one contiguous block: the offsets of all the snapshots are known
+            if offset is not None:
+                self._snap_dtype = dset.dtype
+                self._offsets = {step: offset + (step - first_step) * snap_nbytes for step in self._steps}
+
+    def __repr__(self):
+        return f'MemmapSnapshotArray(shape={self.shape}, dtype={self.dtype}, group={self._group.name})'
+
+    def _offset(self, step):
+        """
+        Byte offset of the snap_t_{step} snapshot in the file, None if it cannot be mapped.
+        """
+
+        if step not in self._offsets:
+            offset = None
+
+            if not is_consolidated(self._group):
+                dset = self._group[f'snap_t_{step}']
+                offset = mappable_offset(dset)
+
+                if offset is not None:
+                    if self._snap_dtype is None:
+                        self._snap_dtype = dset.dtype
+                    elif dset.dtype != self._snap_dtype:
+                        offset = None
+
+            self._offsets[step] = offset
+
+        return self._offsets[step]
+
+    def is_mapped(self, itime):
+        """
+        Check if the snapshot of the time index itime is read through the memory map.
+        """
+
+        return self._offset(int(self._steps[itime])) is not None
+
+    def _read_step(self, step):
+        """
+        View of the snap_t_{step} snapshot (k-points of _kslice) in the memory map,
+        or h5py read if it cannot be mapped.
+        """
+
+        offset = self._offset(step)
+
+        if offset is None:
+            return read_snap(self._group, step, self._kslice)
+
+        if self._file_map is None:
+            self._file_map = np.memmap(self._group.file.filename, dtype=np.uint8, mode='r')
+
+        nbytes = int(np.prod(self._snap_shape)) * self._snap_dtype.itemsize
+
+        return self._file_map[offset:offset + nbytes].view(self._snap_dtype).reshape(self._snap_shape)[self._kslice]
+
+
+class PopuArray():
+    """
+    Lazy, read-only array-like view of the carrier populations of a dynamics-pp calculation
+    (energy_distribution group of the prefix_popu.h5 file). Only the times selected by a slice are read,
+    from the popu_tN datasets written by Perturbo or from the consolidated layout (see cdyna_tools.repack_popu).
+
+    Indexing follows numpy: popu[energy, time].
+
+    Attributes
+    ----------
+    shape : tuple
+        Shape of the array: (num_energies, num_times).
+
+    dtype : np.dtype
+        Data type of the returned arrays.
+
+    _group : h5py.Group
+        The energy_distribution group of the popu HDF5 file.
+    """
+
+    def __init__(self, group, num_times, dtype=np.float64):
+        """
+        Constructor method
+
+        Parameters
+        ----------
+        group : h5py.Group
+            The energy_distribution group of an open popu HDF5 file.
+
+        num_times : int
+            Number of times.
+
+        dtype : np.dtype, optional
+            Data type of the returned arrays.
+        """
+
+        self._group = group
+        self.dtype = np.dtype(dtype)
+
+        if CONSOLIDATED_POPU_DSET in group:
+            num_energies = group[CONSOLIDATED_POPU_DSET].shape[0]
+        else:
+            num_energies = group['popu_t0'].shape[0]
+
+        self.shape = (num_energies, num_times)
+
+    @property
+    def ndim(self):
+        return 2
+
+    @property
+    def size(self):
+        return int(np.prod(self.shape))
+
+    def __len__(self):
+        return self.shape[0]
+
+    def __repr__(self):
+        return f'PopuArray(shape={self.shape}, dtype={self.dtype})'
+
+    def __array__(self, dtype=None, copy=None):
+        arr = self[...]
+        if dtype is not None:
+            arr = arr.astype(dtype, copy=False)
+        return arr
+
+    def read_times(self, itimes):
+        """
+        Read the populations of the given time indices.
+
+        Parameters
+        ----------
+        itimes : array_like
+            Time indices, increasing.
+
+        Returns
+        -------
+        popu : np.ndarray
+            Populations. Shape: (num_energies, len(itimes)).
+        """
+
+        if not self._group:
+            raise ValueError('The popu HDF5 file is closed: the lazy popu array cannot be read anymore.')
+
+        itimes = np.asarray(itimes, dtype=int)
+        popu = np.empty((itimes.size, self.shape[0]), dtype=self.dtype)
+
+        if CONSOLIDATED_POPU_DSET in self._group:
+            dset = self._group[CONSOLIDATED_POPU_DSET]
+            if itimes.size > 0 and np.all(np.diff(itimes) == 1):
+                return np.asarray(dset[:, itimes[0]:itimes[-1] + 1], dtype=self.dtype)
+            for i, itime in enumerate(itimes):
+                popu[i] = dset[:, itime]
+        else:
+            for i, itime in enumerate(itimes):
+                self._group[f'popu_t{itime}'].read_direct(popu, dest_sel=np.s_[i])
+
+        return popu.T
+
+    def __getitem__(self, key):
+        """
+        Numpy-style indexing over (energy, time). Only the selected times are read.
+        """
+
+        energy_key, time_key = normalize_key(key, self.ndim)
+
+        time_idx = np.arange(self.shape[1])[time_key]
+
+        if np.ndim(time_idx) == 0:
+            return self.read_times([time_idx])[energy_key, 0]
+
+        read_idx, inverse = np.unique(time_idx, return_inverse=True)
+
+        # Both keys are applied at once, so that two index arrays are paired (broadcast) as in numpy
+        return self.read_times(read_idx)[energy_key, inverse.reshape(time_idx.shape)]
+
+
+def _read_popu_worker(popu_path, itimes, shm_name, shape, istart):
+    """
+    Read the popu_tN datasets of the time indices itimes into the rows istart, istart + 1, ...
+    of the (num_times, num_energies) array of the shared memory block shm_name.
+    Runs in a worker process, with its own read-only handle of the file.
+    """
+
+    shm = shared_memory.SharedMemory(name=shm_name)
+
+    try:
+        popu = np.ndarray(shape, dtype=np.float64, buffer=shm.buf)
+
+        with h5py.File(popu_path, 'r') as popu_file:
+            group = popu_file['energy_distribution']
+            for i, itime in enumerate(itimes):
+                group[f'popu_t{itime}'].read_direct(popu, dest_sel=np.s_[istart + i])
+
+        del popu
+    finally:
+        shm.close()
+
+
+def read_popu_shared(popu_path, num_times, n_workers=2):
+    """
+    Read the popu_tN datasets of a prefix_popu.h5 file in worker processes into a shared memory block,
+    see read_snaps_shared.
+
+    Parameters
+    ----------
+    popu_path : str
+        Path to the prefix_popu.h5 file.
+
+    num_times : int
+        Number of times.
+
+    n_workers : int, optional
+        Number of worker processes.
+
+    Returns
+    -------
+    popu : np.ndarray
+        Populations. Shape: (num_energies, num_times), a view of the shared memory block.
+    """
+
+    with h5py.File(popu_path, 'r') as popu_file:
+        num_energies = popu_file['energy_distribution']['popu_t0'].shape[0]
+
+    shape = (num_times, num_energies)
+
+    shm = shared_memory.SharedMemory(create=True, size=max(num_times * num_energies * 8, 1))
+
+    try:
+        with ProcessPoolExecutor(max_workers=n_workers, mp_context=multiprocessing.get_context('spawn')) as executor:
+            # Disjoint, contiguous ranges of times, one per worker
+            chunks = [chunk for chunk in np.array_split(np.arange(num_times), n_workers) if chunk.size > 0]
+
+            futures = [executor.submit(_read_popu_worker, popu_path, chunk.tolist(), shm.name, shape, int(chunk[0]))
+                       for chunk in chunks]
+
+            for future in futures:
+                future.result()
+
+    except BaseException:
+        shm.close()
+        shm.unlink()
+        raise
+
+    shm.unlink()
+
+    # (num_times, num_energies) in shared memory -> view (num_energies, num_times)
+    return _shared_array(shm, shape, np.float64).T
+
+
+def prefetch(iterable, depth=1):
+    """
+    Iterate over an iterable in a background thread, keeping up to depth items ready.
+    Used to overlap the HDF5 reads of the next snapshots with the computations on the current ones.
+
+    Parameters
+    ----------
+    iterable : iterable
+        Iterable producing the items, typically a generator reading from an HDF5 file.
+
+    depth : int, optional
+        Number of items read ahead.
+
+    Yields
+    ------
+    item
+        Items of iterable, in the same order.
+    """
+
+    done = object()
+    items = queue.Queue(maxsize=max(depth, 1))
+    stop = threading.Event()
+
+    def put(item):
+        # Wait for the consumer, but give up if it stopped iterating
+        while not stop.is_set():
+            try:
+                items.put(item, timeout=0.1)
+                return True
+            except queue.Full:
+                continue
+        return False
+
+    def producer():
+        try:
+            for item in iterable:
+                if not put((item, None)):
+                    return
+        except BaseException as exc:
+            put((done, exc))
+        else:
+            put((done, None))
+
+    thread = threading.Thread(target=producer, daemon=True)
+    thread.start()
+
+    try:
+        while True:
+            item, exc = items.get()
+            if item is done:
+                if exc is not None:
+                    raise exc
+                break
+            yield item
+    finally:
+        stop.set()
+        thread.join()
+
+
+def _shared_array(shm, shape, dtype):
+    """
+    Numpy array of the given shape over the shared memory block shm (created and unlinked by the caller).
+    np.frombuffer wraps the block in its own memoryview, which is the base of the array and of all its views;
+    the block is closed when this memoryview is released, i.e. when the last of these arrays is deleted.
+    """
+
+    arr = np.frombuffer(shm.buf, dtype=dtype, count=int(np.prod(shape)))
+    weakref.finalize(arr.base, shm.close)
+
+    return arr.reshape(shape)
+
+
+def _read_snaps_worker(cdyna_path, dyn_str, steps, shm_name, shape, dtype, istart,
+                       band_index=None, kpoint_index=None):
+    """
+    Read the snapshots snap_t_{steps} of a dynamics run into the rows istart, istart + 1, ...
+    of the (num_steps, num_kpoints, num_bands) array of the shared memory block shm_name.
+    Runs in a worker process, with its own read-only handle of the file.
+    """
+
+    shm = shared_memory.SharedMemory(name=shm_name)
+
+    try:
+        snaps = np.ndarray(shape, dtype=dtype, buffer=shm.buf)
+
+        with h5py.File(cdyna_path, 'r') as cdyna_file:
+            group = cdyna_file[dyn_str]
+
+            if band_index is not None or kpoint_index is not None:
+                snap_array = SnapshotArray(group, steps, cache_size=0, dtype=dtype, band_index=band_index,
+                                           kpoint_index=kpoint_index)
+                for i in range(len(steps)):
+                    snaps[istart + i] = snap_array.get_step(i)
+
+            elif is_consolidated(group):
+                dset = group[CONSOLIDATED_DSET]
+                first = steps[0] - int(dset.attrs['first_step'])
+
+                if np.all(np.diff(steps) == 1):
+                    # Consecutive steps: one slab
+                    dset.read_direct(snaps, source_sel=np.s_[first:first + len(steps)],
+                                     dest_sel=np.s_[istart:istart + len(steps)])
+                else:
+                    for i, step in enumerate(steps):
+                        dset.read_direct(snaps, source_sel=np.s_[first + step - steps[0]],
+                                         dest_sel=np.s_[istart + i])
+            else:
+                for i, step in enumerate(steps):
+                    group[f'snap_t_{step}'].read_direct(snaps, dest_sel=np.s_[istart + i])
+
+        del snaps
+    finally:
+        shm.close()
+
+
+def read_snaps_shared(cdyna_path, dyn_str, steps, n_workers=2, dtype=np.float64, executor=None,
+                      band_index=None, kpoint_index=None):
+    """
+    Read the snapshots of a dynamics run in worker processes, each with its own read-only handle
+    of the HDF5 file (h5py serializes the reads within one process, so threads do not help).
+    Each worker reads a contiguous range of steps directly into a shared memory block,
+    and the parent gets a numpy view of the block without any copy.
+
+    Parameters
+    ----------
+    cdyna_path : str
+        Path to the prefix_cdyna.h5 file.
+
+    dyn_str : str
+        Name of the dynamics_run_N group.
+
+    steps : array_like
+        Indices N of the snap_t_N datasets to read, in time order.
+
+    n_workers : int, optional
+        Number of worker processes.
+
+    dtype : np.dtype, optional
+        Data type of the returned array.
+
+    executor : concurrent.futures.Executor, optional
+        Pool of worker processes, e.g. shared by the reads of several runs.
+        If None, a pool of n_workers processes is created.
+
+    band_index, kpoint_index : array_like, optional
+        Subsets of bands and k-points, as indices or boolean masks (see subset_index). Default is all.
+
+    Returns
+    -------
+    snaps : np.ndarray
+        Occupations. Shape: (num_steps, num_kpoints, num_bands) of the subsets.
+        Backed by shared memory, which is freed when the array and all its views are deleted.
+    """
+
+    steps = np.asarray(steps, dtype=int)
+    dtype = np.dtype(dtype)
+
+    with h5py.File(cdyna_path, 'r') as cdyna_file:
+        group = cdyna_file[dyn_str]
+        num_kpoints, num_bands = snap_shape(group)
+
+    band_index = subset_index(band_index, num_bands, 'band_index')
+    kpoint_index = subset_index(kpoint_index, num_kpoints, 'kpoint_index')
+
+    if band_index is not None:
+        num_bands = band_index.size
+    if kpoint_index is not None:
+        num_kpoints = kpoint_index.size
+
+    shape = (steps.size, num_kpoints, num_bands)
+
+    shm = shared_memory.SharedMemory(create=True, size=max(int(np.prod(shape)) * dtype.itemsize, 1))
+
+    own_executor = executor is None
+    if own_executor:
+        executor = ProcessPoolExecutor(max_workers=n_workers, mp_context=multiprocessing.get_context('spawn'))
+
+    try:
+        # Disjoint, contiguous ranges of steps, one per worker
+        steps_chunks = [chunk for chunk in np.array_split(steps, n_workers) if chunk.size > 0]
+        starts = np.cumsum([0] + [chunk.size for chunk in steps_chunks[:-1]])
+
+        futures = [executor.submit(_read_snaps_worker, cdyna_path, dyn_str, chunk.tolist(), shm.name,
+                                   shape, dtype.str, int(istart), band_index, kpoint_index)
+                   for istart, chunk in zip(starts, steps_chunks)]
+
+        for future in futures:
+            future.result()
+
+    except BaseException:
+        shm.close()
+        shm.unlink()
+        raise
+
+    finally:
+        if own_executor:
+            executor.shutdown()
+
+    # The name is not needed anymore: the memory is released when the last view is deleted
+    shm.unlink()
+
+    return _shared_array(shm, shape, dtype)
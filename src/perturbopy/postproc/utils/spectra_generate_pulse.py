@@ -4,18 +4,22 @@ Utils for ultrafast spectroscopy: pump pulse generation.
 
 import os
 import time
+import multiprocessing
 import numpy as np
 import matplotlib.pyplot as plt
 import warnings
 from scipy import special
+from concurrent.futures import ProcessPoolExecutor
 
 from perturbopy.io_utils.io import open_hdf5, close_hdf5
 
 from perturbopy.postproc import PumpPulse
+from perturbopy.postproc.dbs.transition_energies import TransitionEnergies
 
 from .memory import get_size
 from .timing import TimingGroup
 from .constants import energy_conversion_factor
+from .cdyna_tools import snap_dataset_options, print_storage_size
 
 from . import spectra_plots
 
@@ -80,7 +84,8 @@ def delta_occs_pulse_coef(t, dt, tw, sigma):
 
 
 def gaussian_excitation(pump_file, occs_amplitude, time_grid, time_window, pump_duration, time_step,
-                        hole=False, finite_width=True):
+                        hole=False, finite_width=True, keep_stride=None, compression=None,
+                        compression_opts=None, shuffle=False, chunks=None, storage_dtype=None):
     """
     The Gaussian pulse excitation for the Perturbo dynamics.
     Pump pulses for electrons and holes must be dumped into separate HDF5 files.
@@ -89,6 +94,9 @@ def gaussian_excitation(pump_file, occs_amplitude, time_grid, time_window, pump_
     In Perturbo, step_0 will be initialized with `init_boltz_dist` parameter,
     the pump pulse will be applied starting from step_1.
 
+    The additional occupations of each step, time_profile[t] * occs_amplitude, are computed
+    and written one step at a time, so that the memory footprint does not depend on the number of steps.
+
     Parameters
     ----------
     pump_pulse_file : h5py.File
@@ -115,11 +123,33 @@ def gaussian_excitation(pump_file, occs_amplitude, time_grid, time_window, pump_
         If True, the pulse is finite in time. If False, the pulse is a step function
         and occs_amplitude will be set as initial occupation.
 
+    keep_stride : int, optional
+        If provided, the additional occupations of every keep_stride-th step are kept in memory
+        and returned (e.g. for animation). keep_stride=1 keeps all the steps.
+        Default is None: nothing is kept.
+
+    compression : str, optional
+        HDF5 compression of the pulse_snap_t_N datasets: None, 'gzip' or 'lzf'.
+        Perturbo reads gzip-compressed datasets, lzf is h5py-only.
+
+    compression_opts : int, optional
+        gzip compression level (0-9).
+
+    shuffle : bool, optional
+        If True, apply the HDF5 shuffle filter before compression.
+
+    chunks : tuple or bool, optional
+        Chunk shape of the datasets. Default: contiguous, or guessed by h5py if compressed.
+
+    storage_dtype : np.dtype, optional
+        Storage data type of the datasets, e.g. np.float32 to halve the file size.
+        Default is float64.
+
     Returns
     -------
     array-like or None
-        Return additional occupations array in time, if `finite_widt` is True,
-        else, return None.
+        Return additional occupations array in time, shape (num_bands, num_kept_steps, num_k),
+        if `finite_width` is True and keep_stride is provided, else, return None.
     """
 
     print('\nCreating the pulse dataset...')
@@ -143,121 +173,52 @@ def gaussian_excitation(pump_file, occs_amplitude, time_grid, time_window, pump_
     # 1 for electrons, -1 for holes
     sign = 1 if not hole else -1
 
-    if finite_width:
-        # Additional occupatons for each step due to the pulse
-        delta_occs_array = np.zeros((num_bands, num_steps, num_k))
+    delta_occs_array = None
 
+    dset_options = snap_dataset_options(compression, compression_opts, shuffle, chunks, storage_dtype)
+
+    if finite_width:
         # A pre-factor for the pump pulse, num_steps steps
         pump_time_profile = delta_occs_pulse_coef(time_grid[:], time_step, time_window, sigma)
 
-        # t - time, j - band, k - k-point
-        delta_occs_array[:, :, :] = np.einsum('t,jk->ktj', pump_time_profile[:], occs_amplitude[:, :])
+        if keep_stride is not None:
+            kept_steps = np.arange(0, num_steps, keep_stride)
 
-        # Print the size of the array since it can be large: num_bands * num_steps * num_k
-        get_size(delta_occs_array, f'delta(fnk(t)) {carrier}', dump=True)
+            # Additional occupatons for the kept steps due to the pulse
+            delta_occs_array = np.zeros((num_bands, kept_steps.size, num_k))
+
+            # Print the size of the array since it can be large: num_bands * num_kept_steps * num_k
+            get_size(delta_occs_array, f'delta(fnk(t)) {carrier}', dump=True)
+
+        # Additional occupations of one step, shape (num_k, num_bands)
+        delta_occs = np.empty_like(occs_amplitude, dtype=float)
 
         # Apply pump pulse starting from pulse_snap_t_1
         for itime in range(num_steps):
-            pump_group.create_dataset(f'pulse_snap_t_{itime + 1}',
-                                      data=sign * delta_occs_array[:, itime, :].T)
+            np.multiply(pump_time_profile[itime], occs_amplitude, out=delta_occs)
 
-    else:
-        pump_group.create_dataset('pulse_snap_t_1', data=sign * occs_amplitude.T)
-
-    t_dataset.timings['total'].stop()
+            pump_group.create_dataset(f'pulse_snap_t_{itime + 1}', data=sign * delta_occs, **dset_options)
 
-    print(f'---Pump pulse HDF5 writings time {carrier}: {t_dataset.timings["total"].t_delta:.4f} s---\n')
+            if delta_occs_array is not None and itime % keep_stride == 0:
+                delta_occs_array[:, itime // keep_stride, :] = delta_occs.T
 
-    if finite_width:
-        return delta_occs_array
     else:
-        return None
-
+        pump_group.create_dataset('pulse_snap_t_1', data=sign * occs_amplitude.T, **dset_options)
 
-def setup_pump_pulse(elec_pump_pulse_path, hole_pump_pulse_path,
-                     elec_dyna_run, hole_dyna_run,
-                     pump_energy,
-                     pump_time_step=1.0,
-                     pump_duration_fwhm=20.0,
-                     pump_spectral_width_fwhm=0.090,
-                     pump_time_window=50.0,
-                     pump_factor=0.3,
-                     finite_width=True,
-                     animate=True,
-                     plot_scale=1.0,
-                     cnum_check=True,
-                     tr_dipoles_sqr=None):
-    """
-    Setup the Gaussian pump pulse excitation for electrons and holes.
-    Write into the pump_pulse.h5 HDF5 file.
-    We use raw k-point and energy arrays as read from the HDF5 files for efficiency.
-    All energies in eV, k points in crystal coordinates.
-
-    Pulse duration and energy broadening FWHM are related, typically,
-    pump_spectral_width_fwhm = 1.8 / pump_duration_fwhm.
-    However, here, we leave the possibility to set them independently.
-
-    Parameters
-    ----------
-    elec_pump_pulse_path : str
-        Path to the HDF5 file for the pump pulse excitation for electrons.
-
-    hole_pump_pulse_path : str
-        Path to the HDF5 file for the pump pulse excitation for holes.
-
-    elec_dyna_run : DynamicsRunCalcMode
-        The DynaRun object for electrons from the HDF5 and YAML files.
-        It is expected that the dyanmics was run only for one step, and only dynamics_run_1 group
-        exists in prefix_cdyna.h5 and ZERO electron occupation is setup.
-
-    hole_dyna_run : DynamicsRunCalcMode
-        The DynaRun object for holes from the HDF5 and YAML files. See elec_dyna_run.
-
-    pump_energy : float
-        The energy of the pump pulse (eV)
-
-    pump_time_step : float, optional
-        Time step in fs for the pump pulse generation.
-        Note: the pump_time_step MUST match the one used in the dynamics run in Perturbo!
-
-    pump_duration_fwhm : float, optional
-        The full width at half maximum of the pump pulse (fs).
-
-    pump_spectral_width_fwhm : float, optional
-        Energy broadening FWHM of the pump pulse (eV).
-
-    pump_time_window : float, optional
-        The time window for the pump pulse (fs).
-        During this time window, the pump pulse will be active.
-        The number of the snapshots in the pump_pulse.h5 file will be
-        equal to pump_time_window / pump_time_step.
-
-    pump_factor : float, optional
-        The amplitude of the pump pulse. The maximum occupation will be pump_factor.
+    t_dataset.timings['total'].stop()
 
-    finite_width : bool, optional
-        If True, the pulse is finite in time. If False, the pulse is a step function
-        and occs_amplitude will be set as initial occupation.
+    print_storage_size(pump_group, prefix='pulse_snap_t_', label=f'Pulse {carrier}')
 
-    animate : bool, optional
-        If True, animate the pump pulse excitation.
+    print(f'---Pump pulse HDF5 writings time {carrier}: {t_dataset.timings["total"].t_delta:.4f} s---\n')
 
-    plot_scale : float
-        Scale factor for the scatter object sizes for carrier occupations.
-        Default is 1.0.
+    return delta_occs_array
 
-    cnum_check : bool, optional
-        If True, create a cnum_check folder with a prefix_cdyna.h5 file with the total
-        occupation summed over time steps. Run dynamics-pp with Perturbo (without dynamics-run)
-        to get the accurate total carrier number in the cnum_check folder (link the epr file there).
 
-    tr_dipoles_sqr: np.ndarray, optional
-        Transition dipoles squared, valence-to-conduction for each k-point and band.
-        Currently, the k-grid for dipoles must match the one for electrons.
-        Experimental feature.
+def _check_time_steps(elec_dyna_run, hole_dyna_run, pump_time_step, finite_width):
+    """
+    Warn if the electron, hole and pump pulse time steps differ.
     """
 
-    # Check electron and hole time steps
     elec_dyna_time_step = elec_dyna_run[1].time_step
     hole_dyna_time_step = hole_dyna_run[1].time_step
 
@@ -276,16 +237,30 @@ def setup_pump_pulse(elec_pump_pulse_path, hole_pump_pulse_path,
                       f'is different from the pump pulse time step ({pump_time_step:.3f} fs).',
                       RuntimeWarning)
 
-    # Raw energy and kpoint arrays for electrons and holes
-    elec_energy_array = elec_dyna_run._energies
-    elec_kpoint_array = elec_dyna_run._kpoints
 
-    hole_energy_array = hole_dyna_run._energies
-    hole_kpoint_array = hole_dyna_run._kpoints
+def _pump_band_data(elec_dyna_run, hole_dyna_run, tr_dipoles_sqr=None, trans_energies_dtype=np.float64):
+    """
+    Band data shared by all the pump energies: energies in eV, and the transition energies
+    and transition dipoles on the intersect k-points.
+    The raw arrays of the DynaRun objects are left unchanged.
+
+    Returns
+    -------
+    elec_energy_array, hole_energy_array : np.ndarray
+        Band energies in eV. Shape (num_kpoints, num_bands).
+
+    trans : TransitionEnergies
+        Transition energies, cached on elec_dyna_run.
+
+    tr_weights : np.ndarray or None
+        Transition dipoles squared on the intersect k-points, same shape as trans.energies.
+    """
+
+    # Raw energy arrays for electrons and holes, converted from Ry to eV
+    elec_energy_array = elec_dyna_run._energies * energy_conversion_factor('Ry', 'eV')
+    hole_energy_array = hole_dyna_run._energies * energy_conversion_factor('Ry', 'eV')
 
-    # Convert from Ry to eV
-    elec_energy_array *= energy_conversion_factor('Ry', 'eV')
-    hole_energy_array *= energy_conversion_factor('Ry', 'eV')
+    num_elec_kpoints = elec_dyna_run._kpoints.shape[0]
 
     VBM = np.max(hole_energy_array.ravel())
     CBM = np.min(elec_energy_array.ravel())
@@ -309,62 +284,44 @@ def setup_pump_pulse(elec_pump_pulse_path, hole_pump_pulse_path,
         elec_nbard_tr_dip, hole_nband_tr_dip, num_k_tr_dip = tr_dipoles_sqr.shape
 
         if elec_nbard_tr_dip != elec_nband or hole_nband_tr_dip != hole_nband \
-                or num_k_tr_dip != elec_kpoint_array.shape[0]:
+                or num_k_tr_dip != num_elec_kpoints:
             raise ValueError(f'Wrong shape of the transition dipoles array: {tr_dipoles_sqr.shape}\n'
-                                f'Expected shape: ({elec_nband}, {hole_nband}, {elec_kpoint_array.shape[0]})')
-
-    elec_occs_amplitude = np.zeros_like(elec_energy_array)
-    hole_occs_amplitude = np.zeros_like(hole_energy_array)
-
-    print('Computing the optically excited occupations...')
-    t_occs = TimingGroup('Setup occupations')
-    t_occs.add('total', level=3).start()
+                             f'Expected shape: ({elec_nband}, {hole_nband}, {num_elec_kpoints})')
 
     # Here, we find the same k points for electrons and holes
     # one-to-one correspondence between elec and hole k points
-    # We transform the 3D k-point arrays into 1D arrays of tuples
-    # Then, intersect1d function is used to find the same k points
-    # for both electrons and holes
-    ekidx, hkidx = np.intersect1d(
-        elec_kpoint_array.view('float64,float64,float64').reshape(-1),
-        hole_kpoint_array.view('float64,float64,float64').reshape(-1),
-        return_indices=True)[1:]
-
-    # Convert the pump energy FWHM to sigma
-    pump_energy_broadening_sigma = sigma_from_fwhm(pump_spectral_width_fwhm)
+    # and the transition energies for each elec branch iband and hole branch jband
+    trans = TransitionEnergies.from_dyna_runs(elec_dyna_run, hole_dyna_run, dtype=trans_energies_dtype)
 
-    # Iteratre over electron and hole bands
-    # Even though, the for loops are inefficient in Python,
-    # the number of bands is rarely more than 10, therefore
-    # the vectorization is not necessary
-    for iband in range(elec_nband):
-        for jband in range(hole_nband):
-            # diff. between elec and hole for a given elec branch iband and hole branch jband
-            delta = pump_factor * \
-                spectra_plots.gaussian(elec_energy_array[ekidx, iband] - hole_energy_array[hkidx, jband],
-                                       pump_energy, pump_energy_broadening_sigma)
-
-            # Multiply by the transition dipoles squared if provided
-            # Transition dipoles are assumed to be on the same k-point grid
-            # as the electron energy array
-            if tr_dipoles_sqr is not None:
-                delta *= tr_dipoles_sqr[iband, jband, ekidx]
-
-            # Only for the intersected k points, we add the delta occupation
-            elec_occs_amplitude[ekidx, iband] += delta
-            hole_occs_amplitude[hkidx, jband] += delta
+    # Transition dipoles are assumed to be on the same k-point grid
+    # as the electron energy array
+    tr_weights = None if tr_dipoles_sqr is None else tr_dipoles_sqr[:, :, trans.ekidx]
 
-    t_occs.timings['total'].stop()
+    return elec_energy_array, hole_energy_array, trans, tr_weights
 
-    print(f"{'OCCUPATION SETUP':*^70}")
-    print(f"{'Occupations setup time:':>40} {t_occs.timings['total'].t_delta:.4f} s")
-    print(f"{'Intersect k-points:':>40} {ekidx.shape[0]} (total: {elec_kpoint_array.shape[0]} elec; {hole_kpoint_array.shape[0]} hole)")
-    print(f"{'Max Electron Occupancy:':>40} {max(elec_occs_amplitude.ravel()):.4f}")
-    print(f"{'Max Hole Occupancy:':>40} {max(hole_occs_amplitude.ravel()):.4f}")
-    print(f"{'Electron concentration (a.u.):':>40} {sum(elec_occs_amplitude.ravel()):.4f}")
-    print(f"{'Hole concentration (a.u.):':>40} {sum(hole_occs_amplitude.ravel()):.4f}")
-    print(f"{'Difference:':>40} {sum(elec_occs_amplitude.ravel()) - sum(hole_occs_amplitude.ravel()):.4e}")
-    print("")
+
+def _write_pump_pulse_files(elec_pump_pulse_path, hole_pump_pulse_path,
+                            elec_occs_amplitude, hole_occs_amplitude,
+                            pump_energy, pump_time_step, pump_duration_fwhm, pump_spectral_width_fwhm,
+                            pump_time_window, pump_factor, finite_width, dyna_time_step, keep_stride=None,
+                            storage_options=None):
+    """
+    Write the electron and hole pump pulse HDF5 files for one pump energy.
+    Runs in worker processes for setup_pump_pulse_sweep.
+
+    Returns
+    -------
+    pump_dict : dict
+        Dictionary to setup the PumpPulse object.
+
+    elec_delta_occs_array, hole_delta_occs_array : np.ndarray or None
+        See gaussian_excitation.
+    """
+
+    if storage_options is None:
+        storage_options = {}
+
+    pump_energy_broadening_sigma = sigma_from_fwhm(pump_spectral_width_fwhm)
 
     # Create the energy profile, only for reference
     en_grid = np.linspace(pump_energy - 3 * pump_energy_broadening_sigma,
@@ -411,10 +368,10 @@ def setup_pump_pulse(elec_pump_pulse_path, hole_pump_pulse_path,
 
         else:
             pump_time_profile = None
-            h5f.create_dataset('time_window', data=elec_dyna_time_step)
+            h5f.create_dataset('time_window', data=dyna_time_step)
             h5f.create_dataset('num_steps', data=1)
-            h5f.create_dataset('pump_time_step', data=elec_dyna_time_step)
-            h5f.create_dataset('pump_duration_fwhm', data=elec_dyna_time_step)
+            h5f.create_dataset('pump_time_step', data=dyna_time_step)
+            h5f.create_dataset('pump_duration_fwhm', data=dyna_time_step)
             h5f.create_dataset('time_profile', data=np.c_[0, 1])
 
         h5f['pump_duration_fwhm'].attrs['units'] = 'fs'
@@ -425,43 +382,32 @@ def setup_pump_pulse(elec_pump_pulse_path, hole_pump_pulse_path,
         h5f['energy_profile'].attrs['units'] = 'eV'
         h5f['time_profile'].attrs['units'] = 'fs'
 
-    elec_pump_pulse_file.create_dataset('num_bands', data=elec_nband)
-    hole_pump_pulse_file.create_dataset('num_bands', data=hole_nband)
-    elec_pump_pulse_file.create_dataset('num_kpoints', data=elec_kpoint_array.shape[0])
-    hole_pump_pulse_file.create_dataset('num_kpoints', data=hole_kpoint_array.shape[0])
+    elec_pump_pulse_file.create_dataset('num_bands', data=elec_occs_amplitude.shape[1])
+    hole_pump_pulse_file.create_dataset('num_bands', data=hole_occs_amplitude.shape[1])
+    elec_pump_pulse_file.create_dataset('num_kpoints', data=elec_occs_amplitude.shape[0])
+    hole_pump_pulse_file.create_dataset('num_kpoints', data=hole_occs_amplitude.shape[0])
 
     elec_pump_pulse_file.create_dataset('hole', data=0)
     hole_pump_pulse_file.create_dataset('hole', data=1)
 
-    # We save the delta_occs_array for animation. If it takes too much space, remove it.
     elec_delta_occs_array = \
         gaussian_excitation(elec_pump_pulse_file, elec_occs_amplitude,
                             time_grid,
                             pump_time_window, pump_duration_fwhm, pump_time_step,
-                            hole=False, finite_width=finite_width)
+                            hole=False, finite_width=finite_width, keep_stride=keep_stride,
+                            **storage_options)
 
     hole_delta_occs_array = \
         gaussian_excitation(hole_pump_pulse_file, hole_occs_amplitude,
                             time_grid,
                             pump_time_window, pump_duration_fwhm, pump_time_step,
-                            hole=True, finite_width=finite_width)
+                            hole=True, finite_width=finite_width, keep_stride=keep_stride,
+                            **storage_options)
 
     # Close
     close_hdf5(elec_pump_pulse_file)
     close_hdf5(hole_pump_pulse_file)
 
-    print('\nPlotting...')
-    spectra_plots.plot_occ_ampl(elec_occs_amplitude, elec_kpoint_array, elec_energy_array,
-                                hole_occs_amplitude, hole_kpoint_array,
-                                hole_energy_array, pump_energy, plot_scale=plot_scale)
-
-    if animate and finite_width:
-        print('\nAnimating...')
-        spectra_plots.animate_pump_pulse(pump_time_step,
-                                         elec_delta_occs_array, elec_kpoint_array, elec_energy_array,
-                                         hole_delta_occs_array, hole_kpoint_array, hole_energy_array,
-                                         pump_energy, plot_scale=plot_scale)
-
     # Setup the pump pulse object
     pump_dict = {
         'pump_energy': pump_energy,
@@ -474,8 +420,8 @@ def setup_pump_pulse(elec_pump_pulse_path, hole_pump_pulse_path,
         'pump_factor': pump_factor,
         'pump_time_step': pump_time_step,
         'pump_time_step units': 'fs',
-        'num_bands': elec_nband,
-        'num_kpoints': elec_kpoint_array.shape[0],
+        'num_bands': elec_occs_amplitude.shape[1],
+        'num_kpoints': elec_occs_amplitude.shape[0],
         'optional_params': optional_params,
         'hole': None,
         'time_profile': np.c_[time_grid, pump_time_profile],
@@ -485,18 +431,185 @@ def setup_pump_pulse(elec_pump_pulse_path, hole_pump_pulse_path,
         'carrier_number units': None,
     }
 
+    return pump_dict, elec_delta_occs_array, hole_delta_occs_array
+
+
+def setup_pump_pulse(elec_pump_pulse_path, hole_pump_pulse_path,
+                     elec_dyna_run, hole_dyna_run,
+                     pump_energy,
+                     pump_time_step=1.0,
+                     pump_duration_fwhm=20.0,
+                     pump_spectral_width_fwhm=0.090,
+                     pump_time_window=50.0,
+                     pump_factor=0.3,
+                     finite_width=True,
+                     animate=True,
+                     plot_scale=1.0,
+                     cnum_check=True,
+                     tr_dipoles_sqr=None,
+                     animate_stride=1,
+                     trans_energies_dtype=np.float64,
+                     num_sigma=None,
+                     storage_options=None):
+    """
+    Setup the Gaussian pump pulse excitation for electrons and holes.
+    Write into the pump_pulse.h5 HDF5 file.
+    We use raw k-point and energy arrays as read from the HDF5 files for efficiency.
+    All energies in eV, k points in crystal coordinates.
+
+    Pulse duration and energy broadening FWHM are related, typically,
+    pump_spectral_width_fwhm = 1.8 / pump_duration_fwhm.
+    However, here, we leave the possibility to set them independently.
+
+    Parameters
+    ----------
+    elec_pump_pulse_path : str
+        Path to the HDF5 file for the pump pulse excitation for electrons.
+
+    hole_pump_pulse_path : str
+        Path to the HDF5 file for the pump pulse excitation for holes.
+
+    elec_dyna_run : DynamicsRunCalcMode
+        The DynaRun object for electrons from the HDF5 and YAML files.
+        It is expected that the dyanmics was run only for one step, and only dynamics_run_1 group
+        exists in prefix_cdyna.h5 and ZERO electron occupation is setup.
+
+    hole_dyna_run : DynamicsRunCalcMode
+        The DynaRun object for holes from the HDF5 and YAML files. See elec_dyna_run.
+
+    pump_energy : float
+        The energy of the pump pulse (eV)
+
+    pump_time_step : float, optional
+        Time step in fs for the pump pulse generation.
+        Note: the pump_time_step MUST match the one used in the dynamics run in Perturbo!
+
+    pump_duration_fwhm : float, optional
+        The full width at half maximum of the pump pulse (fs).
+
+    pump_spectral_width_fwhm : float, optional
+        Energy broadening FWHM of the pump pulse (eV).
+
+    pump_time_window : float, optional
+        The time window for the pump pulse (fs).
+        During this time window, the pump pulse will be active.
+        The number of the snapshots in the pump_pulse.h5 file will be
+        equal to pump_time_window / pump_time_step.
+
+    pump_factor : float, optional
+        The amplitude of the pump pulse. The maximum occupation will be pump_factor.
+
+    finite_width : bool, optional
+        If True, the pulse is finite in time. If False, the pulse is a step function
+        and occs_amplitude will be set as initial occupation.
+
+    animate : bool, optional
+        If True, animate the pump pulse excitation.
+        Only in this case, the additional occupations of all the steps are kept in memory.
+
+    plot_scale : float
+        Scale factor for the scatter object sizes for carrier occupations.
+        Default is 1.0.
+
+    cnum_check : bool, optional
+        If True, create a cnum_check folder with a prefix_cdyna.h5 file with the total
+        occupation summed over time steps. Run dynamics-pp with Perturbo (without dynamics-run)
+        to get the accurate total carrier number in the cnum_check folder (link the epr file there).
+
+    tr_dipoles_sqr: np.ndarray, optional
+        Transition dipoles squared, valence-to-conduction for each k-point and band.
+        Currently, the k-grid for dipoles must match the one for electrons.
+        Experimental feature.
+
+    animate_stride : int, optional
+        Animate every animate_stride-th step, reducing the memory used by the animation
+        by the same factor. Default is 1 (all the steps).
+
+    trans_energies_dtype : np.dtype, optional
+        Data type of the transition energy tensor (see TransitionEnergies). np.float32 halves its memory.
+
+    num_sigma : float, optional
+        Only the transitions within num_sigma Gaussian sigmas of the pump energy are evaluated
+        (see TransitionEnergies.excitation). E.g. num_sigma=6 neglects contributions below 1.5e-8 * pump_factor.
+        Default is None: all the transitions are evaluated.
+
+    storage_options : dict, optional
+        Storage options of the pulse_snap_t_N datasets passed to gaussian_excitation:
+        compression ('gzip' or 'lzf'), compression_opts, shuffle, chunks, storage_dtype.
+        E.g. {'compression': 'gzip', 'shuffle': True, 'storage_dtype': np.float32}.
+        Default is None: contiguous, uncompressed float64 datasets.
+    """
+
+    _check_time_steps(elec_dyna_run, hole_dyna_run, pump_time_step, finite_width)
+
+    # Raw kpoint arrays for electrons and holes
+    elec_kpoint_array = elec_dyna_run._kpoints
+    hole_kpoint_array = hole_dyna_run._kpoints
+
+    elec_energy_array, hole_energy_array, trans, tr_weights = \
+        _pump_band_data(elec_dyna_run, hole_dyna_run, tr_dipoles_sqr, trans_energies_dtype)
+
+    print('Computing the optically excited occupations...')
+    t_occs = TimingGroup('Setup occupations')
+    t_occs.add('total', level=3).start()
+
+    # Gaussian in the transition energy for each elec and hole band pair, in one broadcasted operation
+    elec_occs_amplitude, hole_occs_amplitude = \
+        trans.excitation(pump_energy, sigma_from_fwhm(pump_spectral_width_fwhm),
+                         factor=pump_factor, weights=tr_weights, num_sigma=num_sigma)
+
+    elec_occs_amplitude = elec_occs_amplitude[0]
+    hole_occs_amplitude = hole_occs_amplitude[0]
+
+    t_occs.timings['total'].stop()
+
+    print(f"{'OCCUPATION SETUP':*^70}")
+    print(f"{'Occupations setup time:':>40} {t_occs.timings['total'].t_delta:.4f} s")
+    print(f"{'Intersect k-points:':>40} {trans.num_kpoints} (total: {elec_kpoint_array.shape[0]} elec; {hole_kpoint_array.shape[0]} hole)")
+    print(f"{'Max Electron Occupancy:':>40} {max(elec_occs_amplitude.ravel()):.4f}")
+    print(f"{'Max Hole Occupancy:':>40} {max(hole_occs_amplitude.ravel()):.4f}")
+    print(f"{'Electron concentration (a.u.):':>40} {sum(elec_occs_amplitude.ravel()):.4f}")
+    print(f"{'Hole concentration (a.u.):':>40} {sum(hole_occs_amplitude.ravel()):.4f}")
+    print(f"{'Difference:':>40} {sum(elec_occs_amplitude.ravel()) - sum(hole_occs_amplitude.ravel()):.4e}")
+    print("")
+
+    # The delta_occs_array (num_bands, num_steps, num_k) is only kept for animation,
+    # possibly for every animate_stride-th step
+    keep_stride = animate_stride if animate and finite_width else None
+
+    pump_dict, elec_delta_occs_array, hole_delta_occs_array = \
+        _write_pump_pulse_files(elec_pump_pulse_path, hole_pump_pulse_path,
+                                elec_occs_amplitude, hole_occs_amplitude,
+                                pump_energy, pump_time_step, pump_duration_fwhm, pump_spectral_width_fwhm,
+                                pump_time_window, pump_factor, finite_width, elec_dyna_run[1].time_step,
+                                keep_stride=keep_stride, storage_options=storage_options)
+
+    print('\nPlotting...')
+    spectra_plots.plot_occ_ampl(elec_occs_amplitude, elec_kpoint_array, elec_energy_array,
+                                hole_occs_amplitude, hole_kpoint_array,
+                                hole_energy_array, pump_energy, plot_scale=plot_scale)
+
+    if animate and finite_width:
+        print('\nAnimating...')
+        spectra_plots.animate_pump_pulse(pump_time_step * animate_stride,
+                                         elec_delta_occs_array, elec_kpoint_array, elec_energy_array,
+                                         hole_delta_occs_array, hole_kpoint_array, hole_energy_array,
+                                         pump_energy, plot_scale=plot_scale)
+
     pump_pulse = PumpPulse(pump_dict)
 
     # Create the cnum_check folder
     if cnum_check:
 
+        # Sum over the time steps of time_profile[t] * occs_amplitude
         if finite_width:
-            total_occ_elec = np.sum(elec_delta_occs_array, axis=1)
-            total_occ_hole = np.sum(hole_delta_occs_array, axis=1)
+            pump_time_profile = pump_dict['time_profile'][:, 1]
+            total_occ_elec = np.sum(pump_time_profile) * elec_occs_amplitude.T
+            total_occ_hole = np.sum(pump_time_profile) * hole_occs_amplitude.T
 
         else:
-            total_occ_elec = elec_occs_amplitude
-            total_occ_hole = hole_occs_amplitude
+            total_occ_elec = elec_occs_amplitude.T
+            total_occ_hole = hole_occs_amplitude.T
 
         elec_cnum_check_path = os.path.join(os.path.dirname(elec_pump_pulse_path), 'cnum_check')
         hole_cnum_check_path = os.path.join(os.path.dirname(hole_pump_pulse_path), 'cnum_check')
@@ -526,3 +639,144 @@ def setup_pump_pulse(elec_pump_pulse_path, hole_pump_pulse_path,
                                   overwrite=True)
 
     return pump_pulse
+
+
+def setup_pump_pulse_sweep(pump_energies,
+                           elec_pump_pulse_paths, hole_pump_pulse_paths,
+                           elec_dyna_run, hole_dyna_run,
+                           pump_time_step=1.0,
+                           pump_duration_fwhm=20.0,
+                           pump_spectral_width_fwhm=0.090,
+                           pump_time_window=50.0,
+                           pump_factor=0.3,
+                           finite_width=True,
+                           tr_dipoles_sqr=None,
+                           trans_energies_dtype=np.float64,
+                           num_sigma=None,
+                           energy_chunk=16,
+                           n_workers=None,
+                           storage_options=None):
+    """
+    Setup the Gaussian pump pulse excitation for many pump energies.
+    The band data (energies in eV, intersect k-points, transition energies) is computed once,
+    the occupation amplitudes are evaluated for energy_chunk pump energies at a time,
+    and the pump pulse files are written in parallel worker processes.
+    The files are identical to the ones written by setup_pump_pulse for each pump energy.
+    No plots, animations or cnum_check files are produced; use setup_pump_pulse for a single energy.
+
+    Parameters
+    ----------
+    pump_energies : array_like
+        The energies of the pump pulse (eV).
+
+    elec_pump_pulse_paths : list of str or str
+        Paths to the HDF5 files for the pump pulse excitation for electrons, one per pump energy.
+        A string is used as a template formatted with pump_energy,
+        e.g. 'pump_pulse_elec_Epump_{pump_energy:.3f}.h5'.
+
+    hole_pump_pulse_paths : list of str or str
+        Paths to the HDF5 files for the pump pulse excitation for holes. See elec_pump_pulse_paths.
+
+    elec_dyna_run, hole_dyna_run : DynamicsRunCalcMode
+        The DynaRun objects for electrons and holes. See setup_pump_pulse.
+
+    pump_time_step, pump_duration_fwhm, pump_spectral_width_fwhm, pump_time_window, pump_factor,
+    finite_width, tr_dipoles_sqr, trans_energies_dtype, num_sigma, storage_options :
+        Same for all the pump energies. See setup_pump_pulse.
+
+    energy_chunk : int, optional
+        Number of pump energies evaluated at once. The excitation kernel uses
+        energy_chunk x elec_nband x hole_nband x num_intersect_kpoints floats.
+
+    n_workers : int, optional
+        Number of worker processes writing the files. If None or 1, the files are written in the current process.
+
+    Returns
+    -------
+    pump_pulses : list of PumpPulse
+        Pump pulse objects, one per pump energy.
+    """
+
+    trun = TimingGroup('pump pulse sweep')
+    trun.add('total', level=3).start()
+
+    pump_energies = np.atleast_1d(np.asarray(pump_energies, dtype=float))
+    num_energies = pump_energies.shape[0]
+
+    def format_paths(paths):
+        if isinstance(paths, str):
+            return [paths.format(pump_energy=pump_energy) for pump_energy in pump_energies]
+        return list(paths)
+
+    elec_pump_pulse_paths = format_paths(elec_pump_pulse_paths)
+    hole_pump_pulse_paths = format_paths(hole_pump_pulse_paths)
+
+    if len(elec_pump_pulse_paths) != num_energies or len(hole_pump_pulse_paths) != num_energies:
+        raise ValueError('One electron and one hole pump pulse path must be provided for each pump energy.')
+
+    all_paths = [os.path.abspath(path) for path in elec_pump_pulse_paths + hole_pump_pulse_paths]
+    if len(set(all_paths)) != len(all_paths):
+        raise ValueError('The pump pulse paths must be different for each pump energy and for electrons and holes.')
+
+    _check_time_steps(elec_dyna_run, hole_dyna_run, pump_time_step, finite_width)
+
+    with trun.add('band data') as t:
+        elec_energy_array, hole_energy_array, trans, tr_weights = \
+            _pump_band_data(elec_dyna_run, hole_dyna_run, tr_dipoles_sqr, trans_energies_dtype)
+
+    print(f"{'PUMP ENERGY SWEEP':*^70}")
+    print(f"{'Number of pump energies:':>40} {num_energies}")
+    print(f"{'Intersect k-points:':>40} {trans.num_kpoints}")
+    print("")
+
+    write_args = (pump_time_step, pump_duration_fwhm, pump_spectral_width_fwhm,
+                  pump_time_window, pump_factor, finite_width, elec_dyna_run[1].time_step,
+                  None, storage_options)
+
+    pump_dicts = [None] * num_energies
+
+    def write_chunk(submit, ichunk, elec_occs_amplitude, hole_occs_amplitude):
+        return [(i, submit(_write_pump_pulse_files, elec_pump_pulse_paths[i], hole_pump_pulse_paths[i],
+                           elec_occs_amplitude[i - ichunk], hole_occs_amplitude[i - ichunk],
+                           pump_energies[i], *write_args))
+                for i in range(ichunk, min(ichunk + energy_chunk, num_energies))]
+
+    if n_workers is None or n_workers <= 1:
+        executor = None
+
+        def submit(func, *args):
+            return func(*args)
+    else:
+        context = multiprocessing.get_context('spawn')
+        executor = ProcessPoolExecutor(max_workers=n_workers, mp_context=context)
+        submit = executor.submit
+
+    try:
+        pending = []
+
+        for ichunk in range(0, num_energies, energy_chunk):
+            with trun.add('occupations') as t:
+                elec_occs_amplitude, hole_occs_amplitude = \
+                    trans.excitation(pump_energies[ichunk:ichunk + energy_chunk],
+                                     sigma_from_fwhm(pump_spectral_width_fwhm),
+                                     factor=pump_factor, weights=tr_weights, num_sigma=num_sigma)
+
+            # The files of the previous chunk are written while the next occupations are computed
+            with trun.add('write files') as t:
+                for i, result in pending:
+                    pump_dicts[i] = result.result()[0] if executor is not None else result[0]
+
+                pending = write_chunk(submit, ichunk, elec_occs_amplitude, hole_occs_amplitude)
+
+        with trun.add('write files') as t:
+            for i, result in pending:
+                pump_dicts[i] = result.result()[0] if executor is not None else result[0]
+
+    finally:
+        if executor is not None:
+            executor.shutdown()
+
+    trun.timings['total'].stop()
+    print(trun)
+
+    return [PumpPulse(pump_dict) for pump_dict in pump_dicts]
@@ -11,6 +11,7 @@ from scipy.interpolate import Akima1DInterpolator
 from scipy.optimize import brentq
 
 from perturbopy.io_utils.io import open_hdf5, close_hdf5
+from perturbopy.postproc.dbs.transition_energies import TransitionEnergies
 
 from matplotlib.animation import FuncAnimation
 from mpl_toolkits.axes_grid1 import make_axes_locatable
@@ -20,6 +21,7 @@ from matplotlib.colors import Normalize
 from .memory import get_size
 from .timing import TimingGroup
 from .constants import energy_conversion_factor
+from .lineshapes import gaussian
 
 # Plotting parameters
 from .plot_tools import plotparams
@@ -27,14 +29,6 @@ from .plot_tools import plotparams
 plt.rcParams.update(plotparams)
 
 
-def gaussian(x, mu, sigma):
-    """
-    Gaussian function. Not normalized.
-    """
-
-    return np.exp(-0.5 * ((x - mu) / sigma)**2)
-
-
 def find_fwhm(x, y, num_interp_points=2000):
     """
     Find the Full Width at Half Maximum (FWHM) for a single prominent peak y(x),
@@ -409,17 +403,15 @@ def plot_occs_on_bands(ax, kpath, bands, first_el_band_idx,
     elec_nband = len(elec_band_list)
     hole_nband = len(hole_band_list)
 
-    # First, compute the occupations for every valence-conduction pair
-    for i_elec_band in elec_band_list:
-        for i_hole_band in hole_band_list:
-            elec_band = bands[i_elec_band]
-            hole_band = bands[i_hole_band]
+    # First, compute the occupations for every valence-conduction pair.
+    # Electron and hole bands are on the same k-path
+    trans = TransitionEnergies(np.array([bands[i] for i in elec_band_list]).T,
+                               np.array([bands[i] for i in hole_band_list]).T)
 
-            occ = gaussian(elec_band - hole_band,
-                           pump_energy, pump_spectral_width_fwhm)
+    elec_occs, hole_occs = trans.excitation(pump_energy, pump_spectral_width_fwhm)
 
-            occs_amplitude_bands[i_elec_band - 1, :] += occ
-            occs_amplitude_bands[i_hole_band - 1, :] += occ
+    occs_amplitude_bands[np.array(elec_band_list, dtype=int) - 1, :] += elec_occs[0].T
+    occs_amplitude_bands[np.array(hole_band_list, dtype=int) - 1, :] += hole_occs[0].T
 
     max_occ = np.max(occs_amplitude_bands.ravel())
     factor = scale / max_occ
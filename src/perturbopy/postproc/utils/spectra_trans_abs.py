@@ -3,12 +3,21 @@ Utils for ultrafast spectroscopy: transient absorption calculations
 based on electron-phonon and hole-phonon dynamics simulations.
 """
 
+import os
 import numpy as np
 import warnings
+import multiprocessing
+from concurrent.futures import ProcessPoolExecutor
+from scipy import sparse
+from scipy import fft
+
+from perturbopy.io_utils.io import open_hdf5, close_hdf5
+from perturbopy.postproc.dbs.transition_energies import TransitionEnergies
 
 from .memory import get_size
-from .timing import TimingGroup
+from .timing import Timing, TimingGroup
 from .constants import energy_conversion_factor
+from .snapshots import read_snap, snap_shape, snap_steps, prefetch
 
 
 def gaussian_delta(x, mu, sig):
@@ -28,13 +37,532 @@ def gaussian_delta(x, mu, sig):
     return np.exp(-0.5 * ((x - mu) / sig)**2) / (sig * np.sqrt(2 * np.pi))
 
 
+def trans_abs_kernel(trans_energies, weights, energy_grid, eta, e_occs, h_occs,
+                     method='exact', memory_budget_mb=1024.0, bin_width=None, cutoff=6.0,
+                     num_sigma=None, sort_order=None):
+    """
+    Contract the Gaussian-broadened transitions with the time-stacked occupations:
+
+    .. math::
+        dA_elec(E, t) = 1 / N_k sum_{k,i,j} w_ijk f^e_ki(t) delta(e^e_ki - e^h_kj - E)
+
+    and similarly for dA_hole with the hole occupations of band j.
+
+    Two methods are available:
+
+    * 'exact': the Gaussian deltas are evaluated in blocks of energy points sized to memory_budget_mb,
+      and each block is contracted immediately, so that the full
+      (num_elec_bands, num_hole_bands, num_kpoints, num_energy_points) tensor is never stored.
+      Cost O(N_k N_E) per time step.
+      With num_sigma, the transitions are sorted by energy and, for each energy block,
+      only the ones within num_sigma * eta of the block are evaluated.
+      Per unit of |w_ijk f_ki(t)| / N_k, the difference from the full sum is bounded by
+      g(0) * exp(-num_sigma**2 / 2), g(0) = 1 / (sqrt(2 pi) eta).
+
+    * 'binned': the transitions weighted by the occupations are deposited on a fine uniform grid
+      of spacing bin_width (linear interpolation between the two closest grid points),
+      then convolved with the Gaussian by FFT. Cost O(N_k + N_E log N_E) per time step.
+      The energy_grid must be uniform. Per unit of |w_ijk f_ki(t)| / N_k, the difference from the exact sum is bounded by
+      g(0) * [(bin_width / eta)**2 / 8 + exp(-cutoff**2 / 2)], with g(0) = 1 / (sqrt(2 pi) eta)
+      the peak of the Gaussian: the first term is the linear interpolation error, the second one
+      is the truncation of the Gaussian at cutoff * eta.
+
+    Parameters
+    ----------
+    trans_energies : np.ndarray
+        Transition energies (eV). Shape (num_elec_bands, num_hole_bands, num_kpoints).
+
+    weights : np.ndarray
+        Weights of each transition (spin factor or transition dipoles squared). Same shape as trans_energies.
+
+    energy_grid : np.ndarray
+        Probe energy grid (eV). Shape (num_energy_points,).
+
+    eta : float
+        Broadening parameter for the Gaussian delta functions.
+
+    e_occs : np.ndarray
+        Electron occupations (with the sign of the transient absorption). Shape (num_steps, num_kpoints, num_elec_bands).
+
+    h_occs : np.ndarray
+        Hole occupations (with the sign of the transient absorption). Shape (num_steps, num_kpoints, num_hole_bands).
+
+    method : str, optional
+        'exact' or 'binned'.
+
+    memory_budget_mb : float, optional
+        Memory budget (MB) for the Gaussian deltas of one energy block. Only for method='exact'.
+
+    bin_width : float, optional
+        Spacing of the fine grid (eV) for method='binned'. It is rounded down to an integer
+        fraction of the energy_grid spacing. Default is the largest fraction not exceeding eta / 10.
+
+    cutoff : float, optional
+        Truncation of the Gaussian kernel in units of eta for method='binned'.
+
+    num_sigma : float, optional
+        Energy window (in units of eta) of the transitions evaluated for method='exact'.
+        Default is None: all the transitions are evaluated.
+
+    sort_order : np.ndarray, optional
+        np.argsort(trans_energies, axis=None), if already computed. Only used with num_sigma.
+
+    Returns
+    -------
+    dA_elec : np.ndarray
+        Electron contribution. Shape (num_energy_points, num_steps).
+
+    dA_hole : np.ndarray
+        Hole contribution. Shape (num_energy_points, num_steps).
+    """
+
+    if method == 'exact' and num_sigma is not None:
+        dA_elec, dA_hole = _trans_abs_kernel_pruned(trans_energies, weights, energy_grid, eta, e_occs, h_occs,
+                                                    memory_budget_mb, num_sigma, sort_order)
+    elif method == 'exact':
+        dA_elec, dA_hole = _trans_abs_kernel_exact(trans_energies, weights, energy_grid, eta, e_occs, h_occs,
+                                                   memory_budget_mb)
+    elif method == 'binned':
+        dA_elec, dA_hole = _trans_abs_kernel_binned(trans_energies, weights, energy_grid, eta, e_occs, h_occs,
+                                                    bin_width, cutoff)
+    else:
+        raise ValueError(f"Unknown method '{method}'. Options: 'exact', 'binned'.")
+
+    num_kpoints = trans_energies.shape[2]
+    dA_elec /= num_kpoints
+    dA_hole /= num_kpoints
+
+    return dA_elec, dA_hole
+
+
+def _trans_abs_kernel_exact(trans_energies, weights, energy_grid, eta, e_occs, h_occs, memory_budget_mb):
+    """
+    Exact Gaussian sums of trans_abs_kernel, evaluated in memory-bounded energy blocks.
+    Returns dA_elec and dA_hole without the 1 / N_k normalization.
+    """
+
+    elec_nband, hole_nband, num_kpoints = trans_energies.shape
+    num_energy_points = energy_grid.shape[0]
+    num_steps = e_occs.shape[0]
+
+    # The block of deltas and its two partial sums over bands
+    bytes_per_energy = 8 * num_kpoints * (2 * elec_nband * hole_nband + elec_nband + hole_nband)
+    block_size = int(memory_budget_mb * 1024**2 // bytes_per_energy)
+    block_size = max(1, min(block_size, num_energy_points))
+
+    dA_elec = np.zeros((num_energy_points, num_steps))
+    dA_hole = np.zeros((num_energy_points, num_steps))
+
+    for istart in range(0, num_energy_points, block_size):
+        block = slice(istart, min(istart + block_size, num_energy_points))
+
+        # Shape (elec_nband, hole_nband, num_kpoints, block_size)
+        deltas = gaussian_delta(trans_energies[..., None], energy_grid[None, None, None, block], eta)
+        deltas *= weights[..., None]
+
+        # Sum over hole bands for electrons and over electron bands for holes, then over k-points and bands
+        dA_elec[block, :] = np.tensordot(deltas.sum(axis=1), e_occs, axes=((0, 1), (2, 1)))
+        dA_hole[block, :] = np.tensordot(deltas.sum(axis=0), h_occs, axes=((0, 1), (2, 1)))
+
+    return dA_elec, dA_hole
+
+
+def _trans_abs_kernel_pruned(trans_energies, weights, energy_grid, eta, e_occs, h_occs, memory_budget_mb,
+                             num_sigma, sort_order=None):
+    """
+    Exact Gaussian sums of trans_abs_kernel restricted, for each block of energy points,
+    to the transitions within num_sigma * eta of the block.
+    Returns dA_elec and dA_hole without the 1 / N_k normalization.
+    """
+
+    elec_nband, hole_nband, num_kpoints = trans_energies.shape
+    num_energy_points = energy_grid.shape[0]
+    num_steps = e_occs.shape[0]
+
+    # Transitions sorted by energy: the ones in an energy window are contiguous
+    if sort_order is None:
+        sort_order = np.argsort(trans_energies, axis=None)
+
+    sorted_energies = trans_energies.ravel()[sort_order]
+    sorted_weights = weights.ravel()[sort_order]
+    iband, jband, ik = np.unravel_index(sort_order, trans_energies.shape)
+
+    # The block of deltas and the gathered occupations, for all the transitions at most
+    bytes_per_energy = 8 * trans_energies.size
+    block_size = int(memory_budget_mb * 1024**2 // bytes_per_energy)
+    block_size = max(1, min(block_size, num_energy_points))
+
+    width = num_sigma * eta
+
+    dA_elec = np.zeros((num_energy_points, num_steps))
+    dA_hole = np.zeros((num_energy_points, num_steps))
+
+    for istart in range(0, num_energy_points, block_size):
+        block = slice(istart, min(istart + block_size, num_energy_points))
+
+        lower = np.searchsorted(sorted_energies, np.min(energy_grid[block]) - width, side='left')
+        upper = np.searchsorted(sorted_energies, np.max(energy_grid[block]) + width, side='right')
+
+        if upper == lower:
+            continue
+
+        window = slice(lower, upper)
+
+        # Shape (num_window_transitions, block_size)
+        deltas = gaussian_delta(sorted_energies[window, None], energy_grid[None, block], eta)
+        deltas *= sorted_weights[window, None]
+
+        # Occupations of the transitions of the window, shape (num_steps, num_window_transitions)
+        dA_elec[block, :] = deltas.T @ e_occs[:, ik[window], iband[window]].T
+        dA_hole[block, :] = deltas.T @ h_occs[:, ik[window], jband[window]].T
+
+    return dA_elec, dA_hole
+
+
+def _trans_abs_kernel_binned(trans_energies, weights, energy_grid, eta, e_occs, h_occs, bin_width, cutoff):
+    """
+    Histogram-plus-convolution approximation of trans_abs_kernel.
+    Returns dA_elec and dA_hole without the 1 / N_k normalization.
+    """
+
+    elec_nband, hole_nband, num_kpoints = trans_energies.shape
+    num_energy_points = energy_grid.shape[0]
+    num_steps = e_occs.shape[0]
+
+    # The fine grid contains the probe grid: bin_width = de / nsub
+    if num_energy_points > 1:
+        de = energy_grid[1] - energy_grid[0]
+        if not np.allclose(np.diff(energy_grid), de, rtol=1e-6, atol=0.0):
+            raise ValueError("method='binned' requires a uniform energy grid.")
+    else:
+        de = eta / 10.0 if bin_width is None else bin_width
+
+    if bin_width is None:
+        bin_width = eta / 10.0
+
+    nsub = max(1, int(np.ceil(de / bin_width - 1e-9)))
+    bin_width = de / nsub
+
+    # Kernel half-width and fine grid, padded by the kernel half-width on both sides
+    nhalf = int(np.ceil(cutoff * eta / bin_width))
+    fine_origin = energy_grid[0] - (nhalf + 1) * bin_width
+    num_bins = (num_energy_points - 1) * nsub + 2 * nhalf + 3
+
+    # Linear deposition of each transition on the two closest bins.
+    # Transitions outside the fine grid are farther than cutoff * eta from all the probe energies.
+    position = (trans_energies - fine_origin) / bin_width
+    lower = np.floor(position).astype(int)
+    frac = position - lower
+    inside = (lower >= 0) & (lower < num_bins - 1)
+
+    iband, jband, ik = np.nonzero(inside)
+    lower = lower[inside]
+    frac = frac[inside]
+    weights = weights[inside]
+
+    rows = np.concatenate((lower, lower + 1))
+    values = np.concatenate((weights * (1.0 - frac), weights * frac))
+
+    # Binning matrices: (num_bins, num_kpoints * num_bands), duplicates are summed
+    elec_cols = np.tile(ik * elec_nband + iband, 2)
+    hole_cols = np.tile(ik * hole_nband + jband, 2)
+    elec_binning = sparse.csr_matrix((values, (rows, elec_cols)), shape=(num_bins, num_kpoints * elec_nband))
+    hole_binning = sparse.csr_matrix((values, (rows, hole_cols)), shape=(num_bins, num_kpoints * hole_nband))
+
+    # Histograms for all the time steps, shape (num_bins, num_steps)
+    elec_hist = elec_binning @ e_occs.reshape(num_steps, -1).T
+    hole_hist = hole_binning @ h_occs.reshape(num_steps, -1).T
+
+    # Gaussian kernel on the fine grid, offsets -nhalf..nhalf
+    kernel = gaussian_delta(np.arange(-nhalf, nhalf + 1) * bin_width, 0.0, eta)
+
+    # Probe energies on the fine grid (index in the full convolution output)
+    probe_idx = nhalf + 1 + np.arange(num_energy_points) * nsub + nhalf
+
+    # Linear convolution along the energy axis by FFT
+    nfft = fft.next_fast_len(num_bins + kernel.size - 1, real=True)
+    kernel_fft = fft.rfft(kernel, nfft)[:, None]
+
+    dA_elec = fft.irfft(fft.rfft(elec_hist, nfft, axis=0) * kernel_fft, nfft, axis=0)[probe_idx, :]
+    dA_hole = fft.irfft(fft.rfft(hole_hist, nfft, axis=0) * kernel_fft, nfft, axis=0)[probe_idx, :]
+
+    return dA_elec, dA_hole
+
+
+def read_trans_abs_occs(elec_group, hole_group, steps, ekidx, hkidx):
+    """
+    Read the electron and hole occupations of the given steps on the intersect k-point grid,
+    with the sign used for the transient absorption.
+
+    Parameters
+    ----------
+    elec_group : h5py.Group
+        dynamics_run_N group of the electron cdyna HDF5 file.
+
+    hole_group : h5py.Group
+        dynamics_run_N group of the hole cdyna HDF5 file.
+
+    steps : iterable of int
+        Indices N of the snap_t_N snapshots to read.
+
+    ekidx, hkidx : np.ndarray
+        Indices of the intersect k-points in the electron and hole grids.
+
+    Returns
+    -------
+    e_occs_time_array : np.ndarray
+        Shape (num_steps, num_intersect_kpoints, num_elec_bands).
+
+    h_occs_time_array : np.ndarray
+        Shape (num_steps, num_intersect_kpoints, num_hole_bands).
+    """
+
+    steps = list(steps)
+    elec_nband = snap_shape(elec_group)[1]
+    hole_nband = snap_shape(hole_group)[1]
+
+    e_occs_time_array = np.zeros((len(steps), ekidx.size, elec_nband))
+    h_occs_time_array = np.zeros((len(steps), hkidx.size, hole_nband))
+
+    # Only the range of k-points spanned by ekidx and hkidx is read
+    ekslice = slice(np.min(ekidx), np.max(ekidx) + 1)
+    hkslice = slice(np.min(hkidx), np.max(hkidx) + 1)
+
+    for i, istep in enumerate(steps):
+
+        # Read the occupations
+        # We read them directly from the HDF5 files. Usually, this data is not stored in memory.
+        elec_occs = read_snap(elec_group, istep, ekslice)
+        # Minus sign for transient absorption, store only on the intersect grid, hence ekidx
+        elec_occs = -elec_occs[ekidx - ekslice.start, :]
+
+        hole_occs = 1.0 - read_snap(hole_group, istep, hkslice)
+        hole_occs = -hole_occs[hkidx - hkslice.start, :]
+
+        # Second index of elec_occs is band, one can select specific bands here
+        e_occs_time_array[i, :, :] = elec_occs[:, :]
+        h_occs_time_array[i, :, :] = hole_occs[:, :]
+
+    return e_occs_time_array, h_occs_time_array
+
+
+def _trans_abs_time_loop(elec_group, hole_group, step_range, ekidx, hkidx,
+                         trans_energies, weights, energy_grid, eta,
+                         method, memory_budget_mb, bin_width, occs_memory_mb, num_sigma, trun, verbose=False,
+                         track_memory=False):
+    """
+    Read the occupations in time windows and contract them with trans_abs_kernel.
+    The next window is read in a background thread while the current one is processed.
+    See compute_trans_abs for the parameters, step_range is the range of snapshots to process.
+
+    Returns
+    -------
+    dA_elec, dA_hole : np.ndarray
+        Shape (num_energy_points, len(step_range)), normalized by the number of k-points in ekidx.
+    """
+
+    num_steps = len(step_range)
+    num_kpoints = ekidx.size
+    elec_nband, hole_nband = trans_energies.shape[:2]
+    num_energy_points = energy_grid.shape[0]
+
+    # Number of time steps read at once
+    if occs_memory_mb is None:
+        time_chunk = num_steps
+    else:
+        bytes_per_step = 8 * num_kpoints * (elec_nband + hole_nband)
+        time_chunk = max(1, min(num_steps, int(occs_memory_mb * 1024**2 // bytes_per_step)))
+
+    if verbose:
+        print(f"{'Time steps per chunk':>30}: {time_chunk}\n")
+
+    # Sorted index of the transitions, computed once for all the time windows
+    sort_order = None
+    if method == 'exact' and num_sigma is not None:
+        with trun.add('sort transitions') as t:
+            sort_order = np.argsort(trans_energies, axis=None)
+
+        if verbose:
+            width = num_sigma * eta
+            num_window = np.count_nonzero((trans_energies >= energy_grid[0] - width) &
+                                          (trans_energies <= energy_grid[-1] + width))
+            print(f"{'Transitions in the window':>30}: {num_window} / {trans_energies.size}\n")
+
+    def read_occs_chunks():
+        """
+        Read the occupations on the intersect grid, time_chunk steps at a time.
+        Runs in the prefetch thread: the read time is measured with a separate Timing object,
+        merged into trun by the main thread (TimingGroup is not thread-safe).
+        """
+        for istart in range(0, num_steps, time_chunk):
+            with Timing('read occupations') as t_read:
+                steps = step_range[istart:istart + time_chunk]
+                e_occs_time_array, h_occs_time_array = \
+                    read_trans_abs_occs(elec_group, hole_group, steps, ekidx, hkidx)
+
+            yield istart, e_occs_time_array, h_occs_time_array, t_read
+
+    dA_elec = np.zeros((num_energy_points, num_steps))
+    dA_hole = np.zeros((num_energy_points, num_steps))
+
+    for istart, e_occs_time_array, h_occs_time_array, t_read in prefetch(read_occs_chunks()):
+
+        trun.add('read occupations').merge(t_read)
+
+        if istart == 0 and verbose:
+            get_size(e_occs_time_array, 'e_occs_time_array', dump=True)
+            get_size(h_occs_time_array, 'h_occs_time_array', dump=True)
+            print('')
+
+        with trun.add('compute trans. abs.', track_memory=track_memory) as t:
+            block = slice(istart, istart + e_occs_time_array.shape[0])
+            dA_elec[:, block], dA_hole[:, block] = \
+                trans_abs_kernel(trans_energies, weights, energy_grid, eta,
+                                 e_occs_time_array, h_occs_time_array, method=method,
+                                 memory_budget_mb=memory_budget_mb, bin_width=bin_width,
+                                 num_sigma=num_sigma, sort_order=sort_order)
+
+    return dA_elec, dA_hole
+
+
+def _trans_abs_shard(elec_cdyna_path, hole_cdyna_path, ndyna, step_range, ekidx, hkidx,
+                     trans_energies, weights, energy_grid, eta,
+                     method, memory_budget_mb, bin_width, occs_memory_mb, num_sigma, track_memory=False):
+    """
+    Worker process of compute_trans_abs: open the cdyna files read-only and compute
+    the transient absorption of a shard of intersect k-points.
+
+    Returns
+    -------
+    dA_elec, dA_hole : np.ndarray
+        Partial spectra, normalized by the number of k-points of the shard.
+
+    trun : TimingGroup
+        Timings of the shard, including the total time of the worker.
+    """
+
+    trun = TimingGroup('trans. abs. shard')
+    trun.add('total', level=3).start()
+
+    elec_cdyna_file = open_hdf5(elec_cdyna_path)
+    hole_cdyna_file = open_hdf5(hole_cdyna_path)
+
+    try:
+        dA_elec, dA_hole = \
+            _trans_abs_time_loop(elec_cdyna_file[f'dynamics_run_{ndyna}'], hole_cdyna_file[f'dynamics_run_{ndyna}'],
+                                 step_range, ekidx, hkidx, trans_energies, weights, energy_grid, eta,
+                                 method, memory_budget_mb, bin_width, occs_memory_mb, num_sigma, trun,
+                                 track_memory=track_memory)
+    finally:
+        close_hdf5(elec_cdyna_file)
+        close_hdf5(hole_cdyna_file)
+
+    trun.timings['total'].stop()
+
+    return dA_elec, dA_hole, trun
+
+
+def _num_consecutive_snaps(group):
+    """
+    Number of snapshots snap_t_0, snap_t_1, ... present without gaps in a dynamics_run_N group.
+    """
+
+    steps = snap_steps(group)
+    consecutive = steps == np.arange(steps.size)
+
+    return steps.size if np.all(consecutive) else int(np.argmin(consecutive))
+
+
+def _load_trans_abs_state(result_path, result_params, energy_grid):
+    """
+    Check an existing incremental result file of compute_trans_abs against the current parameters.
+
+    Returns
+    -------
+    first_step : int
+        First step to process: 0 for a new file, last processed step + 1 otherwise.
+    """
+
+    if not os.path.isfile(result_path):
+        return 0
+
+    with open_hdf5(result_path) as result_file:
+        for key, value in result_params.items():
+            stored = result_file.attrs[key]
+            if isinstance(value, str) or isinstance(stored, str):
+                same = str(stored) == str(value)
+            else:
+                same = np.allclose(stored, value)
+            if not same:
+                raise ValueError(f'Parameter {key} = {value} differs from the value {stored} stored in {result_path}. '
+                                 'Use a new result file.')
+
+        if not np.allclose(result_file['energy_grid'][()], energy_grid):
+            raise ValueError(f'The energy grid differs from the one stored in {result_path}. Use a new result file.')
+
+        return int(result_file.attrs['last_step']) + 1
+
+
+def _append_trans_abs_result(result_path, result_params, energy_grid, new_times, new_dA_elec, new_dA_hole):
+    """
+    Append the newly processed steps to the incremental result file of compute_trans_abs,
+    creating it if needed.
+
+    Returns
+    -------
+    time_grid, dA_elec, dA_hole : np.ndarray
+        All the processed steps.
+    """
+
+    num_energy_points = energy_grid.shape[0]
+    new_file = not os.path.isfile(result_path)
+
+    with open_hdf5(result_path, 'w' if new_file else 'a') as result_file:
+
+        if new_file:
+            for key, value in result_params.items():
+                result_file.attrs[key] = value
+            result_file.attrs['last_step'] = -1
+
+            result_file.create_dataset('energy_grid', data=energy_grid)
+            result_file['energy_grid'].attrs['units'] = 'eV'
+            result_file.create_dataset('time_grid', shape=(0,), maxshape=(None,), dtype=float)
+            result_file['time_grid'].attrs['units'] = 'fs'
+            for name in ['dA_elec', 'dA_hole']:
+                result_file.create_dataset(name, shape=(num_energy_points, 0), maxshape=(num_energy_points, None),
+                                           chunks=(num_energy_points, 16), dtype=float)
+
+        num_old = result_file['time_grid'].shape[0]
+        num_new = new_times.shape[0]
+
+        result_file['time_grid'].resize((num_old + num_new,))
+        result_file['time_grid'][num_old:] = new_times
+
+        for name, data in [('dA_elec', new_dA_elec), ('dA_hole', new_dA_hole)]:
+            result_file[name].resize((num_energy_points, num_old + num_new))
+            result_file[name][:, num_old:] = data
+
+        result_file.attrs['last_step'] = num_old + num_new - 1
+
+        return result_file['time_grid'][()], result_file['dA_elec'][()], result_file['dA_hole'][()]
+
+
 def compute_trans_abs(elec_dyna_run,
                       hole_dyna_run,
                       de_grid=0.02,
                       energy_grid_max=None,
                       eta=0.02,
                       save_npy=True,
-                      tr_dipoles_sqr=None):
+                      tr_dipoles_sqr=None,
+                      method='exact',
+                      memory_budget_mb=1024.0,
+                      bin_width=None,
+                      occs_memory_mb=None,
+                      n_workers=None,
+                      result_path=None,
+                      trans_energies_dtype=np.float64,
+                      num_sigma=None,
+                      track_memory=False):
     """
     Compute the transient absorption spectrum from the electron and hole dynamics simulations.
     The data is saved in the current directory as numpy binary files (.npy).
@@ -61,11 +589,59 @@ def compute_trans_abs(elec_dyna_run,
     save_npy : bool
         Save the data as numpy binary files (.npy).
 
+    tr_dipoles_sqr : np.ndarray
+        Transition dipoles squared, valence-to-conduction for each k-point and band.
+        Currently, the k-grid for dipoles must match the one for electrons.
+        Experimental feature.
+
+    method : str
+        'exact' sum of the Gaussian deltas, or 'binned' histogram-plus-convolution fast path.
+        See trans_abs_kernel for the error bound of the 'binned' method.
+
+    memory_budget_mb : float
+        Memory budget (MB) for the Gaussian deltas evaluated at once. See trans_abs_kernel.
+
+    bin_width : float
+        Fine grid spacing (eV) for method='binned'. Default is eta / 10 or smaller.
+
+    occs_memory_mb : float
+        Memory budget (MB) for the electron and hole occupations held at once.
+        The snapshots are then streamed from the HDF5 files in windows of time steps,
+        each window being contracted and discarded before the next one.
+        If None, all the time steps are read at once.
+
+    n_workers : int
+        Number of worker processes. The intersect k-points are split into n_workers shards,
+        each worker opens the cdyna files read-only and computes the partial spectra of its shard,
+        which are summed in the parent process. The per-shard timings are reported.
+        If None or 1, the calculation runs in the current process.
+
+    result_path : str
+        Path to an HDF5 result file for the incremental mode. The file stores the energy grid,
+        the parameters, the spectra and the last processed step. If it exists, only the snapshots written
+        since the previous call are processed and appended, so that the spectra of a running
+        simulation can be refreshed at a cost proportional to the new data. A new DynaRun object
+        must be created to see the snapshots written after its cdyna file was opened.
+        The parameters of all the calls must be the same. If None, all the time steps are processed.
+
+    trans_energies_dtype : np.dtype, optional
+        Data type of the transition energy tensor (see TransitionEnergies). np.float32 halves its memory.
+
+    num_sigma : float, optional
+        For method='exact', only the transitions within num_sigma * eta of the probe energies are evaluated,
+        using an index of the transitions sorted by energy (see trans_abs_kernel for the error bound).
+        E.g. num_sigma=6 gives a relative error below 1e-8. Default is None: all the transitions are evaluated.
+
+    track_memory : bool, optional
+        Record the peak memory of the total and of the kernel timings (with tracemalloc, which slows down
+        the calculation). Default is False.
+
     Returns
     -------
 
     time_grid : np.ndarray
         Time grid for the transient absorption spectrum.
+        In the incremental mode, the times of all the processed steps.
 
     trans_abs_energy_grid : np.ndarray
         Energy grid for the transient absorption spectrum.
@@ -75,15 +651,10 @@ def compute_trans_abs(elec_dyna_run,
 
     dA_hole : np.ndarray
         Hole contribution to the transient absorption spectrum. Shape (num_energy_points, num_steps).
-
-    tr_dipoles_sqr : np.ndarray
-        Transition dipoles squared, valence-to-conduction for each k-point and band.
-        Currently, the k-grid for dipoles must match the one for electrons.
-        Experimental feature.
     """
 
     trun = TimingGroup('trans. abs.')
-    trun.add('total', level=3).start()
+    trun.add('total', level=3, track_memory=track_memory).start()
 
     # Check the consistency of the two DynaRun objects
 
@@ -115,9 +686,9 @@ def compute_trans_abs(elec_dyna_run,
     elec_kpoint_array = elec_dyna_run._kpoints
     hole_kpoint_array = hole_dyna_run._kpoints
 
-    # Convert from Ry to eV
-    elec_energy_array *= energy_conversion_factor('Ry', 'eV')
-    hole_energy_array *= energy_conversion_factor('Ry', 'eV')
+    # Convert from Ry to eV. The raw arrays of the DynaRun objects are left unchanged
+    elec_energy_array = elec_energy_array * energy_conversion_factor('Ry', 'eV')
+    hole_energy_array = hole_energy_array * energy_conversion_factor('Ry', 'eV')
 
     # Number of bands
     elec_nband = len(elec_dyna_run.bands)
@@ -143,15 +714,14 @@ def compute_trans_abs(elec_dyna_run,
     num_energy_points = trans_abs_energy_grid.shape[0]
     print(f"{'Number of energy grid points':>30}: {num_energy_points}\n")
 
-    # Find the interection between the electron and hole k-points
+    # Find the interection between the electron and hole k-points and the transition energies,
+    # shape (elec_nband, hole_nband, num_intersect_kpoints), cached on elec_dyna_run
     print('Finding intersect k-points...')
-    with trun.add('intersect kpoints') as t:
-        ekidx, hkidx = np.intersect1d(
-            elec_kpoint_array.view('float64,float64,float64').reshape(-1),
-            hole_kpoint_array.view('float64,float64,float64').reshape(-1),
-            return_indices=True)[1:]
+    with trun.add('transition energies') as t:
+        trans = TransitionEnergies.from_dyna_runs(elec_dyna_run, hole_dyna_run, dtype=trans_energies_dtype)
 
-        assert ekidx.size == hkidx.size, 'The number of intersect k-points is different.'
+        ekidx, hkidx = trans.ekidx, trans.hkidx
+        trans_energies = trans.energies
 
         num_intersect_kpoints = ekidx.size
 
@@ -168,92 +738,110 @@ def compute_trans_abs(elec_dyna_run,
             print('\nTransition dipoles are provided.')
             print(f"{'Tr. dip. shape (num. elec. bands, num. hole bands, num. k points)':>30}: {tr_dipoles_sqr.shape}\n")
 
-    # Compute all the Gaussian deltas on the intersect grid
-    print('Computing Gaussian deltas...')
-    with trun.add('compute deltas') as t:
-        ALL_DELTAS = np.zeros((elec_nband, hole_nband, num_intersect_kpoints, num_energy_points))
-
-        # Here, we vectorize over the k-points (ekidx, hkidx), the most expensive operation
-        # Computation can still be vectorized for the energy points
-        for iband in range(elec_nband):
-            for jband in range(hole_nband):
-                for ienergy in range(num_energy_points):
-                    # Factor of two from spin.
-                    ALL_DELTAS[iband, jband, :, ienergy] = \
-                        gaussian_delta(elec_energy_array[ekidx, iband] -
-                                       hole_energy_array[hkidx, jband],
-                                       trans_abs_energy_grid[ienergy], eta)
-
-                    if tr_dipoles_sqr is not None:
-                        ALL_DELTAS[iband, jband, :, ienergy] *= 0.5 * tr_dipoles_sqr[iband, jband, ekidx]
-                    else:
-                        ALL_DELTAS[iband, jband, :, ienergy] *= 2.0
-
-        get_size(ALL_DELTAS, 'ALL_DELTAS', dump=True)
-        print('')
-
-    # Compute the transient absorption spectrum first for electrons and holes separately
-    print('Computing transient absorption spectrum...')
-    with trun.add('compute trans. abs.') as t:
-
-        # Store all the occupations at once in numpy arrays
-        # If the memory consumption is too high, one has to setup an explicit time loop for transient absorption
-        e_occs_time_array = np.zeros((num_steps, num_intersect_kpoints, elec_nband))
-        h_occs_time_array = np.zeros((num_steps, num_intersect_kpoints, hole_nband))
+    # Transition weights on the intersect grid. Factor of two from spin.
+    if tr_dipoles_sqr is not None:
+        weights = (0.5 * tr_dipoles_sqr[:, :, ekidx]).astype(trans_energies.dtype, copy=False)
+    else:
+        weights = np.full(trans_energies.shape, 2.0, dtype=trans_energies.dtype)
 
-        # number of dynamics run
-        ndyna = 1
-        for istep in range(num_steps):
+    # number of dynamics run
+    ndyna = 1
 
-            # HDF5 dataset names
-            elec_dset_name = f'dynamics_run_{ndyna}/snap_t_{istep}'
-            hole_dset_name = f'dynamics_run_{ndyna}/snap_t_{istep}'
+    step_range = range(num_steps)
 
-            # Read the occupations
-            # We read them directly from the HDF5 files. Usually, this data is not stored in memory.
-            elec_occs = elec_dyna_run._cdyna_file[elec_dset_name][()]
-            # Minus sign for transient absorption, store only on the intersect grid, hence ekidx
-            elec_occs = -elec_occs[ekidx, :]
+    # Incremental mode: only the snapshots written since the last call are processed
+    if result_path is not None:
+        result_params = {
+            'de_grid': de_grid,
+            'eta': eta,
+            'energy_grid_max': energy_grid_max,
+            'method': method,
+            'bin_width': 'None' if bin_width is None else bin_width,
+            'tr_dipoles': tr_dipoles_sqr is not None,
+            'num_sigma': 'None' if num_sigma is None else num_sigma,
+            'num_intersect_kpoints': num_intersect_kpoints,
+        }
 
-            hole_occs = 1.0 - hole_dyna_run._cdyna_file[hole_dset_name][()]
-            hole_occs = -hole_occs[hkidx, :]
+        first_step = _load_trans_abs_state(result_path, result_params, trans_abs_energy_grid)
 
-            # Second index of elec_occs is band, one can select specific bands here
-            e_occs_time_array[istep, :, :] = elec_occs[:, :]
-            h_occs_time_array[istep, :, :] = hole_occs[:, :]
+        # Snapshots available in both files, consecutive from snap_t_0
+        num_available = min(_num_consecutive_snaps(elec_dyna_run._cdyna_file[f'dynamics_run_{ndyna}']),
+                            _num_consecutive_snaps(hole_dyna_run._cdyna_file[f'dynamics_run_{ndyna}']),
+                            num_steps)
 
-        get_size(e_occs_time_array, 'e_occs_time_array', dump=True)
-        get_size(h_occs_time_array, 'h_occs_time_array', dump=True)
-        print('')
+        step_range = range(first_step, max(first_step, num_available))
 
-        # Compute the transient absorption spectrum
-        dA_elec = np.zeros((num_energy_points, num_steps))
-        dA_hole = np.zeros((num_energy_points, num_steps))
-        for iband in range(elec_nband):
-            for jband in range(hole_nband):
+        print(f"{'Previously processed steps':>30}: {first_step}")
+        print(f"{'New steps':>30}: {len(step_range)}\n")
 
-                # Sum over intersect k-points
-                dA_elec[:, :] += (np.tensordot(e_occs_time_array[:, :, iband],
-                                  ALL_DELTAS[iband, jband, :, :], axes=((1), (0))) / num_intersect_kpoints).T
+    # Compute the transient absorption spectrum first for electrons and holes separately
+    print('Computing transient absorption spectrum...')
 
-                dA_hole[:, :] += (np.tensordot(h_occs_time_array[:, :, jband],
-                                  ALL_DELTAS[iband, jband, :, :], axes=((1), (0))) / num_intersect_kpoints).T
+    if len(step_range) == 0:
+        dA_elec = np.zeros((num_energy_points, 0))
+        dA_hole = np.zeros((num_energy_points, 0))
+
+    elif n_workers is None or n_workers <= 1:
+        elec_group = elec_dyna_run._cdyna_file[f'dynamics_run_{ndyna}']
+        hole_group = hole_dyna_run._cdyna_file[f'dynamics_run_{ndyna}']
+
+        dA_elec, dA_hole = \
+            _trans_abs_time_loop(elec_group, hole_group, step_range, ekidx, hkidx,
+                                 trans_energies, weights, trans_abs_energy_grid, eta,
+                                 method, memory_budget_mb, bin_width, occs_memory_mb, num_sigma, trun,
+                                 verbose=True, track_memory=track_memory)
+
+    else:
+        # Shards of intersect k-points, contiguous in the electron grid to limit the HDF5 reads of each worker
+        shards = np.array_split(np.argsort(ekidx), min(n_workers, num_intersect_kpoints))
+
+        print(f"{'Number of workers':>30}: {len(shards)}\n")
+
+        dA_elec = np.zeros((num_energy_points, len(step_range)))
+        dA_hole = np.zeros((num_energy_points, len(step_range)))
+
+        with trun.add('parallel trans. abs.') as t:
+            context = multiprocessing.get_context('spawn')
+            with ProcessPoolExecutor(max_workers=len(shards), mp_context=context) as executor:
+                futures = [executor.submit(_trans_abs_shard,
+                                           elec_dyna_run._cdyna_file.filename, hole_dyna_run._cdyna_file.filename,
+                                           ndyna, step_range, ekidx[shard], hkidx[shard],
+                                           trans_energies[:, :, shard], weights[:, :, shard],
+                                           trans_abs_energy_grid, eta,
+                                           method, memory_budget_mb, bin_width, occs_memory_mb, num_sigma,
+                                           track_memory)
+                           for shard in shards]
+
+                # Reduce the partial sums, normalized by the number of k-points of each shard
+                for ishard, (shard, future) in enumerate(zip(shards, futures)):
+                    shard_dA_elec, shard_dA_hole, shard_timings = future.result()
+                    dA_elec += shard_dA_elec * shard.size / num_intersect_kpoints
+                    dA_hole += shard_dA_hole * shard.size / num_intersect_kpoints
+
+                    trun.merge(shard_timings, prefix=f'shard {ishard} ', level=1)
+
+    if result_path is not None:
+        with trun.add('save result') as t:
+            time_grid, dA_elec, dA_hole = \
+                _append_trans_abs_result(result_path, result_params, trans_abs_energy_grid,
+                                         np.array(step_range) * time_step, dA_elec, dA_hole)
 
     # Save the data
-    print('Saving the data...')
-    with trun.add('save data') as t:
-        pump_energy = elec_dyna_run.pump_pulse.pump_energy
-        ending = f'_Epump_{pump_energy:.4f}'
-        # Total transient absorption
-        np.save(f'trans_abs_dA{ending}', dA_elec + dA_hole)
-        # Electron contribution
-        np.save(f'trans_abs_dA_elec{ending}', dA_elec)
-        # Hole contribution
-        np.save(f'trans_abs_dA_hole{ending}', dA_hole)
-        # Time grid
-        np.save(f'trans_abs_T{ending}', time_grid)
-        # Energy grid
-        np.save(f'trans_abs_E{ending}', trans_abs_energy_grid)
+    if save_npy:
+        print('Saving the data...')
+        with trun.add('save data') as t:
+            pump_energy = elec_dyna_run.pump_pulse.pump_energy
+            ending = f'_Epump_{pump_energy:.4f}'
+            # Total transient absorption
+            np.save(f'trans_abs_dA{ending}', dA_elec + dA_hole)
+            # Electron contribution
+            np.save(f'trans_abs_dA_elec{ending}', dA_elec)
+            # Hole contribution
+            np.save(f'trans_abs_dA_hole{ending}', dA_hole)
+            # Time grid
+            np.save(f'trans_abs_T{ending}', time_grid)
+            # Energy grid
+            np.save(f'trans_abs_E{ending}', trans_abs_energy_grid)
 
     trun.timings['total'].stop()
     print(trun)
@@ -1,5 +1,6 @@
 #!/usr/bin/env python3
 import time
+import tracemalloc
 from collections import OrderedDict
 
 
@@ -28,6 +29,11 @@ class Timing:
         The number of times the timing has been measured.
     level : int
         The level of importance (hierarchy) for the timing measurement.
+    track_memory : bool
+        If True, the peak memory allocated during the measurements is recorded with tracemalloc.
+        For nested measurements, the peak is counted from the start of the outermost one.
+    peak_memory : float or None
+        The maximum over the measurements of the peak allocated memory (bytes), if track_memory is True.
 
     Methods
     -------
@@ -35,6 +41,8 @@ class Timing:
         Start the timing measurement.
     stop()
         Stop the timing measurement and calculate the time difference.
+    merge(other)
+        Accumulate the measurements of another Timing object.
     __enter__()
         Enter the context for the timing measurement.
     __exit__(exc_type, exc_val, exc_tb)
@@ -75,7 +83,7 @@ class Timing:
     test (s): 1.500
     """
 
-    def __init__(self, tag, level=0):
+    def __init__(self, tag, level=0, track_memory=False):
         self.tag = tag
         self.t_start = None
         self.t_end = None
@@ -83,8 +91,18 @@ class Timing:
         self.total_runtime = 0.0
         self.call_count = 0
         self.level = level
+        self.track_memory = track_memory
+        self.peak_memory = 0.0 if track_memory else None
+        self._own_tracing = False
+        self._mem_start = 0
 
     def start(self):
+        if self.track_memory:
+            self._own_tracing = not tracemalloc.is_tracing()
+            if self._own_tracing:
+                tracemalloc.start()
+            self._mem_start = tracemalloc.get_traced_memory()[0]
+
         self.t_start = time.perf_counter()
 
     def stop(self):
@@ -93,6 +111,35 @@ class Timing:
         self.total_runtime += self.t_delta
         self.call_count += 1
 
+        if self.track_memory:
+            peak = tracemalloc.get_traced_memory()[1] - self._mem_start
+            self.peak_memory = max(self.peak_memory, peak)
+            if self._own_tracing:
+                tracemalloc.stop()
+                self._own_tracing = False
+
+    def merge(self, other):
+        """
+        Accumulate the measurements of another Timing object, e.g. measured in another thread or process.
+
+        Parameters
+        ----------
+        other : Timing
+            The timing to accumulate.
+
+        Returns
+        -------
+        self : Timing
+        """
+
+        self.total_runtime += other.total_runtime
+        self.call_count += other.call_count
+
+        if self.track_memory and other.track_memory:
+            self.peak_memory = max(self.peak_memory, other.peak_memory)
+
+        return self
+
     def __enter__(self):
         self.start()
         return self
@@ -117,6 +164,9 @@ class Timing:
 
         output = f'{tag_text:>{width}}  {self.total_runtime:<12.3f} {self.call_count:<10}'
 
+        if self.track_memory:
+            output += f' {self.peak_memory / 1024**2:<12.3f}'
+
         return output
 
 
@@ -133,6 +183,8 @@ class TimingGroup:
     -------
     add(tag, level=0)
         Add a new timing measurement with the given tag.
+    merge(other, prefix='', level=None)
+        Accumulate the timings of another TimingGroup.
     sort()
         Sort the timings based on the total runtime.
 
@@ -160,18 +212,39 @@ class TimingGroup:
         self.name = name
         self.timings = OrderedDict()
 
-    def add(self, tag, level=0):
+    def add(self, tag, level=0, track_memory=False):
         """
         Add timing to existing tag or create a new one.
+        If track_memory is True, the peak memory of the new timing is also recorded.
         """
         if tag in self.timings:
             timing = self.timings[tag]
         else:
-            timing = Timing(tag, level)
+            timing = Timing(tag, level, track_memory=track_memory)
             self.timings[tag] = timing
 
         return timing
 
+    def merge(self, other, prefix='', level=None):
+        """
+        Accumulate the timings of another TimingGroup, e.g. measured in a worker process.
+
+        Parameters
+        ----------
+        other : TimingGroup
+            The timings to accumulate.
+
+        prefix : str, optional
+            Prefix of the tags of the merged timings.
+
+        level : int, optional
+            Level of the merged timings. Default is the level of each timing in other.
+        """
+
+        for tag, timing in other.timings.items():
+            self.add(f'{prefix}{tag}', timing.level if level is None else level,
+                     track_memory=timing.track_memory).merge(timing)
+
     def sort(self):
         self.timings = dict(sorted(self.timings.items(), key=lambda x: x[1].total_runtime, reverse=True))
 
@@ -191,7 +264,10 @@ class TimingGroup:
 
         output += f'{line}{end}\n'
         output += f"{'=' * width}\n"
-        output += f'{"Tag":>30}  {"Time (s)":<12} {"Calls":<10}\n'
+        header = f'{"Tag":>30}  {"Time (s)":<12} {"Calls":<10}'
+        if any(timing_obj.track_memory for timing_obj in self.timings.values()):
+            header += f' {"Peak mem (MB)":<12}'
+        output += f'{header}\n'
         output += f"{'-' * width}\n"
 
         for tag, timing_obj in self.timings.items():
@@ -217,6 +293,10 @@ class TimingGroup:
                             for tag, timing in self.timings.items()
                         }
 
+        for tag, timing in self.timings.items():
+            if timing.track_memory:
+                timings_dict[tag]['peak_memory_mb'] = round(timing.peak_memory / 1024**2, 3)
+
         # timings_dict = {tag: timing.total_runtime for tag, timing in self.timings.items()}
         return timings_dict
 
@@ -1,6 +1,107 @@
+import os
+import h5py
+import yaml
+import numpy as np
 import pytest
 
+from perturbopy.io_utils.io import open_yaml
+from perturbopy.postproc import DynaRun
+
 
 @pytest.fixture
 def with_plt(request):
     return request.config.getoption("--plots")
+
+
+def _write_dyna_files(path, prefix='gaas', kdim=(4, 4, 4), num_bands=2, num_steps=6,
+                      num_runs=1, hole=False, seed=0, permute_k=False):
+    """
+    Method to write a synthetic dynamics-run calculation: prefix_cdyna.h5, prefix_tet.h5 and YAML file.
+
+    Returns
+    -------
+    cdyna_path, tet_path, yaml_path : str
+
+    """
+    rng = np.random.default_rng(seed)
+
+    grid = np.stack(np.meshgrid(*[np.arange(n) for n in kdim], indexing='ij'), axis=-1).reshape(-1, 3)
+    kpoints = grid / np.array(kdim, dtype=float)
+    if permute_k:
+        kpoints = kpoints[rng.permutation(kpoints.shape[0])]
+    num_k = kpoints.shape[0]
+
+    sign = -1.0 if hole else 1.0
+    energies = sign * (0.1 + 0.05 * np.arange(num_bands)[None, :] + 0.02 * rng.random((num_k, num_bands)))
+
+    cdyna_path = os.path.join(path, f'{prefix}_cdyna.h5')
+    tet_path = os.path.join(path, f'{prefix}_tet.h5')
+    yaml_path = os.path.join(path, f'{prefix}_dynamics-run.yml')
+
+    with h5py.File(tet_path, 'w') as f:
+        f.create_dataset('kpts_all_crys_coord', data=kpoints)
+
+    with h5py.File(cdyna_path, 'w') as f:
+        f.create_dataset('band_structure_ryd', data=energies)
+        f.create_dataset('num_runs', data=num_runs)
+        for irun in range(1, num_runs + 1):
+            group = f.create_group(f'dynamics_run_{irun}')
+            group.create_dataset('num_steps', data=num_steps)
+            group.create_dataset('time_step_fs', data=1.0)
+            first = 0 if irun == 1 else 1
+            for istep in range(first, num_steps + 1):
+                group.create_dataset(f'snap_t_{istep}', data=rng.random((num_k, num_bands)))
+
+    yaml_dict = open_yaml(os.path.join('refs', 'gaas_bands.yml'))
+    params = yaml_dict['input parameters']['after conversion']
+    params['calc_mode'] = 'dynamics-run'
+    params['prefix'] = prefix
+    params['pump_pulse'] = False
+    params['hole'] = hole
+    params['band_min'] = 1
+    params['band_max'] = num_bands
+    params['boltz_kdim'] = list(kdim)
+    params['boltz_qdim'] = list(kdim)
+    yaml_dict.pop('bands')
+    yaml_dict['dynamics-run'] = {}
+
+    with open(yaml_path, 'w') as f:
+        yaml.dump(yaml_dict, f)
+
+    return cdyna_path, tet_path, yaml_path
+
+
+@pytest.fixture
+def write_dyna_files():
+    """
+    Method to get the writer of synthetic dynamics-run calculations (prefix_cdyna.h5, prefix_tet.h5, YAML file).
+
+    """
+    return _write_dyna_files
+
+
+@pytest.fixture
+def elec_hole_runs(tmp_path, write_dyna_files):
+    """
+    Method to generate the electron and hole DynaRun objects of a synthetic pump-probe calculation.
+
+    Returns
+    -------
+    elec_dyna_run, hole_dyna_run : DynaRun
+
+    """
+    elec_path = tmp_path / 'elec'
+    hole_path = tmp_path / 'hole'
+    elec_path.mkdir()
+    hole_path.mkdir()
+
+    elec_dyna_run = DynaRun.from_hdf5_yaml(*write_dyna_files(str(elec_path), num_bands=2, seed=1),
+                                           read_snaps=False)
+    hole_dyna_run = DynaRun.from_hdf5_yaml(*write_dyna_files(str(hole_path), num_bands=3, hole=True, seed=2,
+                                                             permute_k=True),
+                                           read_snaps=False)
+
+    yield elec_dyna_run, hole_dyna_run
+
+    elec_dyna_run.close_hdf5_files()
+    hole_dyna_run.close_hdf5_files()
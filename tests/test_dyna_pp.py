@@ -0,0 +1,86 @@
+import os
+import h5py
+import yaml
+import numpy as np
+import pytest
+
+from perturbopy.io_utils.io import open_yaml
+from perturbopy.postproc import DynaPP
+from perturbopy.postproc.utils.cdyna_tools import repack_popu
+
+
+def write_popu_files(path, num_energies=7, num_times=11, seed=0):
+    """
+    Method to write a synthetic dynamics-pp calculation: prefix_popu.h5 and YAML file.
+
+    Returns
+    -------
+    popu_path, yaml_path : str
+       Paths to the files.
+
+    popu : np.ndarray
+       Populations. Shape (num_energies, num_times).
+
+    """
+    rng = np.random.default_rng(seed)
+    popu = rng.random((num_energies, num_times))
+
+    popu_path = os.path.join(path, 'gaas_popu.h5')
+    yaml_path = os.path.join(path, 'gaas_dynamics-pp.yml')
+
+    with h5py.File(popu_path, 'w') as f:
+        f.create_dataset('times_fs', data=np.arange(num_times, dtype=float))
+        f.create_dataset('energy_grid_ev', data=np.linspace(0.0, 0.5, num_energies))
+        group = f.create_group('energy_distribution')
+        for itime in range(num_times):
+            group.create_dataset(f'popu_t{itime}', data=popu[:, itime])
+
+    yaml_dict = open_yaml(os.path.join('refs', 'gaas_bands.yml'))
+    params = yaml_dict['input parameters']['after conversion']
+    params['calc_mode'] = 'dynamics-pp'
+    params['prefix'] = 'gaas'
+    yaml_dict.pop('bands')
+    yaml_dict['dynamics-pp'] = {}
+
+    with open(yaml_path, 'w') as f:
+        yaml.dump(yaml_dict, f)
+
+    return popu_path, yaml_path, popu
+
+
+@pytest.mark.parametrize("layout", ['per-time', 'consolidated'])
+@pytest.mark.parametrize("lazy, n_workers", [(False, None), (True, None), (False, 2)])
+def test_popu_loading(tmp_path, layout, lazy, n_workers):
+    """
+    Test the eager (serial and parallel) and lazy loading of the populations,
+    with the per-time and consolidated layouts.
+
+    """
+    popu_path, yaml_path, popu = write_popu_files(str(tmp_path))
+
+    if layout == 'consolidated':
+        repacked_path = str(tmp_path / 'gaas_popu_repacked.h5')
+        repack_popu(popu_path, repacked_path, chunk_times=4)
+        popu_path = repacked_path
+
+    dyna_pp = DynaPP.from_hdf5_yaml(popu_path, yaml_path, lazy=lazy, n_workers=n_workers)
+
+    assert dyna_pp.popu.shape == popu.shape
+    assert np.allclose(np.asarray(dyna_pp.popu), popu)
+
+    if lazy:
+        assert np.allclose(dyna_pp.popu[:, 3], popu[:, 3])
+        assert np.allclose(dyna_pp.popu[2:5, ::3], popu[2:5, ::3])
+        assert np.allclose(dyna_pp.popu[:, [9, 1, 1]], popu[:, [9, 1, 1]])
+        assert np.isclose(dyna_pp.popu[4, -1], popu[4, -1])
+        for key in [([0, 2], [1, 3]), ([[0], [2]], [1, 3]), ([6, 0, 6], [2, 2, 5]), (3, [8, 0])]:
+            np.testing.assert_array_equal(dyna_pp.popu[key], popu[key])
+        dyna_pp.close_hdf5_files()
+        dyna_pp.close_hdf5_files()
+
+        with pytest.raises(ValueError, match='closed'):
+            dyna_pp.popu[:, 0]
+    else:
+        # The file is closed after an eager loading
+        with h5py.File(popu_path, 'a'):
+            pass
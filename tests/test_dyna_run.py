@@ -0,0 +1,550 @@
+import numpy as np
+import pytest
+import os
+import itertools
+import gc
+from multiprocessing import shared_memory
+import h5py
+
+import perturbopy.postproc as ppy
+
+
+@pytest.fixture()
+def dyna_paths(tmp_path, write_dyna_files):
+    """
+    Method to generate the paths of a synthetic dynamics-run calculation with two runs.
+
+    """
+    return write_dyna_files(str(tmp_path), num_runs=2)
+
+
+def test_lazy_snaps(dyna_paths):
+    """
+    Method to test that the lazy SnapshotArray matches the snapshots read at initialization.
+
+    """
+    cdyna_path, tet_path, yaml_path = dyna_paths
+
+    dense = ppy.DynaRun.from_hdf5_yaml(cdyna_path, tet_path, yaml_path, read_snaps=True)
+    lazy = ppy.DynaRun.from_hdf5_yaml(cdyna_path, tet_path, yaml_path, read_snaps=False, snap_cache_size=2)
+
+    for irun in (1, 2):
+        ref = dense[irun].snap_t
+        snap_t = lazy[irun].snap_t
+
+        assert isinstance(snap_t, ppy.snapshots.SnapshotArray)
+        assert snap_t.shape == ref.shape
+
+        for key in [(Ellipsis,), (0, slice(None), 3), (slice(None), slice(2, 10, 3), slice(None, None, -2)),
+                    (1, slice(None), [4, 0, 4]), (Ellipsis, -1), ([0, 1], [5, 7], [1, 2])]:
+            np.testing.assert_array_equal(snap_t[key], ref[key])
+
+        np.testing.assert_array_equal(np.asarray(snap_t), ref)
+        assert len(snap_t._cache) <= 2
+
+    dense.close_hdf5_files()
+    lazy.close_hdf5_files()
+
+
+@pytest.mark.parametrize("start, stop, step, chunk, prefetch_depth", [
+                         [0, None, 1, 4, 1],
+                         [1, 6, 2, 1, 2],
+                         [0, None, 1, 64, 0],
+])
+def test_iter_snaps(dyna_paths, start, stop, step, chunk, prefetch_depth):
+    """
+    Method to test DynaRun.iter_snaps against the snapshots read at initialization.
+
+    """
+    cdyna_path, tet_path, yaml_path = dyna_paths
+    dyna_run = ppy.DynaRun.from_hdf5_yaml(cdyna_path, tet_path, yaml_path, read_snaps=True)
+
+    ref = dyna_run[2].snap_t[:, :, start:stop:step]
+    itimes, blocks = zip(*dyna_run.iter_snaps(2, start, stop, step, chunk=chunk, prefetch_depth=prefetch_depth))
+
+    np.testing.assert_array_equal(np.concatenate(itimes), np.arange(6)[start:stop:step])
+    np.testing.assert_array_equal(np.concatenate(blocks, axis=2), ref)
+
+    # Stopping the iteration early must not hang the prefetch thread
+    for itime, block in dyna_run.iter_snaps(1, chunk=1):
+        break
+
+    dyna_run.close_hdf5_files()
+
+
+@pytest.mark.parametrize("read_snaps, n_workers, snap_backend",
+                         [[True, None, 'h5py'], [False, None, 'h5py'], [False, None, 'memmap'], [True, 2, 'h5py']])
+def test_load_options(dyna_paths, read_snaps, n_workers, snap_backend):
+    """
+    Method to test the loading of a subset of steps, bands and k-points in single precision.
+
+    """
+    cdyna_path, tet_path, yaml_path = dyna_paths
+    ref = ppy.DynaRun.from_hdf5_yaml(cdyna_path, tet_path, yaml_path, read_snaps=True)
+
+    kpoint_mask = ref._energies[:, 0] > np.median(ref._energies[:, 0])
+
+    subset = ppy.DynaRun.from_hdf5_yaml(cdyna_path, tet_path, yaml_path, read_snaps=read_snaps,
+                                        n_workers=n_workers, snap_backend=snap_backend, snap_dtype=np.float32,
+                                        time_stride=2, time_window=(2.0, 6.0), band_index=[1],
+                                        kpoint_index=kpoint_mask)
+
+    for irun in (1, 2):
+        np.testing.assert_array_equal(subset[irun].steps, [2, 4, 6])
+        np.testing.assert_allclose(subset[irun].times, [2.0, 4.0, 6.0])
+
+        snap_t = subset[irun].snap_t
+        assert snap_t.shape == (1, np.count_nonzero(kpoint_mask), 3)
+        assert snap_t.dtype == np.float32
+        np.testing.assert_allclose(snap_t[:, :, :], ref[irun].snap_t[1:2, kpoint_mask, 1::2], rtol=1e-6)
+
+        # The streamed snapshots have the same steps, subsets and data type as snap_t
+        blocks = [snaps for _, snaps in subset.iter_snaps(irun, chunk=2)]
+        assert all(snaps.dtype == np.float32 for snaps in blocks)
+        np.testing.assert_array_equal(np.concatenate(blocks, axis=2), snap_t[:, :, :])
+
+    times = ppy.DynaRun.from_hdf5_yaml(cdyna_path, tet_path, yaml_path, read_snaps=read_snaps, times=[0.9, 5.2])
+    np.testing.assert_array_equal(times[1].steps, [1, 5])
+    np.testing.assert_array_equal(times[1].snap_t[:, :, :], ref[1].snap_t[:, :, [0, 4]])
+
+    with pytest.raises(ValueError):
+        ppy.DynaRun.from_hdf5_yaml(cdyna_path, tet_path, yaml_path, time_window=(10.0, 20.0))
+
+    for dyna_run in (ref, subset, times):
+        dyna_run.close_hdf5_files()
+
+
+@pytest.mark.parametrize("compression", [None, 'gzip', 'per-step', 'contiguous'])
+def test_memmap_snaps(dyna_paths, tmp_path, compression):
+    """
+    Method to test the memory-mapped snapshots against the h5py reads, with the fallback for compressed data.
+
+    """
+    cdyna_path, tet_path, yaml_path = dyna_paths
+    ref = ppy.DynaRun.from_hdf5_yaml(cdyna_path, tet_path, yaml_path, read_snaps=True)
+
+    if compression != 'per-step':
+        cdyna_path = str(tmp_path / 'repacked_cdyna.h5')
+        ppy.cdyna_tools.repack_cdyna(dyna_paths[0], cdyna_path, compression=None if compression == 'contiguous'
+                                     else compression, chunk_steps=4)
+
+    if compression == 'contiguous':
+        with h5py.File(cdyna_path, 'a') as f:
+            for irun in (1, 2):
+                group = f[f'dynamics_run_{irun}']
+                snaps, first_step = group['snaps'][()], group['snaps'].attrs['first_step']
+                del group['snaps']
+                group.create_dataset('snaps', data=snaps)
+                group['snaps'].attrs['first_step'] = first_step
+
+    mapped = ppy.DynaRun.from_hdf5_yaml(cdyna_path, tet_path, yaml_path, read_snaps=False, snap_backend='memmap')
+
+    for irun in (1, 2):
+        snap_t = mapped[irun].snap_t
+        assert isinstance(snap_t, ppy.snapshots.MemmapSnapshotArray)
+        # The consolidated layout is chunked by repack_cdyna
+        assert snap_t.is_mapped(0) == (compression in ('per-step', 'contiguous'))
+        np.testing.assert_array_equal(snap_t[:, 5:20, ::2], ref[irun].snap_t[:, 5:20, ::2])
+        np.testing.assert_array_equal(snap_t.get_step(3), ref[irun].snap_t[:, :, 3].T)
+
+    with pytest.raises(ValueError):
+        ppy.DynaRun.from_hdf5_yaml(cdyna_path, tet_path, yaml_path, read_snaps=False, snap_backend='mmap')
+
+    ref.close_hdf5_files()
+    mapped.close_hdf5_files()
+
+
+@pytest.mark.filterwarnings('error::pytest.PytestUnraisableExceptionWarning')
+@pytest.mark.parametrize("repacked", [False, True])
+def test_read_snaps_workers(dyna_paths, tmp_path, monkeypatch, repacked):
+    """
+    Method to test that the snapshots read in worker processes into shared memory match the serial read.
+
+    """
+    cdyna_path, tet_path, yaml_path = dyna_paths
+    ref = ppy.DynaRun.from_hdf5_yaml(cdyna_path, tet_path, yaml_path, read_snaps=True)
+
+    if repacked:
+        cdyna_path = str(tmp_path / 'repacked_cdyna.h5')
+        ppy.cdyna_tools.repack_cdyna(dyna_paths[0], cdyna_path, chunk_steps=4)
+
+    shared = ppy.DynaRun.from_hdf5_yaml(cdyna_path, tet_path, yaml_path, read_snaps=True, n_workers=2)
+
+    for irun in (1, 2):
+        assert shared[irun].snap_t.shape == ref[irun].snap_t.shape
+        np.testing.assert_array_equal(shared[irun].snap_t, ref[irun].snap_t)
+
+    snap_t = shared[1].snap_t
+    ref.close_hdf5_files()
+    shared.close_hdf5_files()
+    del shared
+
+    # The shared memory stays valid as long as the array is used
+    np.testing.assert_array_equal(snap_t, ref[1].snap_t)
+
+    # The block is closed with the last view of the array
+    gc.collect()
+    closed = []
+    close = shared_memory.SharedMemory.close
+    monkeypatch.setattr(shared_memory.SharedMemory, 'close', lambda shm: closed.append(shm.name) or close(shm))
+
+    del snap_t
+    gc.collect()
+    assert len(closed) == 1
+
+
+@pytest.mark.parametrize("compression", [None, 'gzip'])
+def test_repack_cdyna(dyna_paths, tmp_path, compression):
+    """
+    Method to test that a repacked cdyna file is read identically to the original one.
+
+    """
+    cdyna_path, tet_path, yaml_path = dyna_paths
+    repacked_path = os.path.join(str(tmp_path), 'repacked_cdyna.h5')
+
+    ppy.cdyna_tools.repack_cdyna(cdyna_path, repacked_path, compression=compression, chunk_steps=4)
+
+    with h5py.File(repacked_path, 'r') as f:
+        assert 'snap_t_1' not in f['dynamics_run_1']
+        assert f['dynamics_run_1/snaps'].shape == (7, 64, 2)
+        assert f['dynamics_run_2/snaps'].shape == (6, 64, 2)
+
+    ref = ppy.DynaRun.from_hdf5_yaml(cdyna_path, tet_path, yaml_path, read_snaps=True)
+    dense = ppy.DynaRun.from_hdf5_yaml(repacked_path, tet_path, yaml_path, read_snaps=True)
+    lazy = ppy.DynaRun.from_hdf5_yaml(repacked_path, tet_path, yaml_path, read_snaps=False)
+
+    for irun in (1, 2):
+        np.testing.assert_array_equal(dense[irun].snap_t, ref[irun].snap_t)
+        np.testing.assert_array_equal(lazy[irun].snap_t[:, 3:9, ::2], ref[irun].snap_t[:, 3:9, ::2])
+
+    with pytest.raises(FileExistsError):
+        ppy.cdyna_tools.repack_cdyna(cdyna_path, repacked_path)
+
+    with pytest.raises(ValueError):
+        ppy.cdyna_tools.repack_cdyna(cdyna_path, cdyna_path, overwrite=True)
+
+    with pytest.raises(FileNotFoundError):
+        ppy.cdyna_tools.repack_cdyna(str(tmp_path / 'missing_cdyna.h5'), str(tmp_path / 'out.h5'))
+
+    for dyna_run in (ref, dense, lazy):
+        dyna_run.close_hdf5_files()
+
+
+@pytest.mark.parametrize("irun, chunk, prefetch_depth", [[None, 64, 1], [None, 3, 0], [2, 4, 1]])
+def test_compute_populations(dyna_paths, irun, chunk, prefetch_depth):
+    """
+    Method to test the carrier populations against histograms of each snapshot.
+
+    """
+    dyna_run = ppy.DynaRun.from_hdf5_yaml(*dyna_paths, read_snaps=False)
+
+    energy_grid = np.linspace(1.5, 2.5, 21)
+    de = energy_grid[1] - energy_grid[0]
+    edges = np.append(energy_grid - de / 2, energy_grid[-1] + de / 2)
+    energies_ev = dyna_run._energies * ppy.constants.energy_conversion_factor('Ry', 'eV')
+    num_kpoints = np.prod(dyna_run.boltz_kdim)
+
+    times, popu, carrier_number = dyna_run.compute_populations(energy_grid, irun=irun, chunk=chunk,
+                                                               prefetch_depth=prefetch_depth)
+
+    with h5py.File(dyna_paths[0], 'r') as f:
+        if irun is None:
+            snaps = [f[f'dynamics_run_1/snap_t_{i}'][()] for i in range(7)] + \
+                    [f[f'dynamics_run_2/snap_t_{i}'][()] for i in range(1, 7)]
+            np.testing.assert_allclose(times, np.arange(13))
+        else:
+            snaps = [f[f'dynamics_run_2/snap_t_{i}'][()] for i in range(1, 7)]
+            np.testing.assert_allclose(times, np.arange(1, 7))
+
+    assert popu.shape == (energy_grid.size, len(snaps))
+
+    for itime, snap in enumerate(snaps):
+        hist, _ = np.histogram(energies_ev.ravel(), bins=edges, weights=snap.ravel())
+        np.testing.assert_allclose(popu[:, itime], hist / (num_kpoints * de), atol=1e-12)
+        np.testing.assert_allclose(carrier_number[itime], np.sum(snap) / num_kpoints)
+
+    with pytest.raises(ValueError):
+        dyna_run.compute_populations(np.array([0.0, 0.1, 0.3]))
+
+    dyna_run.close_hdf5_files()
+
+
+@pytest.mark.parametrize("irun, chunk", [[None, 64], [2, 4]])
+def test_observables(dyna_paths, irun, chunk):
+    """
+    Method to test the observables on Fermi-Dirac snapshots of known temperatures and chemical potentials,
+    and the sidecar cache.
+
+    """
+    cdyna_path = dyna_paths[0]
+
+    dyna_run = ppy.DynaRun.from_hdf5_yaml(*dyna_paths, read_snaps=False)
+    energies_ev = dyna_run._energies * ppy.constants.energy_conversion_factor('Ry', 'eV')
+    eps = energies_ev - np.min(energies_ev)
+    num_kpoints = np.prod(dyna_run.boltz_kdim)
+    dyna_run.close_hdf5_files()
+
+    # Fermi-Dirac occupations, temperature and chemical potential depending on the step
+    kb = ppy.constants.boltzmann('ev/K')
+    ref = {}
+
+    with h5py.File(cdyna_path, 'a') as f:
+        for jrun in (1, 2):
+            for name in [key for key in f[f'dynamics_run_{jrun}'] if key.startswith('snap_t_')]:
+                step = int(name[7:])
+                temp, mu = 300.0 + 50.0 * step + 400.0 * (jrun - 1), 0.01 * step
+                f[f'dynamics_run_{jrun}/{name}'][()] = 1.0 / (np.exp((eps - mu) / (kb * temp)) + 1.0)
+                ref[(jrun, step)] = (temp, mu)
+
+    keys = [(1, step) for step in range(7)] + [(2, step) for step in range(1, 7)] if irun is None else \
+           [(2, step) for step in range(1, 7)]
+
+    which = ['carrier_number', 'mean_energy', 'temperature', 'chem_potential']
+
+    dyna_run = ppy.DynaRun.from_hdf5_yaml(*dyna_paths, read_snaps=False)
+    cache_path = os.path.splitext(cdyna_path)[0] + '_observables.h5'
+
+    # Nothing is written to disk by default
+    not_cached = dyna_run.observables(irun=irun, which='temperature')
+    assert not os.path.isfile(cache_path)
+
+    obs = dyna_run.observables(irun=irun, which=which, chunk=chunk, cache=True)
+    np.testing.assert_allclose(not_cached['temperature'], obs['temperature'])
+
+    assert obs.dtype.names == ('time',) + tuple(which)
+    assert obs.shape == (len(keys),)
+
+    with h5py.File(cdyna_path, 'r') as f:
+        for itime, (jrun, step) in enumerate(keys):
+            snap = f[f'dynamics_run_{jrun}/snap_t_{step}'][()]
+            np.testing.assert_allclose(obs['carrier_number'][itime], np.sum(snap) / num_kpoints)
+            np.testing.assert_allclose(obs['mean_energy'][itime], np.sum(snap * eps) / np.sum(snap))
+            np.testing.assert_allclose(obs['temperature'][itime], ref[(jrun, step)][0], rtol=1e-6)
+            np.testing.assert_allclose(obs['chem_potential'][itime], ref[(jrun, step)][1], atol=1e-8)
+
+    # Second call: read from the sidecar file
+    assert os.path.isfile(cache_path)
+
+    with h5py.File(cache_path, 'a') as f:
+        group = f['all_runs' if irun is None else f'run_{irun}']
+        group['temperature'][0] = -1.0
+
+    cached = dyna_run.observables(irun=irun, which=['temperature', 'carrier_number'], cache=True)
+    assert cached['temperature'][0] == -1.0
+    np.testing.assert_allclose(cached['carrier_number'], obs['carrier_number'])
+
+    # A different threshold invalidates the cache
+    recomputed = dyna_run.observables(irun=irun, which='temperature', occ_min=1e-5, cache_path=cache_path)
+    assert recomputed['temperature'][0] != -1.0
+
+    with pytest.raises(ValueError):
+        dyna_run.observables(which=['entropy'])
+
+    dyna_run.close_hdf5_files()
+
+
+def test_band_velocities_drift(dyna_paths):
+    """
+    Method to test the finite-difference band velocities on a cosine band, and the drift velocities.
+
+    """
+    cdyna_path, tet_path, yaml_path = dyna_paths
+
+    with h5py.File(tet_path, 'r') as f:
+        kpoints = f['kpts_all_crys_coord'][()]
+
+    # E(k) = sum_i A_i cos(2 pi k_i), in Ry; second band shifted
+    amplitude = np.array([0.01, 0.02, 0.03])
+    energies = np.sum(amplitude * np.cos(2 * np.pi * kpoints), axis=1)
+    energies = np.stack([energies, 2.0 * energies + 0.1], axis=1)
+
+    with h5py.File(cdyna_path, 'a') as f:
+        f['band_structure_ryd'][()] = energies
+
+    dyna_run = ppy.DynaRun.from_hdf5_yaml(cdyna_path, tet_path, yaml_path, read_snaps=False)
+
+    velocities = dyna_run.band_velocities
+    assert velocities.shape == (kpoints.shape[0], 2, 3)
+    assert dyna_run.band_velocities is velocities
+
+    # Central differences of the cosine, in crystal coordinates
+    h = 1.0 / dyna_run.boltz_kdim
+    grad_cryst = -amplitude * np.sin(2 * np.pi * kpoints) * np.sin(2 * np.pi * h) / h
+    grad_cryst = np.stack([grad_cryst, 2.0 * grad_cryst], axis=1)
+
+    alat_cm = dyna_run.alat * 0.529177249e-8
+    factor = ppy.constants.energy_conversion_factor('Ry', 'eV') * alat_cm / (2 * np.pi) / \
+        ppy.constants.hbar('ev*s')
+
+    # Back to crystal coordinates: grad_cryst = recip_lat.T @ grad_cart
+    np.testing.assert_allclose(velocities / factor @ dyna_run.recip_lat, grad_cryst, atol=1e-12)
+
+    times, drift_vel = dyna_run.drift_velocity(chunk=4)
+    assert drift_vel.shape == (13, 3)
+
+    with h5py.File(cdyna_path, 'r') as f:
+        snaps = [f[f'dynamics_run_1/snap_t_{i}'][()] for i in range(7)] + \
+                [f[f'dynamics_run_2/snap_t_{i}'][()] for i in range(1, 7)]
+
+    for itime, snap in enumerate(snaps):
+        ref = np.sum(snap[:, :, None] * velocities, axis=(0, 1)) / np.sum(snap)
+        np.testing.assert_allclose(drift_vel[itime], ref)
+
+    dyna_run.close_hdf5_files()
+
+
+def test_to_cdyna_h5_storage(dyna_paths, tmp_path):
+    """
+    Method to test that a cdyna file written with gzip compression and float32 storage is read back.
+
+    """
+    cdyna_path, tet_path, yaml_path = dyna_paths
+    ref = ppy.DynaRun.from_hdf5_yaml(cdyna_path, tet_path, yaml_path, read_snaps=True)
+
+    new_path = tmp_path / 'compressed'
+    ppy.DynaRun.to_cdyna_h5('gaas', ref._energies, ref[1].snap_t.transpose(2, 1, 0), 1.0, path=str(new_path),
+                            compression='gzip', compression_opts=4, shuffle=True, storage_dtype=np.float32)
+
+    with h5py.File(str(new_path / 'gaas_cdyna.h5'), 'r') as f:
+        assert f['dynamics_run_1/snap_t_0'].dtype == np.float32
+        assert f['dynamics_run_1/snap_t_0'].compression == 'gzip'
+
+    new = ppy.DynaRun.from_hdf5_yaml(str(new_path / 'gaas_cdyna.h5'), tet_path, yaml_path, read_snaps=True)
+
+    # The first written snapshot is the initial state snap_t_0
+    np.testing.assert_allclose(new[1].snap_t, ref[1].snap_t[:, :, 1:], rtol=1e-6)
+
+    ref.close_hdf5_files()
+    new.close_hdf5_files()
+
+
+def test_to_cdyna_h5_stream_append(dyna_paths, tmp_path):
+    """
+    Method to test writing a cdyna file from generators, with several runs, and appending runs to it.
+
+    """
+    cdyna_path, tet_path, yaml_path = dyna_paths
+    ref = ppy.DynaRun.from_hdf5_yaml(cdyna_path, tet_path, yaml_path, read_snaps=False)
+
+    def snaps(irun, first):
+        return (ref[irun].snap_t[:, :, istep].T for istep in range(first, ref[irun].snap_t.shape[2]))
+
+    with h5py.File(cdyna_path, 'r') as f:
+        snap_0 = f['dynamics_run_1/snap_t_0'][()]
+
+    new_path = str(tmp_path / 'new')
+
+    # The runs themselves can be given by a generator
+    runs = (run for run in [itertools.chain([snap_0], snaps(1, 0)), snaps(2, 0)])
+    ppy.DynaRun.to_cdyna_h5('gaas', ref._energies, runs, 1.0, path=new_path, num_runs=2)
+    ppy.DynaRun.to_cdyna_h5('gaas', None, snaps(2, 2), np.array([2.0]), path=new_path, new=False)
+
+    new = ppy.DynaRun.from_hdf5_yaml(os.path.join(new_path, 'gaas_cdyna.h5'), tet_path, yaml_path, read_snaps=False)
+
+    assert new.num_runs == 3
+    assert new[3].time_step == 2.0
+    np.testing.assert_array_equal(new[1].snap_t[()], ref[1].snap_t[()])
+    np.testing.assert_array_equal(new[2].snap_t[()], ref[2].snap_t[()])
+    np.testing.assert_array_equal(new[3].snap_t[()], ref[2].snap_t[:, :, 2:])
+
+    new.close_hdf5_files()
+
+    # A single initial state is also written as the first step
+    ppy.DynaRun.to_cdyna_h5('gaas', ref._energies, snap_0[None, :, :], 1.0, path=new_path, overwrite=True)
+
+    with h5py.File(os.path.join(new_path, 'gaas_cdyna.h5'), 'r') as f:
+        assert f['dynamics_run_1/num_steps'][()] == 1
+        np.testing.assert_array_equal(f['dynamics_run_1/snap_t_1'][()], snap_0)
+
+    # A snapshot of the wrong shape does not leave an incomplete run
+    with pytest.raises(ValueError):
+        ppy.DynaRun.to_cdyna_h5('gaas', None, [snap_0, snap_0.T], 1.0, path=new_path, new=False)
+
+    with h5py.File(os.path.join(new_path, 'gaas_cdyna.h5'), 'r') as f:
+        assert f['num_runs'][()] == 1
+        assert 'dynamics_run_2' not in f
+
+    # Appending with a band structure of a different shape
+    with pytest.raises(ValueError, match='does not match'):
+        ppy.DynaRun.to_cdyna_h5('gaas', ref._energies[:, :1], [snap_0[:, :1]], 1.0, path=new_path, new=False)
+
+    with pytest.raises(ValueError):
+        ppy.DynaRun.to_cdyna_h5('gaas', ref._energies, [snap_0[None, :, :]], 1.0, path=new_path, num_runs=2,
+                                overwrite=True)
+
+    with pytest.raises(FileNotFoundError):
+        ppy.DynaRun.to_cdyna_h5('gaas', None, [snap_0], 1.0, path=str(tmp_path / 'missing'), new=False)
+
+    ref.close_hdf5_files()
+
+
+@pytest.mark.parametrize("repacked", [False, True])
+def test_restart_seed_truncate(dyna_paths, tmp_path, repacked):
+    """
+    Method to test the restart seed extraction and the truncation of a cdyna file.
+
+    """
+    cdyna_path, tet_path, yaml_path = dyna_paths
+    ref = ppy.DynaRun.from_hdf5_yaml(cdyna_path, tet_path, yaml_path, read_snaps=True)
+
+    if repacked:
+        cdyna_path = str(tmp_path / 'repacked_cdyna.h5')
+        ppy.cdyna_tools.repack_cdyna(dyna_paths[0], cdyna_path, compression='gzip', chunk_steps=4)
+
+    seed_path = str(tmp_path / 'seed' / 'gaas_cdyna.h5')
+    os.makedirs(os.path.dirname(seed_path))
+
+    assert ppy.cdyna_tools.extract_restart_seed(cdyna_path, seed_path) == (2, 6)
+
+    seed = ppy.DynaRun.from_hdf5_yaml(seed_path, tet_path, yaml_path, read_snaps=True)
+    assert seed.num_runs == 1
+    np.testing.assert_array_equal(seed[1].snap_t[:, :, 0], ref[2].snap_t[:, :, -1])
+    seed.close_hdf5_files()
+
+    truncated_path = str(tmp_path / 'truncated_cdyna.h5')
+    ppy.cdyna_tools.truncate_cdyna(cdyna_path, truncated_path, 2, 3)
+
+    truncated = ppy.DynaRun.from_hdf5_yaml(truncated_path, tet_path, yaml_path, read_snaps=True)
+    assert truncated.num_runs == 2
+    np.testing.assert_array_equal(truncated[1].snap_t, ref[1].snap_t)
+    np.testing.assert_array_equal(truncated[2].snap_t, ref[2].snap_t[:, :, :3])
+    truncated.close_hdf5_files()
+
+    with pytest.raises(ValueError):
+        ppy.cdyna_tools.truncate_cdyna(cdyna_path, truncated_path, 2, 7, overwrite=True)
+
+    with pytest.raises(FileExistsError):
+        ppy.cdyna_tools.extract_restart_seed(cdyna_path, truncated_path, 1, 0)
+
+    ref.close_hdf5_files()
+
+
+def test_build_cdyna_vds(tmp_path, write_dyna_files):
+    """
+    Method to test the virtual dataset stitching two runs and a restart (in the consolidated layout).
+
+    """
+    path_1 = tmp_path / 'first'
+    path_2 = tmp_path / 'restart'
+    path_1.mkdir()
+    path_2.mkdir()
+
+    cdyna_1 = write_dyna_files(str(path_1), num_runs=2, num_steps=3, seed=1)[0]
+    cdyna_2 = write_dyna_files(str(path_2), num_runs=1, num_steps=4, seed=2)[0]
+    repacked_2 = str(path_2 / 'repacked_cdyna.h5')
+    ppy.cdyna_tools.repack_cdyna(cdyna_2, repacked_2)
+
+    vds_path = str(tmp_path / 'all_cdyna.h5')
+    time_fs = ppy.cdyna_tools.build_cdyna_vds([cdyna_1, repacked_2], vds_path)
+
+    np.testing.assert_allclose(time_fs, np.arange(11))
+
+    with h5py.File(cdyna_1, 'r') as f1, h5py.File(cdyna_2, 'r') as f2:
+        ref = [f1[f'dynamics_run_1/snap_t_{i}'][()] for i in range(4)] + \
+              [f1[f'dynamics_run_2/snap_t_{i}'][()] for i in range(1, 4)] + \
+              [f2[f'dynamics_run_1/snap_t_{i}'][()] for i in range(1, 5)]
+
+    with h5py.File(vds_path, 'r') as f:
+        np.testing.assert_array_equal(f['snaps'][()], np.array(ref))
+        np.testing.assert_array_equal(f['snaps'][5:9, 10, :], np.array(ref)[5:9, 10, :])
+        np.testing.assert_array_equal(f['source_step'][()], [0, 1, 2, 3, 1, 2, 3, 1, 2, 3, 4])
@@ -0,0 +1,98 @@
+import numpy as np
+import pytest
+
+import perturbopy.postproc as ppy
+
+
+@pytest.fixture()
+def kgrid_points():
+    """
+    Fixture to generate the k-points of a (3, 4, 5) grid in random order, with rounding noise.
+
+    """
+    kdim = (3, 4, 5)
+    rng = np.random.default_rng(0)
+
+    grid = np.stack(np.meshgrid(*[np.arange(n) for n in kdim], indexing='ij'), axis=-1).reshape(-1, 3)
+    kpoints = grid / np.array(kdim, dtype=float)
+    kpoints = kpoints[rng.permutation(kpoints.shape[0])]
+
+    return kdim, kpoints + rng.uniform(-1e-9, 1e-9, kpoints.shape)
+
+
+def test_lookup(kgrid_points):
+    """
+    Method to test the scalar and vectorized lookups, including the folding into the first BZ.
+
+    """
+    kdim, kpoints = kgrid_points
+    kgrid = ppy.KGridIndex(kpoints, kdim)
+
+    assert len(kgrid) == 60
+    np.testing.assert_array_equal(kgrid.lookup(kpoints), np.arange(60))
+
+    # Points equivalent by a reciprocal lattice vector
+    np.testing.assert_array_equal(kgrid.lookup(kpoints[:10] - [1.0, 0.0, 2.0]), np.arange(10))
+
+    assert kgrid.index(kpoints[7] + [0.0, -1.0, 0.0]) == 7
+    assert kpoints[3] in kgrid
+
+    # Off-grid point
+    assert [0.1, 0.0, 0.0] not in kgrid
+    with pytest.raises(ValueError):
+        kgrid.lookup([[0.1, 0.0, 0.0]])
+
+
+def test_match(kgrid_points):
+    """
+    Method to test the matching of two subsets of the same grid against np.intersect1d.
+
+    """
+    kdim, kpoints = kgrid_points
+
+    elec = kpoints[:45]
+    hole = kpoints[20:][::-1]
+
+    ekidx, hkidx = ppy.KGridIndex(elec, kdim).match(ppy.KGridIndex(hole, kdim))
+
+    ref_ekidx, ref_hkidx = np.intersect1d(elec.view('float64,float64,float64').reshape(-1),
+                                          hole.view('float64,float64,float64').reshape(-1),
+                                          return_indices=True)[1:]
+    order = np.argsort(ref_ekidx)
+
+    np.testing.assert_array_equal(ekidx, ref_ekidx[order])
+    np.testing.assert_array_equal(hkidx, ref_hkidx[order])
+    np.testing.assert_array_equal(elec[ekidx], hole[hkidx])
+
+    with pytest.raises(ValueError):
+        ppy.KGridIndex(elec, kdim).match(ppy.KGridIndex(np.zeros((1, 3)), (2, 2, 2)))
+
+
+def test_neighbor_table(kgrid_points):
+    """
+    Method to test the periodic neighbors on the full grid and on a subset of it.
+
+    """
+    kdim, kpoints = kgrid_points
+    kgrid = ppy.KGridIndex(kpoints, kdim)
+
+    neighbors = kgrid.neighbor_table()
+    assert neighbors.shape == (60, 3, 2)
+
+    for i in range(3):
+        shift = np.zeros(3)
+        shift[i] = 1.0 / kdim[i]
+        np.testing.assert_array_equal(neighbors[:, i, 0], kgrid.lookup(kpoints + shift))
+        np.testing.assert_array_equal(neighbors[:, i, 1], kgrid.lookup(kpoints - shift))
+
+    # Subset: the missing neighbors are -1
+    subset = ppy.KGridIndex(kpoints[:30], kdim)
+    sub_neighbors = subset.neighbor_table()
+
+    for i in range(3):
+        for j, sign in enumerate((1.0, -1.0)):
+            shift = np.zeros(3)
+            shift[i] = sign / kdim[i]
+            np.testing.assert_array_equal(sub_neighbors[:, i, j], subset.lookup(kpoints[:30] + shift))
+
+    assert np.any(sub_neighbors < 0)
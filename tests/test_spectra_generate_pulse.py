@@ -0,0 +1,177 @@
+import numpy as np
+import pytest
+import os
+import filecmp
+import h5py
+
+import perturbopy.postproc as ppy
+
+from perturbopy.postproc.utils.spectra_generate_pulse import gaussian_excitation, setup_pump_pulse, \
+    delta_occs_pulse_coef, sigma_from_fwhm
+
+
+@pytest.mark.parametrize("hole, keep_stride", [[False, None], [True, 1], [False, 3]])
+def test_gaussian_excitation(tmp_path, hole, keep_stride):
+    """
+    Method to test the streaming pulse writer against the full (num_bands, num_steps, num_k) array.
+
+    """
+    rng = np.random.default_rng(0)
+    occs_amplitude = rng.random((20, 3))
+    time_grid = np.arange(0, 11.0, 1.0)
+
+    with h5py.File(str(tmp_path / 'pulse.h5'), 'w') as f:
+        f.create_group('pump_pulse_snaps')
+        delta_occs_array = gaussian_excitation(f, occs_amplitude, time_grid, 10.0, 4.0, 1.0,
+                                               hole=hole, keep_stride=keep_stride)
+
+        profile = delta_occs_pulse_coef(time_grid, 1.0, 10.0, sigma_from_fwhm(4.0))
+        ref = np.einsum('t,jk->ktj', profile, occs_amplitude)
+        sign = -1 if hole else 1
+
+        assert len(f['pump_pulse_snaps']) == time_grid.size
+        for itime in range(time_grid.size):
+            np.testing.assert_array_equal(f[f'pump_pulse_snaps/pulse_snap_t_{itime + 1}'][()],
+                                          sign * ref[:, itime, :].T)
+
+    if keep_stride is None:
+        assert delta_occs_array is None
+    else:
+        np.testing.assert_array_equal(delta_occs_array, ref[:, ::keep_stride, :])
+
+
+@pytest.mark.parametrize("compression, storage_dtype", [['gzip', None], ['lzf', np.float32], [None, np.float32]])
+def test_gaussian_excitation_storage(tmp_path, compression, storage_dtype):
+    """
+    Method to test the compressed and single-precision pulse datasets.
+
+    """
+    rng = np.random.default_rng(0)
+    occs_amplitude = rng.random((200, 3))
+    occs_amplitude[occs_amplitude < 0.7] = 0.0
+    time_grid = np.arange(0, 11.0, 1.0)
+
+    with h5py.File(str(tmp_path / 'ref.h5'), 'w') as f_ref, h5py.File(str(tmp_path / 'pulse.h5'), 'w') as f:
+        for h5f in (f_ref, f):
+            h5f.create_group('pump_pulse_snaps')
+
+        gaussian_excitation(f_ref, occs_amplitude, time_grid, 10.0, 4.0, 1.0)
+        gaussian_excitation(f, occs_amplitude, time_grid, 10.0, 4.0, 1.0, compression=compression,
+                            shuffle=compression is not None, storage_dtype=storage_dtype)
+
+        rtol = 1e-6 if storage_dtype is not None else 0.0
+        for itime in range(1, time_grid.size + 1):
+            dset = f[f'pump_pulse_snaps/pulse_snap_t_{itime}']
+            assert dset.compression == compression
+            np.testing.assert_allclose(dset[()], f_ref[f'pump_pulse_snaps/pulse_snap_t_{itime}'][()], rtol=rtol)
+
+        stored_mb, raw_mb = ppy.cdyna_tools.storage_size(f['pump_pulse_snaps'], prefix='pulse_snap_t_')
+        stored_ref_mb, _ = ppy.cdyna_tools.storage_size(f_ref['pump_pulse_snaps'], prefix='pulse_snap_t_')
+
+        assert stored_ref_mb == raw_mb
+        assert stored_mb < stored_ref_mb
+
+    with pytest.raises(ValueError):
+        ppy.cdyna_tools.snap_dataset_options(compression='zstd')
+
+
+def test_setup_pump_pulse(elec_hole_runs, tmp_path):
+    """
+    Method to test the pump pulse files and the total occupations of the cnum_check files.
+
+    """
+    elec_dyna_run, hole_dyna_run = elec_hole_runs
+
+    elec_path = str(tmp_path / 'elec' / 'pump_pulse_elec.h5')
+    hole_path = str(tmp_path / 'hole' / 'pump_pulse_hole.h5')
+
+    pump_pulse = setup_pump_pulse(elec_path, hole_path, elec_dyna_run, hole_dyna_run, 3.5,
+                                  pump_spectral_width_fwhm=0.5, pump_time_window=10.0, pump_duration_fwhm=4.0,
+                                  animate=False, cnum_check=True)
+
+    assert pump_pulse.num_steps == 11
+
+    with h5py.File(elec_path, 'r') as f:
+        snaps = np.array([f[f'pump_pulse_snaps/pulse_snap_t_{i}'][()] for i in range(1, 12)])
+
+    assert np.max(snaps) > 0.0
+
+    with h5py.File(os.path.join(str(tmp_path / 'elec'), 'cnum_check', 'gaas_cdyna.h5'), 'r') as f:
+        np.testing.assert_allclose(f['dynamics_run_1/snap_t_0'][()], np.sum(snaps, axis=0), rtol=1e-12)
+
+
+def _assert_same_h5(path_1, path_2):
+    """
+    Method to check that two HDF5 files contain the same datasets and are byte-identical.
+
+    """
+    assert filecmp.cmp(path_1, path_2, shallow=False)
+
+    with h5py.File(path_1, 'r') as f1, h5py.File(path_2, 'r') as f2:
+        names_1, names_2 = [], []
+        f1.visit(names_1.append)
+        f2.visit(names_2.append)
+        assert sorted(names_1) == sorted(names_2)
+
+        for name in names_1:
+            if isinstance(f1[name], h5py.Dataset):
+                np.testing.assert_array_equal(f1[name][()], f2[name][()])
+                assert dict(f1[name].attrs) == dict(f2[name].attrs)
+
+
+@pytest.mark.parametrize("n_workers", [None, 2])
+def test_setup_pump_pulse_sweep(elec_hole_runs, tmp_path, n_workers):
+    """
+    Method to test that the pump energy sweep writes the same files as repeated setup_pump_pulse calls.
+
+    """
+    elec_dyna_run, hole_dyna_run = elec_hole_runs
+    pump_energies = [3.2, 3.5, 3.8]
+
+    kwargs = dict(pump_spectral_width_fwhm=0.5, pump_time_window=10.0, pump_duration_fwhm=4.0)
+
+    single_dir = tmp_path / 'single'
+    sweep_dir = tmp_path / 'sweep'
+    single_dir.mkdir()
+    sweep_dir.mkdir()
+
+    for pump_energy in pump_energies:
+        setup_pump_pulse(str(single_dir / f'elec_{pump_energy:.2f}.h5'), str(single_dir / f'hole_{pump_energy:.2f}.h5'),
+                         elec_dyna_run, hole_dyna_run, pump_energy, animate=False, cnum_check=False, **kwargs)
+
+    pump_pulses = ppy.spectra_generate_pulse.setup_pump_pulse_sweep(
+        pump_energies, str(sweep_dir / 'elec_{pump_energy:.2f}.h5'), str(sweep_dir / 'hole_{pump_energy:.2f}.h5'),
+        elec_dyna_run, hole_dyna_run, energy_chunk=2, n_workers=n_workers, **kwargs)
+
+    assert [pump_pulse.pump_energy for pump_pulse in pump_pulses] == pump_energies
+
+    for pump_energy in pump_energies:
+        for carrier in ['elec', 'hole']:
+            _assert_same_h5(str(single_dir / f'{carrier}_{pump_energy:.2f}.h5'),
+                            str(sweep_dir / f'{carrier}_{pump_energy:.2f}.h5'))
+
+    with pytest.raises(ValueError):
+        ppy.spectra_generate_pulse.setup_pump_pulse_sweep(pump_energies, str(sweep_dir / 'elec.h5'),
+                                                          str(sweep_dir / 'hole.h5'), elec_dyna_run, hole_dyna_run)
+
+
+def test_setup_pump_pulse_window(elec_hole_runs, tmp_path):
+    """
+    Method to test that evaluating only the transitions close to the pump energy gives the same pulse.
+
+    """
+    elec_dyna_run, hole_dyna_run = elec_hole_runs
+
+    kwargs = dict(pump_spectral_width_fwhm=0.2, pump_time_window=10.0, pump_duration_fwhm=4.0,
+                  animate=False, cnum_check=False)
+
+    paths = {}
+    for num_sigma in [None, 6.0]:
+        paths[num_sigma] = [str(tmp_path / f'{carrier}_{num_sigma}.h5') for carrier in ['elec', 'hole']]
+        setup_pump_pulse(*paths[num_sigma], elec_dyna_run, hole_dyna_run, 3.2, num_sigma=num_sigma, **kwargs)
+
+    for ifile in range(2):
+        with h5py.File(paths[None][ifile], 'r') as f_ref, h5py.File(paths[6.0][ifile], 'r') as f:
+            for itime in range(1, 12):
+                name = f'pump_pulse_snaps/pulse_snap_t_{itime}'
+                np.testing.assert_allclose(f[name][()], f_ref[name][()], rtol=1e-12, atol=1e-9)
@@ -0,0 +1,232 @@
+import numpy as np
+import pytest
+import os
+import shutil
+import h5py
+
+import perturbopy.postproc as ppy
+from perturbopy.postproc.utils.spectra_trans_abs import compute_trans_abs, gaussian_delta
+
+
+def reference_trans_abs(elec_dyna_run, hole_dyna_run, energy_grid, eta):
+    """
+    Method to compute the transient absorption with explicit loops over bands, energies and time steps.
+
+    """
+    ryd2ev = ppy.constants.energy_conversion_factor('Ry', 'eV')
+    elec_energy = elec_dyna_run._energies * ryd2ev
+    hole_energy = hole_dyna_run._energies * ryd2ev
+
+    ekidx, hkidx = np.intersect1d(
+        elec_dyna_run._kpoints.view('float64,float64,float64').reshape(-1),
+        hole_dyna_run._kpoints.view('float64,float64,float64').reshape(-1),
+        return_indices=True)[1:]
+    num_k = ekidx.size
+
+    num_steps = elec_dyna_run[1].num_steps
+    dA_elec = np.zeros((energy_grid.size, num_steps))
+    dA_hole = np.zeros((energy_grid.size, num_steps))
+
+    for istep in range(num_steps):
+        e_occs = -elec_dyna_run._cdyna_file[f'dynamics_run_1/snap_t_{istep}'][()][ekidx, :]
+        h_occs = -(1.0 - hole_dyna_run._cdyna_file[f'dynamics_run_1/snap_t_{istep}'][()][hkidx, :])
+        for iband in range(elec_energy.shape[1]):
+            for jband in range(hole_energy.shape[1]):
+                for ienergy, energy in enumerate(energy_grid):
+                    delta = 2.0 * gaussian_delta(elec_energy[ekidx, iband] - hole_energy[hkidx, jband], energy, eta)
+                    dA_elec[ienergy, istep] += np.sum(e_occs[:, iband] * delta) / num_k
+                    dA_hole[ienergy, istep] += np.sum(h_occs[:, jband] * delta) / num_k
+
+    return dA_elec, dA_hole
+
+
+@pytest.mark.parametrize("memory_budget_mb", [1024.0, 1e-3])
+def test_compute_trans_abs(elec_hole_runs, memory_budget_mb):
+    """
+    Method to test compute_trans_abs against the explicit loops, for one and many energy blocks.
+
+    """
+    elec_dyna_run, hole_dyna_run = elec_hole_runs
+    energies_before = elec_dyna_run._energies.copy()
+
+    time_grid, energy_grid, dA_elec, dA_hole = compute_trans_abs(elec_dyna_run, hole_dyna_run,
+                                                                 de_grid=0.05, eta=0.1, save_npy=False,
+                                                                 memory_budget_mb=memory_budget_mb)
+
+    ref_elec, ref_hole = reference_trans_abs(elec_dyna_run, hole_dyna_run, energy_grid, 0.1)
+
+    assert dA_elec.shape == (energy_grid.size, time_grid.size)
+    np.testing.assert_allclose(dA_elec, ref_elec, rtol=1e-10, atol=1e-12)
+    np.testing.assert_allclose(dA_hole, ref_hole, rtol=1e-10, atol=1e-12)
+
+    # The raw energies of the DynaRun objects are not modified
+    np.testing.assert_array_equal(elec_dyna_run._energies, energies_before)
+
+
+@pytest.mark.parametrize("track_memory", [False, True])
+def test_compute_trans_abs_track_memory(elec_hole_runs, capsys, track_memory):
+    """
+    Method to test that the peak memory is only recorded on request.
+
+    """
+    elec_dyna_run, hole_dyna_run = elec_hole_runs
+
+    compute_trans_abs(elec_dyna_run, hole_dyna_run, de_grid=0.05, eta=0.1, save_npy=False,
+                      track_memory=track_memory)
+
+    assert ('Peak mem (MB)' in capsys.readouterr().out) == track_memory
+
+
+@pytest.mark.parametrize("bin_width", [None, 0.002])
+def test_compute_trans_abs_binned(elec_hole_runs, bin_width):
+    """
+    Method to test the histogram-plus-convolution method against the exact Gaussian sum, within its error bound.
+
+    """
+    elec_dyna_run, hole_dyna_run = elec_hole_runs
+    eta = 0.1
+
+    kwargs = dict(de_grid=0.05, eta=eta, save_npy=False)
+    _, _, exact_elec, exact_hole = compute_trans_abs(elec_dyna_run, hole_dyna_run, method='exact', **kwargs)
+    _, _, dA_elec, dA_hole = compute_trans_abs(elec_dyna_run, hole_dyna_run, method='binned',
+                                               bin_width=bin_width, **kwargs)
+
+    # Error bound per unit weight; occupations are in [0, 1], spin factor 2, sum over 2 x 3 band pairs
+    h = 0.05 / np.ceil(0.05 / (eta / 10 if bin_width is None else bin_width))
+    bound = 2 * 6 / (np.sqrt(2 * np.pi) * eta) * ((h / eta)**2 / 8 + np.exp(-6.0**2 / 2))
+
+    assert np.max(np.abs(dA_elec - exact_elec)) < bound
+    assert np.max(np.abs(dA_hole - exact_hole)) < bound
+    assert np.max(np.abs(dA_elec - exact_elec)) < 1e-2 * np.max(np.abs(exact_elec))
+
+    with pytest.raises(ValueError):
+        compute_trans_abs(elec_dyna_run, hole_dyna_run, method='histogram', **kwargs)
+
+
+@pytest.mark.parametrize("method", ['exact', 'binned'])
+def test_compute_trans_abs_time_chunks(elec_hole_runs, method):
+    """
+    Method to test that streaming the occupations in time windows gives the same spectrum.
+
+    """
+    elec_dyna_run, hole_dyna_run = elec_hole_runs
+
+    kwargs = dict(de_grid=0.05, eta=0.1, save_npy=False, method=method)
+    _, _, ref_elec, ref_hole = compute_trans_abs(elec_dyna_run, hole_dyna_run, **kwargs)
+
+    # 64 k-points x 5 bands x 8 bytes = 2.5 KB per step: windows of 2 steps
+    _, _, dA_elec, dA_hole = compute_trans_abs(elec_dyna_run, hole_dyna_run, occs_memory_mb=5.5e-3, **kwargs)
+
+    np.testing.assert_allclose(dA_elec, ref_elec, rtol=1e-12, atol=1e-14)
+    np.testing.assert_allclose(dA_hole, ref_hole, rtol=1e-12, atol=1e-14)
+
+
+def test_compute_trans_abs_workers(elec_hole_runs, capsys):
+    """
+    Method to test the process-pool parallelization over k-point shards, and the merged shard timings.
+
+    """
+    elec_dyna_run, hole_dyna_run = elec_hole_runs
+
+    kwargs = dict(de_grid=0.05, eta=0.1, save_npy=False)
+    _, _, ref_elec, ref_hole = compute_trans_abs(elec_dyna_run, hole_dyna_run, **kwargs)
+    capsys.readouterr()
+    _, _, dA_elec, dA_hole = compute_trans_abs(elec_dyna_run, hole_dyna_run, n_workers=3,
+                                               occs_memory_mb=5.5e-3, **kwargs)
+
+    np.testing.assert_allclose(dA_elec, ref_elec, rtol=1e-10, atol=1e-14)
+    np.testing.assert_allclose(dA_hole, ref_hole, rtol=1e-10, atol=1e-14)
+
+    out = capsys.readouterr().out
+    for ishard in range(3):
+        assert f'shard {ishard} total' in out
+        assert f'shard {ishard} read occupations' in out
+        assert f'shard {ishard} compute trans. abs.' in out
+
+
+def test_compute_trans_abs_incremental(elec_hole_runs, tmp_path):
+    """
+    Method to test the incremental mode: a partially written run, then the full run, appended to a result file.
+
+    """
+    elec_dyna_run, hole_dyna_run = elec_hole_runs
+
+    kwargs = dict(de_grid=0.05, eta=0.1, save_npy=False)
+    ref_time, _, ref_elec, ref_hole = compute_trans_abs(elec_dyna_run, hole_dyna_run, **kwargs)
+
+    # Simulation still running: only snap_t_0 to snap_t_2 written for the electrons
+    cdyna_path = elec_dyna_run._cdyna_file.filename
+    partial_path = str(tmp_path / 'partial_cdyna.h5')
+    shutil.copy(cdyna_path, partial_path)
+
+    with h5py.File(partial_path, 'a') as f:
+        for istep in range(3, 7):
+            del f[f'dynamics_run_1/snap_t_{istep}']
+
+    partial_dyna_run = ppy.DynaRun.from_hdf5_yaml(partial_path, elec_dyna_run._tet_file.filename,
+                                                  str(tmp_path / 'elec' / 'gaas_dynamics-run.yml'), read_snaps=False)
+
+    result_path = str(tmp_path / 'trans_abs.h5')
+    time_grid, _, dA_elec, dA_hole = compute_trans_abs(partial_dyna_run, hole_dyna_run, result_path=result_path,
+                                                       **kwargs)
+    partial_dyna_run.close_hdf5_files()
+
+    np.testing.assert_allclose(time_grid, ref_time[:3])
+    np.testing.assert_allclose(dA_elec, ref_elec[:, :3], rtol=1e-12, atol=1e-14)
+
+    # Only the new steps are computed and appended
+    time_grid, _, dA_elec, dA_hole = compute_trans_abs(elec_dyna_run, hole_dyna_run, result_path=result_path,
+                                                       **kwargs)
+
+    np.testing.assert_allclose(time_grid, ref_time)
+    np.testing.assert_allclose(dA_elec, ref_elec, rtol=1e-12, atol=1e-14)
+    np.testing.assert_allclose(dA_hole, ref_hole, rtol=1e-12, atol=1e-14)
+
+    with h5py.File(result_path, 'r') as f:
+        assert f.attrs['last_step'] == ref_time.size - 1
+
+    with pytest.raises(ValueError):
+        compute_trans_abs(elec_dyna_run, hole_dyna_run, result_path=result_path, de_grid=0.05, eta=0.2,
+                          save_npy=False)
+
+
+def test_compute_trans_abs_float32(elec_hole_runs):
+    """
+    Method to test the transient absorption with the float32 transition energy tensor.
+
+    """
+    elec_dyna_run, hole_dyna_run = elec_hole_runs
+
+    kwargs = dict(de_grid=0.05, eta=0.1, save_npy=False)
+    _, _, ref_elec, ref_hole = compute_trans_abs(elec_dyna_run, hole_dyna_run, **kwargs)
+    _, _, dA_elec, dA_hole = compute_trans_abs(elec_dyna_run, hole_dyna_run, trans_energies_dtype=np.float32,
+                                               **kwargs)
+
+    np.testing.assert_allclose(dA_elec, ref_elec, rtol=1e-4, atol=1e-6 * np.max(np.abs(ref_elec)))
+    np.testing.assert_allclose(dA_hole, ref_hole, rtol=1e-4, atol=1e-6 * np.max(np.abs(ref_hole)))
+
+
+@pytest.mark.parametrize("num_sigma, memory_budget_mb", [[4.0, 1024.0], [6.0, 1e-3]])
+def test_compute_trans_abs_window(elec_hole_runs, num_sigma, memory_budget_mb):
+    """
+    Method to test the pruning of the transitions far from the probe energies, within its error bound.
+
+    """
+    elec_dyna_run, hole_dyna_run = elec_hole_runs
+    eta = 0.1
+
+    kwargs = dict(de_grid=0.05, eta=eta, save_npy=False, memory_budget_mb=memory_budget_mb)
+
+    # Restrict the probe window to the lower half of the transitions
+    trans_energies = ppy.TransitionEnergies.from_dyna_runs(elec_dyna_run, hole_dyna_run).energies
+    energy_grid_max = 0.5 * (np.min(trans_energies) + np.max(trans_energies))
+    _, _, ref_elec, ref_hole = compute_trans_abs(elec_dyna_run, hole_dyna_run, energy_grid_max=energy_grid_max,
+                                                 **kwargs)
+    _, _, dA_elec, dA_hole = compute_trans_abs(elec_dyna_run, hole_dyna_run, energy_grid_max=energy_grid_max,
+                                               num_sigma=num_sigma, occs_memory_mb=5.5e-3, **kwargs)
+
+    # Per unit weight; occupations are in [0, 1], spin factor 2, sum over 2 x 3 band pairs
+    bound = 2 * 6 / (np.sqrt(2 * np.pi) * eta) * np.exp(-num_sigma**2 / 2)
+
+    assert np.max(np.abs(dA_elec - ref_elec)) < bound
+    assert np.max(np.abs(dA_hole - ref_hole)) < bound
@@ -1,6 +1,7 @@
 import numpy as np
 import pytest
 import os
+import h5py
 
 import perturbopy.postproc as ppy
 
@@ -53,3 +54,43 @@ def test_spectral_cum():
     np.testing.assert_equal(model.Akw.shape, (1, 3, 2, 3001))
     np.testing.assert_equal(model.freq_array.shape, (3001,))
 
+
+@pytest.mark.parametrize("cache_size", [0, 2])
+def test_spectral_cum_lazy(tmp_path, cache_size):
+    """
+    Method to test the lazy AkwArray against the eager Akw, on a file with several k-points.
+
+    """
+    yml_path = os.path.join("refs", "sto_spectral-cum.yml")
+    spectral_path = str(tmp_path / "sto_spectral_cumulant.h5")
+
+    rng = np.random.default_rng(0)
+
+    with h5py.File(os.path.join("refs", "sto_spectral_cumulant.h5"), 'r') as ref, h5py.File(spectral_path, 'w') as f:
+        for key in ref.keys():
+            ref.copy(key, f)
+        shape = f['spectral_functions/kpt_1'].shape
+        for ik in range(2, 6):
+            f['spectral_functions'].create_dataset(f'kpt_{ik}', data=rng.random(shape))
+
+    eager = ppy.SpectralCumulant.from_hdf5_yaml(spectral_path, yml_path)
+    lazy = ppy.SpectralCumulant.from_hdf5_yaml(spectral_path, yml_path, lazy=True, cache_size=cache_size)
+
+    assert isinstance(eager.Akw, np.ndarray)
+    assert isinstance(lazy.Akw, ppy.AkwArray)
+    assert lazy.Akw.shape == eager.Akw.shape == (5, 3, 2, 3001)
+    assert len(lazy.Akw) == 5
+
+    for key in [(Ellipsis,), 3, (-1, 2, 1), (slice(None, None, -2), 0), ([4, 1, 4], slice(None), 1, slice(0, 10)),
+                (slice(1, 4), [0, 2], [1, 0]), ([0, 3], [0, 2], 1),
+                (1, slice(None), [0, 1], 5)]:
+        np.testing.assert_array_equal(lazy.Akw[key], eager.Akw[key])
+
+    np.testing.assert_array_equal(np.asarray(lazy.Akw), eager.Akw)
+    assert len(lazy.Akw._cache) <= cache_size
+
+    lazy.close_hdf5_files()
+    lazy.close_hdf5_files()
+
+    with pytest.raises(ValueError, match='closed'):
+        lazy.Akw[0]
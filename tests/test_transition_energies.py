@@ -0,0 +1,68 @@
+import numpy as np
+import pytest
+
+import perturbopy.postproc as ppy
+from perturbopy.postproc.utils.lineshapes import gaussian
+
+
+def test_from_dyna_runs(elec_hole_runs):
+    """
+    Method to test the transition energy tensor and its caching on the electron DynaRun object.
+
+    """
+    elec_dyna_run, hole_dyna_run = elec_hole_runs
+    ryd2ev = ppy.constants.energy_conversion_factor('Ry', 'eV')
+
+    trans = ppy.TransitionEnergies.from_dyna_runs(elec_dyna_run, hole_dyna_run)
+
+    assert trans.shape == (2, 3, 64)
+    assert ppy.TransitionEnergies.from_dyna_runs(elec_dyna_run, hole_dyna_run) is trans
+
+    for iband in range(2):
+        for jband in range(3):
+            np.testing.assert_allclose(trans.energies[iband, jband],
+                                       (elec_dyna_run._energies[trans.ekidx, iband] -
+                                        hole_dyna_run._energies[trans.hkidx, jband]) * ryd2ev)
+
+    trans_32 = ppy.TransitionEnergies.from_dyna_runs(elec_dyna_run, hole_dyna_run, dtype=np.float32)
+
+    assert trans_32 is not trans
+    assert trans_32.energies.dtype == np.float32
+    np.testing.assert_allclose(trans_32.energies, trans.energies, rtol=1e-6)
+
+
+@pytest.mark.parametrize("num_sigma", [None, 8.0])
+def test_excitation(elec_hole_runs, num_sigma):
+    """
+    Method to test the broadcasted excitation kernel against the loops over the band pairs.
+
+    """
+    elec_dyna_run, hole_dyna_run = elec_hole_runs
+    trans = ppy.TransitionEnergies.from_dyna_runs(elec_dyna_run, hole_dyna_run)
+
+    rng = np.random.default_rng(0)
+    weights = rng.random(trans.shape)
+    pump_energies = np.array([3.4, 3.6])
+    sigma = 0.1
+
+    elec_occs, hole_occs = trans.excitation(pump_energies, sigma, factor=0.3, weights=weights, num_sigma=num_sigma)
+
+    for ienergy, pump_energy in enumerate(pump_energies):
+        ref_elec = np.zeros((trans.num_elec_kpoints, 2))
+        ref_hole = np.zeros((trans.num_hole_kpoints, 3))
+
+        for iband in range(2):
+            for jband in range(3):
+                delta = 0.3 * gaussian(trans.energies[iband, jband], pump_energy, sigma) * weights[iband, jband]
+                ref_elec[trans.ekidx, iband] += delta
+                ref_hole[trans.hkidx, jband] += delta
+
+        # The window drops the Gaussian tails below exp(-num_sigma^2 / 2)
+        atol = 1e-12 if num_sigma is None else 6 * 0.3 * np.exp(-num_sigma**2 / 2)
+        np.testing.assert_allclose(elec_occs[ienergy], ref_elec, rtol=1e-12, atol=atol)
+        np.testing.assert_allclose(hole_occs[ienergy], ref_hole, rtol=1e-12, atol=atol)
+
+    if num_sigma is not None:
+        iband, jband, ik = trans.window(pump_energies, sigma, num_sigma)
+        assert ik.size < trans.energies.size
+        assert np.all(np.abs(trans.energies[iband, jband, ik] - 3.5) <= 0.1 + num_sigma * sigma)